@@ -0,0 +1,291 @@
+"""
+Batch analysis: many positions at once as NumPy arrays, and an evaluator that scores the whole batch with
+array operations.
+
+encodeSquares turns game states (either backend) or FEN strings into an (N, 64) array of piece indices
+(ChessEngine.pieceCodes order, square r * 8 + c) and the side to move. The Python work per position is a
+couple of string joins: a game state's rows are joined into one 128 character string (two per square), a FEN
+placement has its digits expanded with str.translate, and every check and lookup after that (rank lengths, piece
+letters) runs on the whole batch.
+encodePlanes gives the usual network input from the same data: (N, 12, 8, 8) one-hot planes, one per piece
+code in pieceCodes order, and the side to move (1 white, 0 black).
+
+evaluateBatch scores every position from the point of view of the side to move:
+    material and piece-square tables, tapered by game phase: the ChessEval tables, so without mobility the
+    result is exactly ChessEval.evaluateFull
+    mobility: squares attacked by knights, bishops, rooks and queens and not held by their own side, white
+    minus black, times mobilityWeight. Attacks are worked out on 64-bit boards for the whole batch at once
+    (all 13 built by one packbits), sliders with occluded fills (three shifts per direction)
+
+Usage (from the project root):
+    python -m Chess.ChessBatch                        # throughput on 100000 positions from random games
+    python -m Chess.ChessBatch --input positions.epd -o scores.txt
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from Chess import ChessEngine
+from Chess.ChessEval import middlegameTable, endgameTable, phaseTable, FULL_PHASE, evaluateFull
+from Chess.ChessPgn import STANDARD_FEN
+
+MOBILITY_WEIGHT = 2  # Centipawns per attacked square
+
+# Piece index by the two characters of a piece code, and by FEN letter ('.' = empty square)
+_codeIndex = np.zeros((256, 256), dtype=np.uint8)
+_letterIndex = np.full(256, 255, dtype=np.uint8)  # 255: not a piece letter
+_letterIndex[ord('.')] = 0
+for _index, _piece in enumerate(ChessEngine.pieceCodes[1:], 1):
+    _codeIndex[ord(_piece[0]), ord(_piece[1])] = _index
+    _letter = _piece[1].upper() if _piece[1] != 'p' else 'P'
+    _letterIndex[ord(_letter if _piece[0] == 'w' else _letter.lower())] = _index
+_expandDigits = str.maketrans({str(n): "." * n for n in range(1, 9)})
+
+_middlegame = np.array(middlegameTable, dtype=np.int32)  # (13, 64), signed, material included
+_endgame = np.array(endgameTable, dtype=np.int32)
+_phase = np.array(phaseTable, dtype=np.int32)
+_squareNumbers = np.arange(64)
+
+"""
+# (squares (N, 64) uint8 piece indices, whiteToMove (N,) bool) for a list of game states and/or FEN strings
+# Raises ValueError for a FEN whose placement is not 8 ranks of 8 squares
+"""
+
+
+def encodeSquares(positions):
+    count = len(positions)
+    squares = np.empty((count, 64), dtype=np.uint8)
+    whiteToMove = np.empty(count, dtype=bool)
+    stateRows, stateText, fenRows, fenText = [], [], [], []
+    for i, position in enumerate(positions):
+        if isinstance(position, str):
+            fields = position.split()
+            placement = fields[0].translate(_expandDigits)
+            if len(placement) != 71:  # The rank ends are checked below for the whole batch
+                raise ValueError("position %d: placement is not 8 ranks of 8 squares: %s" % (i, fields[0]))
+            fenRows.append(i)
+            fenText.append(placement)
+            whiteToMove[i] = len(fields) < 2 or fields[1] == 'w'
+        else:
+            stateRows.append(i)
+            stateText.append("".join(["".join(row) for row in position.board]))
+            whiteToMove[i] = position.whiteToMove
+    if stateRows:
+        chars = np.frombuffer("".join(stateText).encode("ascii"), dtype=np.uint8).reshape(-1, 64, 2)
+        squares[stateRows] = _codeIndex[chars[:, :, 0], chars[:, :, 1]]
+    if fenRows:
+        # Joined with one more '/' a good placement is 8 ranks of 8 squares each followed by a '/', like
+        # ChessEngine.parsePlacement every rank has to end there
+        ranks = np.frombuffer(("/".join(fenText) + "/").encode("ascii"), dtype=np.uint8).reshape(-1, 8, 9)
+        bad = np.flatnonzero((ranks[:, :, 8] != ord("/")).any(axis=1))
+        if len(bad):
+            raise ValueError("position %d: placement is not 8 ranks of 8 squares: %s" % (
+                fenRows[bad[0]], positions[fenRows[bad[0]]].split()[0]))
+        indices = _letterIndex[ranks[:, :, :8].reshape(-1, 64)]
+        bad = np.flatnonzero((indices == 255).any(axis=1))
+        if len(bad):
+            raise ValueError("position %d: unknown piece letter in %s" % (fenRows[bad[0]], positions[fenRows[bad[0]]]))
+        squares[fenRows] = indices
+    return squares, whiteToMove
+
+
+"""
+# (planes (N, 12, 8, 8), sideToMove (N,)) in 'dtype', planes in pieceCodes order, sideToMove 1 for white
+"""
+
+
+def encodePlanes(positions, dtype=np.uint8):
+    squares, whiteToMove = encodeSquares(positions)
+    return toPlanes(squares, dtype), whiteToMove.astype(dtype)
+
+
+def toPlanes(squares, dtype=np.uint8):
+    pieces = np.arange(1, 13, dtype=np.uint8).reshape(1, 12, 1)
+    return (squares[:, None, :] == pieces).astype(dtype).reshape(-1, 12, 8, 8)
+
+
+_pieceNumbers = np.arange(13, dtype=np.uint8).reshape(1, 13, 1)
+
+"""
+# 64-bit boards (N, 13) uint64, column p holds the squares of piece index p (column 0 the empty squares)
+# One comparison and one packbits for all pieces at once
+"""
+
+
+def _pieceBoards(squares):
+    bits = squares[:, None, :] == _pieceNumbers
+    return np.packbits(bits, axis=2, bitorder="little").view("<u8").reshape(-1, 13)
+
+
+_FULL = np.uint64((1 << 64) - 1)
+_NOT_FILE_A = np.uint64(sum(1 << sq for sq in range(64) if sq & 7 != 0))
+_NOT_FILE_H = np.uint64(sum(1 << sq for sq in range(64) if sq & 7 != 7))
+_NOT_FILES_AB = np.uint64(sum(1 << sq for sq in range(64) if sq & 7 > 1))
+_NOT_FILES_GH = np.uint64(sum(1 << sq for sq in range(64) if sq & 7 < 6))
+
+
+def _shift(bits, amount):
+    if amount > 0:
+        return np.left_shift(bits, np.uint64(amount))
+    return np.right_shift(bits, np.uint64(-amount))
+
+
+"""
+# Squares attacked along one direction (a shift and the mask of squares it may land on) by the pieces in
+# 'sliders', blocked by the occupied squares (Kogge-Stone occluded fill)
+"""
+
+
+def _slide(sliders, empty, amount, mask):
+    empty = empty & mask
+    sliders = sliders | (empty & _shift(sliders, amount))
+    empty = empty & _shift(empty, amount)
+    sliders = sliders | (empty & _shift(sliders, 2 * amount))
+    empty = empty & _shift(empty, 2 * amount)
+    sliders = sliders | (empty & _shift(sliders, 4 * amount))
+    return _shift(sliders, amount) & mask
+
+
+# (shift, landing mask): r * 8 + c indexing, so +1 is one file right and +8 one rank down
+_ORTHOGONAL = ((8, _FULL), (-8, _FULL), (1, _NOT_FILE_A), (-1, _NOT_FILE_H))
+_DIAGONAL = ((9, _NOT_FILE_A), (7, _NOT_FILE_H), (-7, _NOT_FILE_A), (-9, _NOT_FILE_H))
+_KNIGHT = ((17, _NOT_FILE_A), (15, _NOT_FILE_H), (10, _NOT_FILES_AB), (6, _NOT_FILES_GH),
+           (-15, _NOT_FILE_A), (-17, _NOT_FILE_H), (-6, _NOT_FILES_AB), (-10, _NOT_FILES_GH))
+
+
+def _popcount(bits):
+    if hasattr(np, "bitwise_count"):  # NumPy 2
+        return np.bitwise_count(bits).astype(np.int32)
+    return np.unpackbits(bits.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1, dtype=np.int32)
+
+
+"""
+# Squares attacked by the knights, bishops, rooks and queens of one side and not held by that side, (N,) int32
+# boards: _pieceBoards, first: piece index of the side's pawn (1 white, 7 black), the others follow in pieceCodes order
+"""
+
+
+def _mobility(boards, first):
+    empty = boards[:, 0]
+    knights = boards[:, first + 1]
+    diagonal = boards[:, first + 2] | boards[:, first + 4]
+    orthogonal = boards[:, first + 3] | boards[:, first + 4]
+    own = np.bitwise_or.reduce(boards[:, first:first + 6], axis=1)
+    attacks = np.zeros(len(boards), dtype=np.uint64)
+    for amount, mask in _KNIGHT:
+        attacks |= _shift(knights, amount) & mask
+    for amount, mask in _DIAGONAL:
+        attacks |= _slide(diagonal, empty, amount, mask)
+    for amount, mask in _ORTHOGONAL:
+        attacks |= _slide(orthogonal, empty, amount, mask)
+    return _popcount(attacks & ~own)
+
+
+"""
+# Scores (N,) int32 of encoded positions for the side to move, see the module description
+"""
+
+
+def evaluateBatch(squares, whiteToMove, mobilityWeight=MOBILITY_WEIGHT):
+    middlegame = _middlegame[squares, _squareNumbers].sum(axis=1)
+    endgame = _endgame[squares, _squareNumbers].sum(axis=1)
+    phase = np.minimum(_phase[squares].sum(axis=1), FULL_PHASE)
+    score = (middlegame * phase + endgame * (FULL_PHASE - phase)) // FULL_PHASE
+    if mobilityWeight:
+        boards = _pieceBoards(squares)
+        score += mobilityWeight * (_mobility(boards, 1) - _mobility(boards, 7))
+    return np.where(whiteToMove, score, -score).astype(np.int32)
+
+
+"""
+# FENs of 'count' positions from random games, for benchmarks
+"""
+
+
+def randomPositions(count, seed=1, maxPlies=80, backend="string"):
+    rng = random.Random(seed)
+    fens = []
+    gs = ChessEngine.newGameState(backend)
+    while len(fens) < count:
+        gs.setFen(STANDARD_FEN)
+        for _ in range(maxPlies):
+            codes = gs.getValidMoveCodes()
+            if len(codes) == 0 or len(fens) >= count:
+                break
+            gs.makeMoveCode(rng.choice(codes))
+            fens.append(gs.getFen())
+    return fens
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encode and score positions in NumPy batches")
+    parser.add_argument("--input", help="File with one FEN/EPD position per line (default: random positions)")
+    parser.add_argument("-o", "--output", help="Write one score per line here (with --input)")
+    parser.add_argument("-n", "--positions", type=int, default=100000, help="Benchmark batch size")
+    parser.add_argument("--batch", type=int, default=100000, help="Positions per batch with --input")
+    parser.add_argument("--mobility", type=int, default=MOBILITY_WEIGHT, help="Centipawns per attacked square")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        output = open(args.output, "w") if args.output else None
+        total = 0
+        start = time.perf_counter()
+        with open(args.input) as f:
+            lines = (line.strip() for line in f)
+            while True:
+                batch = [line for _, line in zip(range(args.batch), lines) if line and not line.startswith("#")]
+                if not batch:
+                    break
+                squares, whiteToMove = encodeSquares(batch)
+                scores = evaluateBatch(squares, whiteToMove, args.mobility)
+                total += len(batch)
+                if output is not None:
+                    output.write("\n".join(map(str, scores.tolist())) + "\n")
+        if output is not None:
+            output.close()
+        elapsed = time.perf_counter() - start
+        print("%d positions in %.2fs (%.0f positions/s)" % (total, elapsed, total / elapsed if elapsed > 0 else 0))
+        return 0
+
+    distinct = randomPositions(min(args.positions, 5000))
+    fens = [distinct[i % len(distinct)] for i in range(args.positions)]
+    states = []
+    for fen in distinct:
+        gs = ChessEngine.newGameState()
+        gs.setFen(fen)
+        states.append(gs)
+    states = [states[i % len(states)] for i in range(args.positions)]
+
+    # The batch evaluation without mobility has to match evaluateFull exactly
+    squares, whiteToMove = encodeSquares(states[:len(distinct)])
+    scores = evaluateBatch(squares, whiteToMove, 0)
+    mismatches = sum(1 for gs, score in zip(states, scores.tolist()) if evaluateFull(gs) != score)
+    print("check: %d positions, %d mismatches against ChessEval.evaluateFull" % (len(distinct), mismatches))
+
+    def timed(name, function):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        print("%-24s %7.3fs  %9.0f positions/s" % (name, elapsed, args.positions / elapsed))
+        return result
+
+    timed("encode game states", lambda: encodeSquares(states))
+    squares, whiteToMove = timed("encode FEN strings", lambda: encodeSquares(fens))
+    timed("planes (N, 12, 8, 8)", lambda: toPlanes(squares))
+    timed("evaluate", lambda: evaluateBatch(squares, whiteToMove, args.mobility))
+    timed("encode + evaluate", lambda: evaluateBatch(*encodeSquares(states), args.mobility))
+    sample = states[:2000]
+    start = time.perf_counter()
+    for gs in sample:
+        evaluateFull(gs)
+    elapsed = time.perf_counter() - start
+    print("%-24s %7.3fs  %9.0f positions/s (one at a time, no mobility)" % (
+        "evaluateFull", elapsed, len(sample) / elapsed))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
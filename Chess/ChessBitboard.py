@@ -0,0 +1,508 @@
+"""
+Bitboard backend for the game state.
+
+Every piece type of every color is stored as a 64-bit integer where bit (r * 8 + c) is set
+when that piece stands on row r, column c (row 0 is rank 8, same layout as GameState.board).
+Exposes the same surface as ChessEngine.GameState (board, whiteToMove, moveLog,
+getValidMoves, getValidMoveCodes, makeMove, makeMoveCode, undoMove) so ChessMain and the tools
+can use either backend. Moves use the packed codes of ChessEngine.encodeMove.
+Pick the backend with ChessEngine.newGameState("bitboard").
+"""
+from array import array
+
+from Chess.ChessMetrics import clock
+from Chess.ChessEngine import MoveCache, MoveList, MoveLog, pieceCodes, pieceIndex, computeZobristKey, zobristMoveKey, \
+    captureOrder, orderMoves, checkKings, parseFen, positionFen
+
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+ROW_5 = 0xFF << 40  # Rank 3, where white's single pawn pushes land before a double push
+ROW_2 = 0xFF << 16  # Rank 6, same for black
+
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+# Piece code used by the string board -> (color, piece type)
+# ChessEngine.pieceIndex uses the same order, so its index is 1 + color * 6 + piece type
+PIECE_INDEX = {color + piece: (ci, pi)
+               for ci, color in enumerate("wb")
+               for pi, piece in enumerate(["p", "N", "B", "R", "Q", "K"])}
+
+# Square index -> (row, col)
+SQUARES = [(sq // 8, sq % 8) for sq in range(64)]
+
+# (row step, col step) of each ray direction, index < 4 are straight, the rest diagonal
+RAY_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+STRAIGHT = range(0, 4)
+DIAGONAL = range(4, 8)
+# A direction walks towards higher square indices when it goes down or right on the same row
+RAY_POSITIVE = [dr > 0 or (dr == 0 and dc > 0) for dr, dc in RAY_DIRECTIONS]
+
+
+def _stepMask(sq, steps):
+    r, c = SQUARES[sq]
+    mask = 0
+    for dr, dc in steps:
+        if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+            mask |= 1 << ((r + dr) * 8 + c + dc)
+    return mask
+
+
+def _ray(sq, d):
+    r, c = SQUARES[sq]
+    dr, dc = RAY_DIRECTIONS[d]
+    mask = 0
+    r, c = r + dr, c + dc
+    while 0 <= r <= 7 and 0 <= c <= 7:
+        mask |= 1 << (r * 8 + c)
+        r, c = r + dr, c + dc
+    return mask
+
+
+KNIGHT_ATTACKS = [_stepMask(sq, [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+                  for sq in range(64)]
+KING_ATTACKS = [_stepMask(sq, RAY_DIRECTIONS) for sq in range(64)]
+# Squares a pawn of the given color on sq attacks
+PAWN_ATTACKS = [[_stepMask(sq, [(-1, -1), (-1, 1)]) for sq in range(64)],
+                [_stepMask(sq, [(1, -1), (1, 1)]) for sq in range(64)]]
+RAYS = [[_ray(sq, d) for sq in range(64)] for d in range(8)]
+
+# Squares strictly between two squares on a shared line, 0 if they do not share one
+BETWEEN = [[0] * 64 for _ in range(64)]
+# Direction index from the first square to the second, -1 if they do not share a line
+LINE_DIRECTION = [[-1] * 64 for _ in range(64)]
+for _sq in range(64):
+    for _d in range(8):
+        _rayBits = RAYS[_d][_sq]
+        while _rayBits:
+            _bit = _rayBits & -_rayBits
+            _target = _bit.bit_length() - 1
+            BETWEEN[_sq][_target] = RAYS[_d][_sq] & ~RAYS[_d][_target] & ~_bit
+            LINE_DIRECTION[_sq][_target] = _d
+            _rayBits ^= _bit
+
+
+def rayAttacks(d: int, sq: int, occupied: int):
+    ray = RAYS[d][sq]
+    blockers = ray & occupied
+    if blockers:
+        if RAY_POSITIVE[d]:
+            first = (blockers & -blockers).bit_length() - 1
+        else:
+            first = blockers.bit_length() - 1
+        ray ^= RAYS[d][first]
+    return ray
+
+
+def rookAttacks(sq: int, occupied: int):
+    return (rayAttacks(0, sq, occupied) | rayAttacks(1, sq, occupied) |
+            rayAttacks(2, sq, occupied) | rayAttacks(3, sq, occupied))
+
+
+def bishopAttacks(sq: int, occupied: int):
+    return (rayAttacks(4, sq, occupied) | rayAttacks(5, sq, occupied) |
+            rayAttacks(6, sq, occupied) | rayAttacks(7, sq, occupied))
+
+
+class BitboardGameState:
+    def __init__(self, board=None, whiteToMove=True):
+        self.evaluation = None  # ChessEval.Evaluation kept up to date by makeMoveCode/undoMove, None for none
+        # Same opening layout as ChessEngine.GameState
+        self.setBoard(board or [
+            ["bR", "--", "--", "--", "bK", "--", "--", "bR"],
+            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
+            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
+        ], whiteToMove)
+        self.metrics = None  # ChessMetrics.Metrics to profile the move generator, None records nothing
+        self.moveCache = None  # MoveCache of getValidMoveCodes results, see setMoveCache
+
+    """
+    # Replace the position with an 8x8 board of piece codes and clear the move log
+    # Raises ValueError unless each side has exactly one king
+    """
+
+    def setBoard(self, board, whiteToMove=True):
+        checkKings(board)
+        self.board = [list(row) for row in board]  # Kept in sync for the UI and Move construction
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupancy = [0, 0]
+        for sq in range(64):
+            piece = self.board[sq // 8][sq % 8]
+            if piece != "--":
+                color, pieceType = PIECE_INDEX[piece]
+                self.pieces[color][pieceType] |= 1 << sq
+                self.occupancy[color] |= 1 << sq
+        self.whiteToMove = whiteToMove
+        self.moveCodes = []
+        self.whiteKingLocation = self.__kingLocation(WHITE)
+        self.blackKingLocation = self.__kingLocation(BLACK)
+        self.isInCheck = False
+        self.checkMate = False
+        self.staleMate = False
+        self.zobristKey = computeZobristKey(self.board, whiteToMove)
+        self.fenCounters = (0, 1)
+        if self.evaluation is not None:
+            self.evaluation.reset(self.board)
+
+    def setFen(self, fen):
+        board, whiteToMove, halfmove, fullmove = parseFen(fen)
+        self.setBoard(board, whiteToMove)
+        self.fenCounters = (halfmove, fullmove)
+
+    def getFen(self):
+        return positionFen(self)
+
+    def __kingLocation(self, color):
+        king = self.pieces[color][KING]
+        return SQUARES[king.bit_length() - 1] if king else None
+
+    def pieceCount(self):
+        return (self.occupancy[WHITE] | self.occupancy[BLACK]).bit_count()
+
+    @property
+    def moveLog(self):
+        return MoveLog(self.moveCodes)
+
+    def makeMove(self, move):
+        if move.pieceMoved != "--":
+            self.makeMoveCode(move.code)
+
+    def makeMoveCode(self, code):
+        start = (code >> 6) & 63
+        end = code & 63
+        moved = (code >> 12) & 15
+        captured = (code >> 16) & 15
+        color, pieceType = divmod(moved - 1, 6)
+        moveBits = (1 << start) | (1 << end)
+        self.pieces[color][pieceType] ^= moveBits
+        self.occupancy[color] ^= moveBits
+        if captured:
+            capColor, capType = divmod(captured - 1, 6)
+            self.pieces[capColor][capType] ^= 1 << end
+            self.occupancy[capColor] ^= 1 << end
+
+        self.board[start >> 3][start & 7] = "--"
+        self.board[end >> 3][end & 7] = pieceCodes[moved]
+        self.moveCodes.append(code)
+        self.zobristKey ^= zobristMoveKey(code)
+        if self.evaluation is not None:
+            self.evaluation.makeMove(code)
+        if pieceType == KING:
+            if color == WHITE:
+                self.whiteKingLocation = SQUARES[end]
+            else:
+                self.blackKingLocation = SQUARES[end]
+        self.whiteToMove = not self.whiteToMove
+
+    def undoMove(self):
+        if len(self.moveCodes) == 0:
+            return
+        code = self.moveCodes.pop()
+        start = (code >> 6) & 63
+        end = code & 63
+        moved = (code >> 12) & 15
+        captured = (code >> 16) & 15
+        color, pieceType = divmod(moved - 1, 6)
+        moveBits = (1 << start) | (1 << end)
+        self.pieces[color][pieceType] ^= moveBits
+        self.occupancy[color] ^= moveBits
+        if captured:
+            capColor, capType = divmod(captured - 1, 6)
+            self.pieces[capColor][capType] ^= 1 << end
+            self.occupancy[capColor] ^= 1 << end
+
+        self.board[start >> 3][start & 7] = pieceCodes[moved]
+        self.board[end >> 3][end & 7] = pieceCodes[captured]
+        self.zobristKey ^= zobristMoveKey(code)
+        if self.evaluation is not None:
+            self.evaluation.undoMove(code)
+        if pieceType == KING:
+            if color == WHITE:
+                self.whiteKingLocation = SQUARES[start]
+            else:
+                self.blackKingLocation = SQUARES[start]
+        self.whiteToMove = not self.whiteToMove
+
+    """
+    # Pieces of color 'them' that attack sq, given the occupancy
+    """
+
+    def __attackersTo(self, sq: int, them: int, occupied: int):
+        enemy = self.pieces[them]
+        attackers = (KNIGHT_ATTACKS[sq] & enemy[KNIGHT]) | (KING_ATTACKS[sq] & enemy[KING]) | \
+                    (PAWN_ATTACKS[1 - them][sq] & enemy[PAWN])
+        diagonal = enemy[BISHOP] | enemy[QUEEN]
+        if diagonal:
+            attackers |= bishopAttacks(sq, occupied) & diagonal
+        straight = enemy[ROOK] | enemy[QUEEN]
+        if straight:
+            attackers |= rookAttacks(sq, occupied) & straight
+        return attackers
+
+    """
+    # Work out the check mask and the pinned pieces of the side to move
+    # checkMask: squares a non-king move must land on (FULL when not in check, 0 in double check)
+    # pinRays:   pinned square -> squares it may still move to (the line between king and pinner)
+    """
+
+    def __checksAndPins(self, us: int, them: int, kingSq: int, occupied: int):
+        checkers = self.__attackersTo(kingSq, them, occupied)
+        if checkers == 0:
+            checkMask = FULL
+        elif checkers & (checkers - 1) == 0:  # Exactly one checker, capture or block it
+            checkerSq = checkers.bit_length() - 1
+            checkMask = checkers | BETWEEN[kingSq][checkerSq]
+        else:  # Double check, only the king can move
+            checkMask = 0
+
+        pinRays = {}
+        own = self.occupancy[us]
+        enemy = self.pieces[them]
+        diagonal = enemy[BISHOP] | enemy[QUEEN]
+        straight = enemy[ROOK] | enemy[QUEEN]
+        for d in range(8):
+            sliders = straight if d < 4 else diagonal
+            if not sliders & RAYS[d][kingSq]:
+                continue
+            blockers = RAYS[d][kingSq] & occupied
+            if not blockers:
+                continue
+            first = (blockers & -blockers).bit_length() - 1 if RAY_POSITIVE[d] else blockers.bit_length() - 1
+            if not (own >> first) & 1:
+                continue
+            behind = RAYS[d][first] & occupied
+            if not behind:
+                continue
+            second = (behind & -behind).bit_length() - 1 if RAY_POSITIVE[d] else behind.bit_length() - 1
+            if (sliders >> second) & 1:
+                pinRays[first] = BETWEEN[kingSq][second] | (1 << second)
+        return checkers, checkMask, pinRays
+
+    """
+    # Target squares of every legal move, as a list of (start square, target bitboard)
+    # Shared by getValidMoves and countValidMoves so both agree on legality
+    """
+
+    def __legalTargets(self):
+        us = WHITE if self.whiteToMove else BLACK
+        them = 1 - us
+        own = self.occupancy[us]
+        enemyOcc = self.occupancy[them]
+        occupied = own | enemyOcc
+        mine = self.pieces[us]
+        kingBit = mine[KING]
+        kingSq = kingBit.bit_length() - 1
+        metrics = self.metrics
+        if metrics is not None:
+            start = clock()
+        checkers, checkMask, pinRays = self.__checksAndPins(us, them, kingSq, occupied)
+        self.isInCheck = checkers != 0
+        if metrics is not None:
+            metrics.addTime("checksAndPins", start)
+            metrics.count("checksFound", checkers.bit_count())
+            metrics.count("pinsFound", len(pinRays))
+        targets = []
+
+        # King: every target must be safe with the king lifted off its square (x-rays through it count)
+        kingTargets = 0
+        withoutKing = occupied ^ kingBit
+        candidates = KING_ATTACKS[kingSq] & ~own
+        while candidates:
+            bit = candidates & -candidates
+            if not self.__attackersTo(bit.bit_length() - 1, them, withoutKing):
+                kingTargets |= bit
+            candidates ^= bit
+        if kingTargets:
+            targets.append((kingSq, kingTargets))
+
+        if checkMask == 0:
+            return targets
+
+        notOwn = ~own & checkMask
+        for pieceType, attacks in ((KNIGHT, None), (BISHOP, bishopAttacks), (ROOK, rookAttacks),
+                                   (QUEEN, None)):
+            bits = mine[pieceType]
+            while bits:
+                bit = bits & -bits
+                sq = bit.bit_length() - 1
+                bits ^= bit
+                if pieceType == KNIGHT:
+                    if sq in pinRays:  # A pinned knight can never stay on the pin line
+                        continue
+                    moves = KNIGHT_ATTACKS[sq]
+                elif pieceType == QUEEN:
+                    moves = bishopAttacks(sq, occupied) | rookAttacks(sq, occupied)
+                else:
+                    moves = attacks(sq, occupied)
+                moves &= notOwn
+                if sq in pinRays:
+                    moves &= pinRays[sq]
+                if moves:
+                    targets.append((sq, moves))
+
+        empty = ~occupied & FULL
+        bits = mine[PAWN]
+        while bits:
+            bit = bits & -bits
+            sq = bit.bit_length() - 1
+            bits ^= bit
+            if us == WHITE:
+                push = (bit >> 8) & empty
+                if push & ROW_5:
+                    push |= (push >> 8) & empty
+            else:
+                push = (bit << 8) & empty & FULL
+                if push & ROW_2:
+                    push |= (push << 8) & empty
+            moves = (push | (PAWN_ATTACKS[us][sq] & enemyOcc)) & checkMask
+            if sq in pinRays:
+                moves &= pinRays[sq]
+            if moves:
+                targets.append((sq, moves))
+        return targets
+
+    def getValidMoves(self):
+        return MoveList(self.getValidMoveCodes())
+
+    def getValidMoveCodes(self):
+        cache = self.moveCache
+        if cache is not None:
+            entry = cache.get(self.zobristKey)
+            if entry is not None:
+                moves, self.isInCheck, self.checkMate, self.staleMate = entry
+                return array('I', moves)
+        metrics = self.metrics
+        if metrics is not None:
+            genStart = clock()
+        moves = array('I')
+        board = self.board
+        for start, bits in self.__legalTargets():
+            base = (start << 6) | (pieceIndex[board[start >> 3][start & 7]] << 12)
+            while bits:
+                bit = bits & -bits
+                end = bit.bit_length() - 1
+                moves.append(base | end | (pieceIndex[board[end >> 3][end & 7]] << 16))
+                bits ^= bit
+        self.__updateEndState(len(moves))
+        if metrics is not None:
+            metrics.addTime("getValidMoves", genStart)
+            metrics.count("movesGenerated", len(moves))
+            if self.checkMate or self.staleMate:
+                metrics.event("checkmate" if self.checkMate else "stalemate", plies=len(self.moveCodes))
+        if cache is not None:
+            cache.put(self.zobristKey, (array('I', moves), self.isInCheck, self.checkMate, self.staleMate))
+        return moves
+
+    def setMoveCache(self, capacity):
+        self.moveCache = MoveCache(capacity) if capacity else None
+
+    """
+    # Number of legal moves, counted from the target bitboards without building Move objects
+    """
+
+    def countValidMoves(self):
+        count = 0
+        for _, bits in self.__legalTargets():
+            count += bits.bit_count()
+        self.__updateEndState(count)
+        return count
+
+    """
+    # Same staged order as GameState.getStagedMoveCodes (hash move, MVV-LVA captures, killers, quiet moves
+    # by history). The target bitboards are cheap enough to compute up front, the stages only split them
+    # into captures and quiet moves and encode each part when it is reached
+    """
+
+    def getStagedMoveCodes(self, hashMove=0, killers=(), history=None):
+        return self.__stagedMoves(self.__legalTargets(), self.occupancy[BLACK if self.whiteToMove else WHITE],
+                                  hashMove & 0xFFFF, killers, history)
+
+    def inCheck(self):
+        us = WHITE if self.whiteToMove else BLACK
+        occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        self.isInCheck = self.__attackersTo(self.pieces[us][KING].bit_length() - 1, 1 - us, occupied) != 0
+        return self.isInCheck
+
+    """
+    # Legal captures in MVV-LVA order, every evasion when in check, like GameState.getCaptureMoveCodes
+    """
+
+    def getCaptureMoveCodes(self):
+        targets = self.__legalTargets()
+        mask = FULL if self.isInCheck else self.occupancy[BLACK if self.whiteToMove else WHITE]
+        board = self.board
+        moves = []
+        for start, bits in targets:
+            bits &= mask
+            base = (start << 6) | (pieceIndex[board[start >> 3][start & 7]] << 12)
+            while bits:
+                bit = bits & -bits
+                end = bit.bit_length() - 1
+                moves.append(base | end | (pieceIndex[board[end >> 3][end & 7]] << 16))
+                bits ^= bit
+        if self.isInCheck:
+            return orderMoves(moves)
+        moves.sort(key=captureOrder, reverse=True)
+        return moves
+
+    def __stagedMoves(self, targets, enemyOcc, hashMove, killers, history):
+        board = self.board
+        targetMap = dict(targets)
+
+        def legalCode(move):
+            start = (move >> 6) & 63
+            end = move & 63
+            if (targetMap.get(start, 0) >> end) & 1 and \
+                    pieceIndex[board[start >> 3][start & 7]] == (move >> 12) & 15:
+                return (move & 0xFFFF) | (pieceIndex[board[end >> 3][end & 7]] << 16)
+            return 0
+
+        if hashMove:
+            hashMove = legalCode(hashMove)
+            if hashMove:
+                yield hashMove
+
+        captures = []
+        for start, bits in targets:
+            bits &= enemyOcc
+            base = (start << 6) | (pieceIndex[board[start >> 3][start & 7]] << 12)
+            while bits:
+                bit = bits & -bits
+                end = bit.bit_length() - 1
+                captures.append(base | end | (pieceIndex[board[end >> 3][end & 7]] << 16))
+                bits ^= bit
+        captures.sort(key=captureOrder, reverse=True)
+        for move in captures:
+            if move != hashMove:
+                yield move
+
+        tried = [hashMove]
+        for killer in killers:
+            if killer and not killer & 0xF0000 and killer not in tried and legalCode(killer) == killer:
+                tried.append(killer)
+                yield killer
+
+        quiets = []
+        for start, bits in targets:
+            bits &= ~enemyOcc
+            base = (start << 6) | (pieceIndex[board[start >> 3][start & 7]] << 12)
+            while bits:
+                bit = bits & -bits
+                move = base | (bit.bit_length() - 1)
+                if move not in tried:
+                    quiets.append(move)
+                bits ^= bit
+        if history is not None:
+            quiets.sort(key=lambda move: history[move & 0xFFF], reverse=True)
+        for move in quiets:
+            yield move
+
+    def __updateEndState(self, moveCount):
+        self.checkMate = moveCount == 0 and self.isInCheck
+        self.staleMate = moveCount == 0 and not self.isInCheck
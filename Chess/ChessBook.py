@@ -0,0 +1,202 @@
+"""
+Opening book: weighted moves by position, read straight from a memory-mapped file.
+
+The file follows the Polyglot layout: 16-byte big-endian entries (key u64, move u16, weight u16, learn u32)
+sorted by key, so a lookup is a binary search over the mapped bytes and opening a book parses nothing,
+whatever its size. Moves use the Polyglot bits (to file 0-2, to rank 3-5, from file 6-8, from rank 9-11,
+ranks counted from rank 1). The key is GameState.zobristKey rather than the Polyglot hash, so books must be
+built with this module (buildBook), books made by other programs will not match any position.
+
+Usage (from the project root):
+    python -m Chess.ChessBook build games.pgn -o book.bin --max-ply 20
+    python -m Chess.ChessBook probe book.bin
+    python -m Chess.ChessBook probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b - - 0 1"
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+
+from Chess import ChessEngine
+from Chess.ChessPgn import readGames, sanToMove, STANDARD_FEN, PgnError
+
+ENTRY = struct.Struct(">QHHI")  # key, move, weight, learn
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+
+"""
+# Polyglot move bits of a Move, and back to a Move on the board of gs
+"""
+
+
+def encodeBookMove(move):
+    return ((7 - move.endRow) << 3 | move.endCol) | ((7 - move.startRow) << 3 | move.startCol) << 6
+
+
+def decodeBookMove(bookMove, gs):
+    endRow, endCol = 7 - ((bookMove >> 3) & 7), bookMove & 7
+    startRow, startCol = 7 - ((bookMove >> 9) & 7), (bookMove >> 6) & 7
+    return ChessEngine.Move((startRow, startCol), (endRow, endCol), gs.board)
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = self.file.seek(0, 2)
+        self.count = size // ENTRY.size
+        # mmap refuses empty files, an empty book simply has no entries
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b""
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.count:
+            self.data.close()
+        self.file.close()
+
+    """
+    # Raw entries of a position hash: list of (Polyglot move, weight), best weight first
+    """
+
+    def lookup(self, key):
+        data = self.data
+        low, high = 0, self.count
+        while low < high:  # First entry with this key
+            middle = (low + high) >> 1
+            if KEY.unpack_from(data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.count:
+            entryKey, bookMove, weight, _ = ENTRY.unpack_from(data, low * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((bookMove, weight))
+            low += 1
+        entries.sort(key=lambda entry: entry[1], reverse=True)
+        return entries
+
+    """
+    # Book moves of the position of gs as (Move, weight), only the ones legal here (a hash collision or
+    # a book built from different rules can hold others). The moves go straight to gs.makeMove
+    """
+
+    def getMoves(self, gs):
+        entries = self.lookup(gs.zobristKey)
+        if not entries:
+            return []
+        validMoves = gs.getValidMoves()
+        moves = []
+        for bookMove, weight in entries:
+            code = validMoves.find(decodeBookMove(bookMove, gs))
+            if code is not None:
+                moves.append((ChessEngine.Move.fromCode(code), weight))
+        return moves
+
+    """
+    # One book move picked at random in proportion to its weight, None when the position is not in the book
+    """
+
+    def pickMove(self, gs, rng=random):
+        moves = [(move, weight) for move, weight in self.getMoves(gs) if weight > 0]
+        if not moves:
+            return None
+        return rng.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+
+"""
+# Build a book from PGN files: the first maxPly moves of every game, weighted 2 for a win of the side
+# that played the move, 1 for a draw or an unknown result, 0 for a loss (dropped)
+# Moves seen fewer than minGames times are left out. Returns (games read, entries written)
+"""
+
+
+def buildBook(pgnPaths, outPath, maxPly=20, minGames=1, backend="string"):
+    weights = {}  # (key, Polyglot move) -> [weight, games]
+    games = 0
+    for path in pgnPaths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for game in readGames(f):
+                if game.startFen() != STANDARD_FEN:
+                    continue
+                games += 1
+                gs = ChessEngine.newGameState(backend)
+                gs.setFen(STANDARD_FEN)
+                for san in game.moves[:maxPly]:
+                    try:
+                        move = sanToMove(gs, san)
+                    except PgnError:  # Illegal or not supported by the engine, keep what came before
+                        break
+                    if game.result == "1/2-1/2" or game.result == "*":
+                        weight = 1
+                    else:
+                        weight = 2 if (game.result == "1-0") == gs.whiteToMove else 0
+                    entry = weights.setdefault((gs.zobristKey, encodeBookMove(move)), [0, 0])
+                    entry[0] += weight
+                    entry[1] += 1
+                    gs.makeMove(move)
+
+    byKey = {}
+    for (key, bookMove), (weight, seen) in weights.items():
+        if weight > 0 and seen >= minGames:
+            byKey.setdefault(key, []).append((bookMove, weight))
+    written = 0
+    with open(outPath, "wb") as out:
+        for key in sorted(byKey):
+            moves = byKey[key]
+            top = max(weight for _, weight in moves)
+            scale = MAX_WEIGHT / top if top > MAX_WEIGHT else 1  # Keep the proportions within 16 bits
+            for bookMove, weight in sorted(moves, key=lambda entry: entry[1], reverse=True):
+                out.write(ENTRY.pack(key, bookMove, max(1, int(weight * scale)), 0))
+                written += 1
+    return games, written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe a memory-mapped opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build a book from PGN files")
+    build.add_argument("pgn", nargs="+", help="PGN files")
+    build.add_argument("-o", "--output", required=True, help="Book file to write")
+    build.add_argument("--max-ply", type=int, default=20, help="Moves taken from the start of every game")
+    build.add_argument("--min-games", type=int, default=1, help="Drop moves played in fewer games")
+    probe = commands.add_parser("probe", help="List the book moves of a position")
+    probe.add_argument("book", help="Book file")
+    probe.add_argument("--fen", default=STANDARD_FEN, help="Position to look up (default: standard start)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        games, written = buildBook(args.pgn, args.output, args.max_ply, args.min_games)
+        print("%d games, %d entries (%d bytes) in %.2fs" % (games, written, written * ENTRY.size,
+                                                             time.perf_counter() - start))
+        return 0
+
+    gs = ChessEngine.newGameState()
+    gs.setFen(args.fen)
+    with OpeningBook(args.book) as book:
+        repeats = 1000
+        start = time.perf_counter()
+        for _ in range(repeats):
+            book.lookup(gs.zobristKey)
+        micros = (time.perf_counter() - start) * 1e6 / repeats
+        moves = book.getMoves(gs)
+        total = sum(weight for _, weight in moves)
+        for move, weight in moves:
+            print("%s %6d %5.1f%%" % (move.getChessNotation(), weight, 100.0 * weight / total))
+        print("%d entries in the book, %d moves here, lookup %.1f us" % (len(book), len(moves), micros))
+    return 0 if moves else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,8 +3,11 @@
 2. Valid moves
 3. Logging (uses chess algebraic notation)
 """
-from nguyenpanda.swan import Color
-import time
+import random
+from array import array
+from collections import OrderedDict
+
+from Chess.ChessMetrics import clock
 
 # Maps chess ranks to row indices
 ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -40,6 +43,342 @@ mapDirection = {'N': knightDirections, 'B': diagonalDirection,
 def isInBoard(r, c):
     return 0 <= r <= 7 and 0 <= c <= 7
 
+
+def _targets(r, c, steps, maxLength):
+    targets = []
+    for i in range(1, maxLength + 1):
+        endRow, endCol = r + i * steps[0], c + i * steps[1]
+        if not isInBoard(endRow, endCol):
+            break
+        targets.append((endRow, endCol))
+    return tuple(targets)
+
+
+# Target squares precomputed for every square (index r * 8 + c) at import, so the generators
+# and the check detection just walk a tuple and never test the board edges
+# rayTable[sq][i]: squares from sq in the direction omniDirection[i], nearest first (0-3 diagonal, 4-7 straight)
+# knightTable[sq], kingTable[sq]: squares a knight/king on sq can jump to
+rayTable = [[_targets(sq >> 3, sq & 7, d, 7) for d in omniDirection] for sq in range(64)]
+knightTable = [sum((_targets(sq >> 3, sq & 7, d, 1) for d in knightDirections), ()) for sq in range(64)]
+kingTable = [sum((_targets(sq >> 3, sq & 7, d, 1) for d in omniDirection), ()) for sq in range(64)]
+
+
+def _betweenMasks(sq):
+    masks = [0] * 64
+    for ray in rayTable[sq]:
+        mask = 0
+        for endRow, endCol in ray:
+            masks[endRow * 8 + endCol] = mask
+            mask |= 1 << (endRow * 8 + endCol)
+    return masks
+
+
+# Attacked squares as bit masks (bit r * 8 + c) for the pieces that do not slide
+# pawnAttackTable[color][sq]: the two squares a pawn of that color on sq captures on
+knightAttackTable = [sum(1 << (r * 8 + c) for r, c in knightTable[sq]) for sq in range(64)]
+kingAttackTable = [sum(1 << (r * 8 + c) for r, c in kingTable[sq]) for sq in range(64)]
+pawnAttackTable = {color: [sum(1 << (r * 8 + c) for r, c in (rayTable[sq][i][:1] + rayTable[sq][i + 1][:1]))
+                           for sq in range(64)]
+                   for color, i in (('w', 0), ('b', 2))}
+sliderRays = {'B': (0, 1, 2, 3), 'R': (4, 5, 6, 7), 'Q': tuple(range(8))}  # rayTable directions of each slider
+sliderCodes = ("wB", "wR", "wQ", "bB", "bR", "bQ")
+
+
+# Rough worth of each piece index, only used to order moves (the king last as an attacker)
+orderValues = [0, 1, 3, 3, 5, 9, 20, 1, 3, 3, 5, 9, 20]
+
+
+"""
+# Sort key of a capture: most valuable victim first, then the least valuable attacker (MVV-LVA)
+"""
+
+
+def captureOrder(code):
+    return orderValues[(code >> 16) & 15] * 32 - orderValues[(code >> 12) & 15]
+
+
+# Material (centipawns) of each piece index for the static exchange evaluation
+exchangeValues = [0, 100, 320, 330, 500, 900, 20000, 100, 320, 330, 500, 900, 20000]
+
+
+"""
+# Pieces that take part in an exchange on 'target', found with the ray and knight tables:
+# lines[i] holds the pieces on ray i that can reach target one after the other (a pawn or king only right next
+# to it, sliders of the ray's kind behind them), farthest first so the front one is line[-1]
+# knights[color] the knights of that color. The piece on 'skip' (the first capturer) is left out, so whatever
+# stood behind it joins the exchange
+"""
+
+
+def _exchangeAttackers(board, target, skip):
+    lines = []
+    for i, ray in enumerate(rayTable[target]):
+        sliders = "BQ" if i < 4 else "RQ"
+        pawn = "bp" if i < 2 else "wp" if i < 4 else None  # Pawns below the target are white ones (rows grow down)
+        line = []
+        for distance, (r, c) in enumerate(ray):
+            piece = board[r][c]
+            if piece == "--" or r * 8 + c == skip:
+                continue
+            if piece[1] in sliders or distance == 0 and (piece[1] == 'K' or piece == pawn):
+                line.append(piece)
+            else:
+                break
+        if line:
+            line.reverse()
+            lines.append(line)
+    knights = {'w': [], 'b': []}
+    for r, c in knightTable[target]:
+        piece = board[r][c]
+        if piece[1] == 'N' and r * 8 + c != skip:
+            knights[piece[0]].append(piece)
+    return lines, knights
+
+
+def _leastValuableAttacker(lines, knights, color):
+    best = knights[color] if knights[color] else None
+    bestValue = exchangeValues[pieceIndex[best[-1]]] if best else None
+    for line in lines:
+        if line and line[-1][0] == color:
+            value = exchangeValues[pieceIndex[line[-1]]]
+            if bestValue is None or value < bestValue:
+                best, bestValue = line, value
+    return best
+
+
+"""
+# Static exchange evaluation: material won (centipawns, negative when lost) by the capture 'code' followed by
+# the best sequence of recaptures on its target square, lowest value attacker first, either side free to stop
+# Works on the board alone, nothing is moved. Pins are not looked at, a king only recaptures onto a square the
+# other side no longer attacks
+"""
+
+
+def staticExchange(board, code):
+    target = code & 63
+    start = (code >> 6) & 63
+    moved = pieceCodes[(code >> 12) & 15]
+    lines, knights = _exchangeAttackers(board, target, start)
+    gains = [exchangeValues[(code >> 16) & 15]]
+    onSquare = exchangeValues[pieceIndex[moved]]
+    color = 'b' if moved[0] == 'w' else 'w'
+    while True:
+        attackers = _leastValuableAttacker(lines, knights, color)
+        if attackers is None:
+            break
+        piece = attackers.pop()
+        color = 'b' if color == 'w' else 'w'
+        if piece[1] == 'K' and _leastValuableAttacker(lines, knights, color) is not None:
+            break
+        gains.append(onSquare - gains[-1])
+        onSquare = exchangeValues[pieceIndex[piece]]
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+
+"""
+# Order a whole list the way GameState.getStagedMoveCodes stages it: hash move, captures by MVV-LVA,
+# killers, then quiet moves by history score
+"""
+
+
+def orderMoves(moves, hashMove=0, killers=(), history=None):
+    hashMove &= 0xFFFF
+
+    def key(move):
+        if move & 0xFFFF == hashMove:
+            return 3, 0
+        if move & 0xF0000:
+            return 2, captureOrder(move)
+        if move in killers:
+            return 1, 0
+        return 0, history[move & 0xFFF] if history is not None else 0
+
+    return sorted(moves, key=key, reverse=True)
+
+
+# betweenTable[a][b]: bit mask (bit r * 8 + c) of the squares strictly between a and b when they share
+# a line, 0 otherwise. King square to checker gives the squares where a check can be blocked
+betweenTable = [_betweenMasks(sq) for sq in range(64)]
+
+
+# Packed move encoding, the generators describe every move with a single int:
+#   bits 0-5   end square     (r * 8 + c)
+#   bits 6-11  start square
+#   bits 12-15 moved piece    (index into pieceCodes)
+#   bits 16-19 captured piece (index into pieceCodes, 0 = empty square)
+#   bits 20-23 flags, reserved for castling/en-passant/promotion
+# A Move object is only built from a code when the UI or the notation needs one (Move.fromCode)
+pieceCodes = ["--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+pieceIndex = {piece: i for i, piece in enumerate(pieceCodes)}
+colorPieces = {'w': pieceCodes[1:7], 'b': pieceCodes[7:]}  # Piece codes of each color, pawns first
+
+
+def encodeMove(startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured, flags=0):
+    return (((startRow * 8 + startCol) << 6) | (endRow * 8 + endCol) |
+            (pieceIndex[pieceMoved] << 12) | (pieceIndex[pieceCaptured] << 16) | (flags << 20))
+
+
+# Zobrist hashing: one random 64-bit key per (piece, square), indexed by r * 8 + c, and one for black to move.
+# The generator is seeded so a position hashes to the same key in every run.
+# "--" maps to zeros so makeMove can XOR the captured piece in without checking for an empty square.
+_zobristRandom = random.Random(0x5EED)
+zobristPieceKeys = {color + piece: [_zobristRandom.getrandbits(64) for _ in range(64)]
+                    for color in "wb" for piece in "pNBRQK"}
+zobristPieceKeys["--"] = [0] * 64
+zobristBlackToMove = _zobristRandom.getrandbits(64)
+_zobristIndexKeys = [zobristPieceKeys[piece] for piece in pieceCodes]  # Same keys, by piece index
+
+"""
+# Hash a whole board from scratch, only needed when a position is set up
+# makeMove/undoMove keep the key up to date with XORs
+"""
+
+
+def computeZobristKey(board, whiteToMove):
+    key = 0 if whiteToMove else zobristBlackToMove
+    for r in range(8):
+        for c in range(8):
+            key ^= zobristPieceKeys[board[r][c]][r * 8 + c]
+    return key
+
+
+"""
+# The XOR that a move applies to the key, undoing the move applies the same XOR again
+# Piece leaves the start square, lands on the end square, the captured piece (if any) goes away, side flips
+"""
+
+
+def zobristMoveKey(code):
+    end = code & 63
+    moved = _zobristIndexKeys[(code >> 12) & 15]
+    return moved[(code >> 6) & 63] ^ moved[end] ^ _zobristIndexKeys[(code >> 16) & 15][end] ^ zobristBlackToMove
+
+
+# FEN fields: piece placement, side to move, castling rights, en passant square, halfmove clock, fullmove number
+# The engine has no castling or en passant yet, those two are accepted and ignored on import and written as '-'
+START_FEN = "r3k2r/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"  # The layout GameState() starts with
+fenPieces = {'p': 'p', 'n': 'N', 'b': 'B', 'r': 'R', 'q': 'Q', 'k': 'K'}
+
+"""
+# 8x8 board of piece codes from the piece placement field of a FEN string
+# Uppercase letters are white pieces, lowercase are black, digits are runs of empty squares
+"""
+
+
+def parsePlacement(placement):
+    board = []
+    for rank in placement.split("/"):
+        row = []
+        for ch in rank:
+            if ch.isdigit():
+                row.extend(["--"] * int(ch))
+            elif ch.lower() in fenPieces:
+                row.append(("w" if ch.isupper() else "b") + fenPieces[ch.lower()])
+            else:
+                raise ValueError("Bad piece '" + ch + "' in placement " + placement)
+        if len(row) != 8:
+            raise ValueError("Bad rank '" + rank + "' in placement " + placement)
+        board.append(row)
+    if len(board) != 8:
+        raise ValueError("Placement must have 8 ranks: " + placement)
+    return board
+
+
+"""
+# Raise ValueError unless the board has exactly one king of each color, the move generators rely on it
+"""
+
+
+def checkKings(board):
+    for king, color in (("wK", "white"), ("bK", "black")):
+        count = sum(row.count(king) for row in board)
+        if count != 1:
+            raise ValueError("Position needs exactly one " + color + " king, found " + str(count))
+
+
+def boardToPlacement(board):
+    ranks = []
+    for row in board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece == "--":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            letter = piece[1].lower()
+            rank += letter.upper() if piece[0] == 'w' else letter
+        ranks.append(rank + (str(empty) if empty else ""))
+    return "/".join(ranks)
+
+
+"""
+# Split a FEN string into (board, whiteToMove, halfmove clock, fullmove number)
+# Only the placement is required, missing fields default to white to move, 0 and 1
+# Raises ValueError for a malformed FEN or one without exactly one king per side
+"""
+
+
+def parseFen(fen):
+    fields = fen.split()
+    if not fields:
+        raise ValueError("Empty FEN")
+    board = parsePlacement(fields[0])
+    checkKings(board)
+    side = fields[1] if len(fields) > 1 else "w"
+    if side not in ("w", "b"):
+        raise ValueError("Bad side to move '" + side + "' in FEN " + fen)
+    try:
+        halfmove = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError("Bad move counters in FEN " + fen) from None
+    return board, side == "w", halfmove, fullmove
+
+
+"""
+# FEN of the current position of a game state (either backend)
+# The counters continue from the ones the position was loaded with (fenCounters) over the moves made since
+"""
+
+
+def positionFen(gs):
+    halfmove, fullmove = gs.fenCounters
+    plies = len(gs.moveCodes)
+    for i in range(plies - 1, -1, -1):  # The clock restarts on the last pawn move or capture
+        code = gs.moveCodes[i]
+        if code & 0xF0000 or pieceCodes[(code >> 12) & 15][1] == 'p':
+            halfmove = plies - 1 - i
+            break
+    else:
+        halfmove += plies
+    startedWhite = gs.whiteToMove == (plies % 2 == 0)
+    fullmove += (plies + (0 if startedWhite else 1)) // 2
+    return "%s %s - - %d %d" % (boardToPlacement(gs.board), "w" if gs.whiteToMove else "b", halfmove, fullmove)
+
+
+BACKENDS = ("string", "bitboard")
+
+"""
+# Create a game state with the chosen board representation
+# "string"   - GameState, the 8x8 board of piece codes
+# "bitboard" - ChessBitboard.BitboardGameState, one 64-bit integer per piece type and color
+"""
+
+
+def newGameState(backend="string"):
+    if backend == "string":
+        return GameState()
+    if backend == "bitboard":
+        from Chess.ChessBitboard import BitboardGameState  # Imported here, it imports Move from this module
+        return BitboardGameState()
+    raise ValueError("Unknown backend '" + backend + "', expected one of " + ", ".join(BACKENDS))
+
+
 class GameState:
     def __init__(self):
         self.board = [
@@ -53,7 +392,7 @@ class GameState:
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
         self.whiteToMove = True
-        self.moveLog = []
+        self.moveCodes = []  # Packed codes of the moves made, read through moveLog
         self.moveFunctions = {'p': self.__getPawnMoves, 'R': self.__getRookMoves,
                               'N': self.__getKnightMoves, 'B': self.__getBishopMoves,
                               'Q': self.__getQueenMoves, 'K': self.__getKingMoves}
@@ -61,10 +400,176 @@ class GameState:
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
         self.isInCheck = False
-        self.pins = []
+        self.pins = {}  # Pinned ally square (r * 8 + c) -> direction of the pin ray, from the king
         self.checks = []
         self.checkMate = False
         self.staleMate = False
+        self.zobristKey = computeZobristKey(self.board, self.whiteToMove)
+        self.pieceSquares = self.__indexPieces()
+        self.__indexAttacks()
+        self.fenCounters = (0, 1)  # Halfmove clock and fullmove number of the position before moveCodes
+        self.metrics = None  # ChessMetrics.Metrics to profile the move generator, None records nothing
+        self.moveCache = None  # MoveCache of getValidMoveCodes results, see setMoveCache
+        self.evaluation = None  # ChessEval.Evaluation kept up to date by makeMoveCode/undoMove, None for none
+
+    """
+    # Replace the position with an 8x8 board of piece codes and clear the move log
+    # Raises ValueError unless each side has exactly one king
+    """
+
+    def setBoard(self, board, whiteToMove=True):
+        checkKings(board)
+        self.board = [list(row) for row in board]
+        self.whiteToMove = whiteToMove
+        self.moveCodes = []
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif self.board[r][c] == "bK":
+                    self.blackKingLocation = (r, c)
+        self.isInCheck = False
+        self.checkMate = False
+        self.staleMate = False
+        self.zobristKey = computeZobristKey(self.board, self.whiteToMove)
+        self.pieceSquares = self.__indexPieces()
+        self.__indexAttacks()
+        self.fenCounters = (0, 1)
+        if self.evaluation is not None:
+            self.evaluation.reset(self.board)
+
+    """
+    # Replace the position with the one described by a FEN string, castling and en passant are ignored
+    """
+
+    def setFen(self, fen):
+        board, whiteToMove, halfmove, fullmove = parseFen(fen)
+        self.setBoard(board, whiteToMove)
+        self.fenCounters = (halfmove, fullmove)
+
+    def getFen(self):
+        return positionFen(self)
+
+    """
+    # Piece lists: piece code -> set of the squares (r * 8 + c) it stands on
+    # Built once per position, makeMove/undoMove keep them up to date
+    """
+
+    def __indexPieces(self):
+        pieceSquares = {piece: set() for piece in pieceCodes[1:]}
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    pieceSquares[self.board[r][c]].add(r * 8 + c)
+        return pieceSquares
+
+    """
+    # Attack maps: pieceAttacks[sq] is the mask of squares the piece on sq attacks (0 when empty),
+    # attackMaps[color] the union over that side's pieces, defended ally squares included
+    # Built once per position, after that only the pieces a move can affect are recomputed (__syncAttacks)
+    # and undoMove restores them from attackHistory
+    """
+
+    def __indexAttacks(self):
+        self.pieceAttacks = [0] * 64
+        for piece, squares in self.pieceSquares.items():
+            for sq in squares:
+                self.pieceAttacks[sq] = self.__attacksFrom(sq, piece)
+        self.attackHistory = []
+        self.attackMaps = {color: self.__unionAttacks(color) for color in "wb"}
+
+    """
+    # Squares attacked by 'piece' standing on sq
+    # Sliders see through the enemy king, so a square behind the king on the checking line counts as attacked
+    """
+
+    def __attacksFrom(self, sq, piece):
+        kind = piece[1]
+        if kind == 'p':
+            return pawnAttackTable[piece[0]][sq]
+        if kind == 'N':
+            return knightAttackTable[sq]
+        if kind == 'K':
+            return kingAttackTable[sq]
+        board = self.board
+        enemyKing = "bK" if piece[0] == 'w' else "wK"
+        mask = 0
+        rays = rayTable[sq]
+        for i in sliderRays[kind]:
+            for r, c in rays[i]:
+                mask |= 1 << (r * 8 + c)
+                endPiece = board[r][c]
+                if endPiece != "--" and endPiece != enemyKing:
+                    break
+        return mask
+
+    def __unionAttacks(self, color):
+        attacks = self.pieceAttacks
+        mask = 0
+        for piece in colorPieces[color]:
+            for sq in self.pieceSquares[piece]:
+                mask |= attacks[sq]
+        return mask
+
+    """
+    # Bring the attack maps up to date with the moves made since they were last used
+    # makeMoveCode only queues its move (a None entry in attackHistory), so the leaves of a search, which never
+    # generate moves, pay nothing. Here the pieces on the touched start/end squares and every slider whose rays
+    # reached one of them are recomputed, the old masks are kept on the last move's entry for undoMove
+    """
+
+    def __syncAttacks(self):
+        history = self.attackHistory
+        if not history or history[-1] is not None:
+            return
+        first = len(history) - 1
+        while first > 0 and history[first - 1] is None:
+            first -= 1
+        touched = 0
+        for code in self.moveCodes[first:]:
+            touched |= (1 << (code & 63)) | (1 << ((code >> 6) & 63))
+
+        board = self.board
+        attacks = self.pieceAttacks
+        changed = []
+        bits = touched
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            sq = bit.bit_length() - 1
+            piece = board[sq >> 3][sq & 7]
+            changed.append((sq, attacks[sq]))
+            attacks[sq] = self.__attacksFrom(sq, piece) if piece != "--" else 0
+        for piece in sliderCodes:
+            for sq in self.pieceSquares[piece]:
+                if attacks[sq] & touched and not (touched >> sq) & 1:
+                    changed.append((sq, attacks[sq]))
+                    attacks[sq] = self.__attacksFrom(sq, piece)
+        history[-1] = (changed, self.attackMaps)
+        self.attackMaps = {color: self.__unionAttacks(color) for color in "wb"}
+
+    """
+    # Squares attacked by a side ('w' or 'b') as a bit mask, defended pieces included
+    """
+
+    def attackedSquares(self, color):
+        self.__syncAttacks()
+        return self.attackMaps[color]
+
+    """
+    # Number of pieces on the board, kings included
+    """
+
+    def pieceCount(self):
+        return sum(len(squares) for squares in self.pieceSquares.values())
+
+    """
+    # The moves made so far, as Move objects built on demand from the packed codes
+    """
+
+    @property
+    def moveLog(self):
+        return MoveLog(self.moveCodes)
 
     '''
     Take a Move s a parameter and  execute it( this will not work for castling, en-passant, promotion)
@@ -72,85 +577,289 @@ class GameState:
 
     def makeMove(self, move):
         if move.pieceMoved != "--":
-            self.board[move.startRow][move.startCol] = "--"
-            self.board[move.endRow][move.endCol] = move.pieceMoved
-            self.moveLog.append(move)
-
-            # Update the king location
-            if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.endRow, move.endCol)
-            elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.endRow, move.endCol)
-
-            # Switch turn
-            self.whiteToMove = not self.whiteToMove
+            self.makeMoveCode(move.code)
         else:
             pass
 
+    """
+    # Same as makeMove, for a packed move code straight from the generator
+    """
+
+    def makeMoveCode(self, code):
+        start = (code >> 6) & 63
+        end = code & 63
+        pieceMoved = pieceCodes[(code >> 12) & 15]
+        self.board[start >> 3][start & 7] = "--"
+        self.board[end >> 3][end & 7] = pieceMoved
+        self.moveCodes.append(code)
+        self.zobristKey ^= zobristMoveKey(code)
+        squares = self.pieceSquares[pieceMoved]
+        squares.remove(start)
+        squares.add(end)
+        if code & 0xF0000:  # Captured piece
+            self.pieceSquares[pieceCodes[(code >> 16) & 15]].remove(end)
+        if self.evaluation is not None:
+            self.evaluation.makeMove(code)
+
+        # Update the king location
+        if pieceMoved == "wK":
+            self.whiteKingLocation = (end >> 3, end & 7)
+        elif pieceMoved == "bK":
+            self.blackKingLocation = (end >> 3, end & 7)
+
+        self.attackHistory.append(None)  # Attack maps catch up in __syncAttacks when they are needed
+
+        # Switch turn
+        self.whiteToMove = not self.whiteToMove
+
     def undoMove(self):
-        if len(self.moveLog) != 0:
-            lastMove = self.moveLog.pop()
-            self.board[lastMove.startRow][lastMove.startCol] = lastMove.pieceMoved
-            self.board[lastMove.endRow][lastMove.endCol] = lastMove.pieceCaptured
+        if len(self.moveCodes) != 0:
+            code = self.moveCodes.pop()
+            start = (code >> 6) & 63
+            end = code & 63
+            pieceMoved = pieceCodes[(code >> 12) & 15]
+            pieceCaptured = pieceCodes[(code >> 16) & 15]
+            self.board[start >> 3][start & 7] = pieceMoved
+            self.board[end >> 3][end & 7] = pieceCaptured
             self.whiteToMove = not self.whiteToMove
+            self.zobristKey ^= zobristMoveKey(code)
+            squares = self.pieceSquares[pieceMoved]
+            squares.remove(end)
+            squares.add(start)
+            if pieceCaptured != "--":
+                self.pieceSquares[pieceCaptured].add(end)
+            if self.evaluation is not None:
+                self.evaluation.undoMove(code)
+
+            entry = self.attackHistory.pop()
+            if entry is not None:  # The maps were synced after this move, put back what it changed
+                changed, self.attackMaps = entry
+                attacks = self.pieceAttacks
+                for sq, mask in changed:
+                    attacks[sq] = mask
+
+            if pieceMoved == "wK":
+                self.whiteKingLocation = (start >> 3, start & 7)
+            elif pieceMoved == "bK":
+                self.blackKingLocation = (start >> 3, start & 7)
 
-            if lastMove.pieceMoved == "wK":
-                self.whiteKingLocation = (lastMove.startRow, lastMove.startCol)
-            elif lastMove.pieceMoved == "bK":
-                self.blackKingLocation = (lastMove.startRow, lastMove.startCol)
+    """
+    # All legal moves as Move objects, for the UI and anything that needs notation
+    # 'move in validMoves' is a dictionary lookup
+    """
 
     def getValidMoves(self):
-        moves = []
+        return MoveList(self.getValidMoveCodes())
+
+    """
+    # All legal moves as an array of packed move codes, what perft and the search use
+    """
+
+    def getValidMoveCodes(self):
+        cache = self.moveCache
+        if cache is not None:
+            entry = cache.get(self.zobristKey)
+            if entry is not None:
+                moves, self.isInCheck, self.checkMate, self.staleMate = entry
+                return array('I', moves)
+        metrics = self.metrics
+        if metrics is not None:
+            start = clock()
+        moves = array('I')
         self.isInCheck, self.pins, self.checks = self.__inCheckAnhKhoa()
-        t0 = time.time()
-        if self.whiteToMove:
-            Kr, Kc = self.whiteKingLocation
-        else:
-            Kr, Kc = self.blackKingLocation
+        self.__syncAttacks()
+        if metrics is not None:
+            metrics.addTime("checksAndPins", start)
+            metrics.count("checksFound", len(self.checks))
+            metrics.count("pinsFound", len(self.pins))
         if self.isInCheck:
-            if len(self.checks) == 1:  # Only 1 check, block or move the king
-                moves = self.getAllPossibleMoves()
-                # Move a square between the checking enemy and the king
-                check = self.checks[0]
-                checkRow, checkCol, _, _ = check
-                pieceChecking = self.board[checkRow][checkCol]
-
-                validSquares = []  # Square that the piece can move to
-                # If knight, must capture the knight or move the king
-                if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                # If not then try to block
-                else:
-                    for i in range(1, 8):
-                        validSquare = (Kr + check[2] * i, Kc + check[3] * i)
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            break
-
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K':  # If this move doesn't move the king, it has to stop the check
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
-            else:  # Double check -> King is forced to move
-                self.__getKingMoves(Kr, Kc, moves)
+            if metrics is not None:
+                evasionStart = clock()
+            self.__getCheckEvasions(moves)
+            if metrics is not None:
+                metrics.addTime("generate.evasions", evasionStart)
         else:
             moves = self.getAllPossibleMoves()
-        t1 = time.time()
-        print(t1 - t0)
-        print("length of moves:" + str(len(moves)))
         if len(moves) == 0:
             if self.isInCheck:
                 self.checkMate = True
-                print("Checkmate!")
             else:
-                self.StaleMate = True
+                self.staleMate = True
         else:
             self.checkMate = False
             self.staleMate = False
+        if metrics is not None:
+            metrics.addTime("getValidMoves", start)
+            metrics.count("movesGenerated", len(moves))
+            if self.checkMate or self.staleMate:
+                metrics.event("checkmate" if self.checkMate else "stalemate", plies=len(self.moveCodes))
+        if cache is not None:
+            cache.put(self.zobristKey, (array('I', moves), self.isInCheck, self.checkMate, self.staleMate))
         return moves
 
     """
-    # Determine if the current player is in check, unused cuz inefficient
+    # Keep the results of getValidMoveCodes for the last 'capacity' positions, so going back and forth over
+    # the same positions (undo, transpositions) skips the generator. None or 0 turns the cache off
+    """
+
+    def setMoveCache(self, capacity):
+        self.moveCache = MoveCache(capacity) if capacity else None
+
+    """
+    # Number of legal moves, lets perft count leaves the same way on every backend
+    """
+
+    def countValidMoves(self):
+        return len(self.getValidMoveCodes())
+
+    """
+    # Legal moves one at a time, best candidates first, for the search:
+    #   1. hashMove (a code or its low 16 bits, 0 for none) when it is legal here
+    #   2. captures, most valuable victim / least valuable attacker first
+    #   3. killers, quiet moves that caused a cutoff in a sibling node, when legal here
+    #   4. the other quiet moves, highest history[code & 0xFFF] first
+    # Every stage is only generated once the one before it runs out, so a cutoff on an early move skips the rest.
+    # Checks and pins are worked out right away (isInCheck is valid on return), the moves come from the generator
+    # this returns. The position may change in between as long as every makeMove is undone before the next move
+    # is pulled. Does not update checkMate/staleMate
+    """
+
+    def getStagedMoveCodes(self, hashMove=0, killers=(), history=None):
+        self.isInCheck, self.pins, self.checks = self.__inCheckAnhKhoa()
+        self.__syncAttacks()
+        if self.isInCheck:  # Few evasions, generate them all and order them in one go
+            moves = array('I')
+            self.__getCheckEvasions(moves)
+            return iter(orderMoves(moves, hashMove, killers, history))
+        return self.__stagedMoves(hashMove, killers, history, self.pins)
+
+    """
+    # Whether the side to move is in check (also sets isInCheck), without generating any move
+    """
+
+    def inCheck(self):
+        self.isInCheck, self.pins, self.checks = self.__inCheckAnhKhoa()
+        return self.isInCheck
+
+    """
+    # Legal captures, most valuable victim / least valuable attacker first, for the quiescence search
+    # In check every evasion is returned instead (isInCheck is valid on return). Does not update checkMate/staleMate
+    """
+
+    def getCaptureMoveCodes(self):
+        self.isInCheck, self.pins, self.checks = self.__inCheckAnhKhoa()
+        self.__syncAttacks()
+        if self.isInCheck:
+            moves = array('I')
+            self.__getCheckEvasions(moves)
+            return orderMoves(moves)
+        captures = []
+        self.__getCaptureMoves(captures, self.pins)
+        captures.sort(key=captureOrder, reverse=True)
+        return captures
+
+    def __stagedMoves(self, hashMove, killers, history, pins):
+        hashMove &= 0xFFFF
+        if hashMove:
+            hashMove = self.__findPieceMove(hashMove, pins)
+            if hashMove:
+                yield hashMove
+
+        captures = []
+        self.__getCaptureMoves(captures, pins)
+        captures.sort(key=captureOrder, reverse=True)
+        for move in captures:
+            if move != hashMove:
+                yield move
+
+        tried = [hashMove]
+        for killer in killers:
+            # Still quiet here: the target square of a killer from a sibling can hold a piece in this position
+            if killer and not killer & 0xF0000 and killer not in tried and \
+                    self.__findPieceMove(killer, pins) == killer:
+                tried.append(killer)
+                yield killer
+
+        self.pins = pins  # The searched child positions left theirs behind
+        quiets = [move for move in self.getAllPossibleMoves() if not move & 0xF0000 and move not in tried]
+        if history is not None:
+            quiets.sort(key=lambda move: history[move & 0xFFF], reverse=True)
+        for move in quiets:
+            yield move
+
+    """
+    # The full legal code of 'move' (matched on the low 16 bits) from the moves of the piece on its start square,
+    # 0 when it is not legal here
+    """
+
+    def __findPieceMove(self, move, pins):
+        start = (move >> 6) & 63
+        piece = self.board[start >> 3][start & 7]
+        if pieceIndex[piece] != (move >> 12) & 15 or piece[0] != ('w' if self.whiteToMove else 'b'):
+            return 0
+        self.pins = pins
+        pieceMoves = array('I')
+        self.moveFunctions[piece[1]](start >> 3, start & 7, pieceMoves)
+        move &= 0xFFFF
+        for code in pieceMoves:
+            if code & 0xFFFF == move:
+                return code
+        return 0
+
+    """
+    # Append the legal captures when not in check, read off the attack maps instead of walking the board
+    # A pinned piece can only take on its pin line, beyond itself seen from the king (betweenTable)
+    """
+
+    def __getCaptureMoves(self, moves, pins):
+        if self.whiteToMove:
+            ally, enemy = 'w', 'b'
+            Kr, Kc = self.whiteKingLocation
+        else:
+            ally, enemy = 'b', 'w'
+            Kr, Kc = self.blackKingLocation
+        pieceSquares = self.pieceSquares
+        enemySquares = 0
+        for piece in colorPieces[enemy]:
+            for sq in pieceSquares[piece]:
+                enemySquares |= 1 << sq
+        board = self.board
+        attacks = self.pieceAttacks
+        fromKing = betweenTable[Kr * 8 + Kc]
+        for piece in colorPieces[ally]:
+            index = pieceIndex[piece] << 12
+            for sq in pieceSquares[piece]:
+                targets = attacks[sq] & enemySquares
+                if piece[1] == 'K':
+                    targets &= ~self.attackMaps[enemy]
+                base = index | (sq << 6)
+                pinned = sq in pins
+                while targets:
+                    bit = targets & -targets
+                    targets ^= bit
+                    end = bit.bit_length() - 1
+                    if not pinned or (fromKing[end] >> sq) & 1:
+                        moves.append(base | end | (pieceIndex[board[end >> 3][end & 7]] << 16))
+
+    """
+    # Legal moves while in check: king moves, and on a single check the blocks and captures of the checker
+    """
+
+    def __getCheckEvasions(self, moves):
+        if self.whiteToMove:
+            Kr, Kc = self.whiteKingLocation
+        else:
+            Kr, Kc = self.blackKingLocation
+        self.__getKingMoves(Kr, Kc, moves)
+        if len(self.checks) == 1:  # Only 1 check, the king can also be shielded or the checker captured
+            checkRow, checkCol, _, _ = self.checks[0]
+            checkSq = checkRow * 8 + checkCol
+            # Knights and pawns are adjacent or off any line, nothing between them and the king
+            self.__getEvasionMoves(betweenTable[Kr * 8 + Kc][checkSq] | (1 << checkSq), moves)
+        # Double check -> King is forced to move
+
+    """
+    # Determine if the current player is in check
     """
 
     def __inCheck(self):
@@ -165,15 +874,7 @@ class GameState:
     """
 
     def __squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove  # Switch to opponent turn
-        oppoMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # Switch the turn back
-
-        for move in oppoMoves:
-            if move.endRow == r and move.endCol == c:
-                return True
-
-        return False
+        return (self.attackedSquares('b' if self.whiteToMove else 'w') >> (r * 8 + c)) & 1 == 1
 
     """
     # Return all possible pins and check 
@@ -186,7 +887,7 @@ class GameState:
         # 2. Check Pawn attack
         # 3. Rook/Bishop/Queen attack
         isInCheck = False
-        pins = []
+        pins = {}
         checks = []
 
         if self.whiteToMove:
@@ -199,63 +900,112 @@ class GameState:
             Kr, Kc = self.blackKingLocation
 
         # Track enemy's Pawn, Bishop, Rook, Queen, King
+        rays = rayTable[Kr * 8 + Kc]
         for i in range(0, 8):  # Index based retrieval allows for checking diagonal/horizontal moves separately
             d = omniDirection[i]
-            possiblePin = ()
-            for j in range(1, 8):
-                endRow = Kr + j * d[0]
-                endCol = Kc + j * d[1]
+            possiblePin = None
+            for j, (endRow, endCol) in enumerate(rays[i], 1):
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePin is None:
+                        possiblePin = endRow * 8 + endCol
+                    else:  # 2nd ally piece, no longer possible to be pinned/check in this direction
+                        break
 
-                if isInBoard(endRow, endCol):
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePin == ():
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:  # 2nd ally piece, no longer possible to be pinned/check in this direction
+                elif endPiece[0] == enemyColor:
+                    pieceType = endPiece[1]
+                    # If there's an enemy piece in this direction, check if the enemy can give a check
+                    # There are 5 cases, I think...
+                    # 1.) Bishop - diagonal
+                    # 2.) Rook   - horizontal
+                    # 3.) Pawn
+                    #   3.a Black Pawn  (-1,-1) or (-1,1)
+                    #   3.b White Pawn  (1,-1) or (1,1)
+                    # 4.) King  - There's another king adjacent or j = 1
+                    # 5.) Queen - If the King can see the queen then it can be checked from that direction
+                    if (0 <= i <= 3 and pieceType == 'B') or \
+                            (4 <= i <= 7 and pieceType == 'R') or \
+                            (j == 1 and pieceType == 'p' and enemyColor == 'b' and 0 <= i <= 1) or \
+                            (j == 1 and pieceType == 'p' and enemyColor == 'w' and 2 <= i <= 3) or \
+                            (pieceType == 'K' and j == 1) or \
+                            (pieceType == 'Q'):
+
+                        if possiblePin is None:  # No blocking piece
+                            isInCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-
-                    elif endPiece[0] == enemyColor:
-                        pieceType = endPiece[1]
-                        # If there's an enemy piece in this direction, check if the enemy can give a check
-                        # There are 5 cases, I think...
-                        # 1.) Bishop - diagonal
-                        # 2.) Rook   - horizontal
-                        # 3.) Pawn
-                        #   3.a Black Pawn  (-1,-1) or (-1,-1)
-                        #   3.a White Pawn  (1,-1) or (1,1)
-                        # 4.) King  - There's another king adjacent or j = 1
-                        # 5.) Queen - If the King can see the queen then it can be checked from that direction
-                        if (0 <= i <= 3 and pieceType == 'B') or \
-                                (4 <= i <= 7 and pieceType == 'R') or \
-                                (j == 1 and pieceType == 'p' and enemyColor == 'b' and 2 <= i <= 3) or \
-                                (j == 1 and pieceType == 'p' and enemyColor == 'w' and 0 <= i <= 1) or \
-                                (pieceType == 'K' and j == 1) or \
-                                (pieceType == 'Q'):
-
-                            if possiblePin == ():  # No blocking piece
-                                isInCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possiblePin)
-                                break
-                        else:  # Enemy cannot check the king
+                        else:
+                            pins[possiblePin] = d
                             break
-                else:  # out of the board
-                    break
+                    else:  # Enemy cannot check the king
+                        break
 
-        # Track the enemy's Knight
-        for d in knightDirections:
-            endRow = Kr + d[0]
-            endCol = Kc + d[1]
-            if isInBoard(endRow, endCol):
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N':
-                    isInCheck = True
-                    checks.append((endRow, endCol, d[0], d[1]))
+        # Track the enemy's Knight, straight from the piece list instead of probing the 8 knight squares
+        for sq in self.pieceSquares[enemyColor + 'N']:
+            dr = (sq >> 3) - Kr
+            dc = (sq & 7) - Kc
+            if dr * dr + dc * dc == 5:  # (1, 2) or (2, 1) away in any direction
+                isInCheck = True
+                checks.append((sq >> 3, sq & 7, dr, dc))
 
         return isInCheck, pins, checks
 
+    """
+    # Generate the non-king moves that end a single check, landing on a square of blockMask
+    # (the checker itself or a square between it and the king)
+    # Works backwards from each target square to the pieces that can reach it, so nothing is generated
+    # just to be thrown away. A pinned piece can never help: it stays on the pin line, which only meets
+    # the check line at the king
+    """
+
+    def __getEvasionMoves(self, blockMask: int, moves):
+        board = self.board
+        if self.whiteToMove:
+            ally, enemy, forward, doublePushRow = 'w', 'b', -1, 4
+        else:
+            ally, enemy, forward, doublePushRow = 'b', 'w', 1, 3
+        pawn, knight = ally + 'p', ally + 'N'
+        pinned = self.pins
+
+        while blockMask:
+            bit = blockMask & -blockMask
+            blockMask ^= bit
+            t = bit.bit_length() - 1
+            tr, tc = t >> 3, t & 7
+            target = board[tr][tc]
+            end = t | (pieceIndex[target] << 16)
+
+            # Sliders: the first piece on each ray from the target
+            rays = rayTable[t]
+            for i in range(0, 8):
+                for r, c in rays[i]:
+                    piece = board[r][c]
+                    if piece != "--":
+                        if piece[0] == ally and (piece[1] == 'Q' or piece[1] == ('B' if i < 4 else 'R')) \
+                                and r * 8 + c not in pinned:
+                            moves.append(end | ((r * 8 + c) << 6) | (pieceIndex[piece] << 12))
+                        break
+
+            for r, c in knightTable[t]:
+                if board[r][c] == knight and r * 8 + c not in pinned:
+                    moves.append(end | ((r * 8 + c) << 6) | (pieceIndex[knight] << 12))
+
+            # Pawns come from behind the target square: pushes onto a block square, diagonals onto the checker
+            r = tr - forward
+            if not 0 <= r <= 7:
+                continue
+            if target == "--":
+                if board[r][tc] == pawn:
+                    if r * 8 + tc not in pinned:
+                        moves.append(end | ((r * 8 + tc) << 6) | (pieceIndex[pawn] << 12))
+                elif board[r][tc] == "--" and tr == doublePushRow and board[r - forward][tc] == pawn \
+                        and (r - forward) * 8 + tc not in pinned:
+                    moves.append(end | (((r - forward) * 8 + tc) << 6) | (pieceIndex[pawn] << 12))
+            elif target[0] == enemy:
+                for c in (tc - 1, tc + 1):
+                    if 0 <= c <= 7 and board[r][c] == pawn and r * 8 + c not in pinned:
+                        moves.append(end | ((r * 8 + c) << 6) | (pieceIndex[pawn] << 12))
+
     """
     # Generate all the possible moves for the Pawns
     # White pawns can capture to the direction that it is being pinned
@@ -264,16 +1014,9 @@ class GameState:
     """
 
     def __getPawnMoves(self, r: int, c: int, moves):
-        piecePined = False
-        pinDirection = ()
-
-        # Looks for pin information
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePined = True
-                pinDirection = self.pins[i][2:3]
-                self.pins.remove(self.pins[i])
-                break
+        base = ((r * 8 + c) << 6) | (pieceIndex[self.board[r][c]] << 12)  # Start square and piece of every code
+        pinDirection = self.pins.get(r * 8 + c)
+        piecePined = pinDirection is not None
 
         # White pawn to move
         if self.whiteToMove:
@@ -282,21 +1025,21 @@ class GameState:
 
             if self.board[r - 1][c] == "--":  # 1 square pawn advance
                 if not piecePined or pinDirection == (-1, 0) or pinDirection == (1, 0):
-                    moves.append(Move((r, c), (r - 1, c), self.board))
+                    moves.append(base | ((r - 1) * 8 + c))
                     if r == 6 and self.board[r - 2][c] == "--":  # 2 square pawn move advance
-                        moves.append(Move((r, c), (r - 2, c), self.board))
+                        moves.append(base | ((r - 2) * 8 + c))
 
             # Capture to the left
             if c - 1 >= 0:
                 if self.board[r - 1][c - 1][0] == "b":  # Enemy piece
                     if not piecePined or pinDirection == (-1, -1):
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board))
+                        moves.append(base | ((r - 1) * 8 + c - 1) | (pieceIndex[self.board[r - 1][c - 1]] << 16))
 
             # Capture to the right
             if c + 1 <= 7:
                 if self.board[r - 1][c + 1][0] == "b":  # Enemy piece
                     if not piecePined or pinDirection == (-1, 1):
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board))
+                        moves.append(base | ((r - 1) * 8 + c + 1) | (pieceIndex[self.board[r - 1][c + 1]] << 16))
 
         # Black pawn to move
         if not self.whiteToMove:
@@ -305,21 +1048,21 @@ class GameState:
 
             if self.board[r + 1][c] == "--":  # 1 square pawn advance
                 if not piecePined or pinDirection == (1, 0) or pinDirection == (-1, 0):
-                    moves.append(Move((r, c), (r + 1, c), self.board))
+                    moves.append(base | ((r + 1) * 8 + c))
                     if r == 1 and self.board[r + 2][c] == "--":
-                        moves.append(Move((r, c), (r + 2, c), self.board))
+                        moves.append(base | ((r + 2) * 8 + c))
 
             # Capture to the left
             if c - 1 >= 0:
                 if self.board[r + 1][c - 1][0] == "w":  # Enemy piece
                     if not piecePined or pinDirection == (1, -1):
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
+                        moves.append(base | ((r + 1) * 8 + c - 1) | (pieceIndex[self.board[r + 1][c - 1]] << 16))
 
             # Capture to the right
             if c + 1 <= 7:
                 if self.board[r + 1][c + 1][0] == "w":  # Enemy piece
                     if not piecePined or pinDirection == (1, 1):
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
+                        moves.append(base | ((r + 1) * 8 + c + 1) | (pieceIndex[self.board[r + 1][c + 1]] << 16))
         pass
 
     """
@@ -330,37 +1073,25 @@ class GameState:
     """
 
     def __getRookMoves(self, r: int, c: int, moves):
-        piecePined = False
-        pinDirection = ()
-        # Looks for pin information
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePined = True
-                pinDirection = self.pins[i][2:3]
-                if self.board[r][c][1] != 'Q':  # Can't remove queen pin from rook moves, only remove it on bisohp moves
-                    self.pins.remove(self.pins[i])
-                break
+        base = ((r * 8 + c) << 6) | (pieceIndex[self.board[r][c]] << 12)
+        pinDirection = self.pins.get(r * 8 + c)
+        piecePined = pinDirection is not None
 
         enemy = 'b' if self.whiteToMove else 'w'
-        for d in straightDirection:
-            for i in range(1, 8):
-                # Find the end location
-                endRow = r + i * d[0]
-                endCol = c + i * d[1]
-
-                if isInBoard(endRow, endCol):
-                    if not piecePined or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":  # Empty square
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+        rays = rayTable[r * 8 + c]
+        for i in range(4, 8):  # Straight directions of omniDirection
+            d = omniDirection[i]
+            if not piecePined or pinDirection == d or pinDirection == (-d[0], -d[1]):
+                for endRow, endCol in rays[i]:
+                    endPiece = self.board[endRow][endCol]
+                    if endPiece == "--":  # Empty square
+                        moves.append(base | (endRow * 8 + endCol))
 
-                        elif endPiece[0] == enemy:  # Enemy square, stop moving in that direction
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else:  # Allies square
-                            break
-                else:
-                    break
+                    elif endPiece[0] == enemy:  # Enemy square, stop moving in that direction
+                        moves.append(base | (endRow * 8 + endCol) | (pieceIndex[endPiece] << 16))
+                        break
+                    else:  # Allies square
+                        break
 
     """
     # Generate all the possible moves for the Bishops
@@ -370,36 +1101,25 @@ class GameState:
     """
 
     def __getBishopMoves(self, r: int, c: int, moves):
-        piecePined = False
-        pinDirection = ()
-        # Looks for pin information
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePined = True
-                pinDirection = self.pins[i][2:3]
-                self.pins.remove(self.pins[i])
-                break
+        base = ((r * 8 + c) << 6) | (pieceIndex[self.board[r][c]] << 12)
+        pinDirection = self.pins.get(r * 8 + c)
+        piecePined = pinDirection is not None
 
         enemy = 'b' if self.whiteToMove else 'w'
-        for d in diagonalDirection:
-            for i in range(1, 8):
-                # Find the end location
-                endRow = r + i * d[0]
-                endCol = c + i * d[1]
-
-                if isInBoard(endRow, endCol):
-                    if not piecePined or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":  # Empty square
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+        rays = rayTable[r * 8 + c]
+        for i in range(0, 4):  # Diagonal directions of omniDirection
+            d = omniDirection[i]
+            if not piecePined or pinDirection == d or pinDirection == (-d[0], -d[1]):
+                for endRow, endCol in rays[i]:
+                    endPiece = self.board[endRow][endCol]
+                    if endPiece == "--":  # Empty square
+                        moves.append(base | (endRow * 8 + endCol))
 
-                        elif endPiece[0] == enemy:  # Enemy square, stop moving in that direction
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else:  # Allies square
-                            break
-                else:
-                    break
+                    elif endPiece[0] == enemy:  # Enemy square, stop moving in that direction
+                        moves.append(base | (endRow * 8 + endCol) | (pieceIndex[endPiece] << 16))
+                        break
+                    else:  # Allies square
+                        break
 
     """
     # Generate all the possible moves for the Queens
@@ -417,51 +1137,32 @@ class GameState:
     """
 
     def __getKnightMoves(self, r: int, c: int, moves):
-        piecePined = False
-
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePined = True
-                self.pins.remove(self.pins[i])
-                break
+        if r * 8 + c in self.pins:  # A pinned knight can never move
+            return
+        base = ((r * 8 + c) << 6) | (pieceIndex[self.board[r][c]] << 12)
 
         allyColor = 'w' if self.whiteToMove else 'b'
-        for d in knightDirections:
-            endRow = r + d[0]
-            endCol = c + d[1]
-            if isInBoard(endRow, endCol):
-                if not piecePined:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+        for endRow, endCol in knightTable[r * 8 + c]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] != allyColor:
+                moves.append(base | (endRow * 8 + endCol) | (pieceIndex[endPiece] << 16))
+
+    """
+    # Generate all the legal moves for the King
+    # A square is safe when the enemy attack map does not cover it, enemy sliders see through our king
+    # so stepping back along a checking line is caught, defended enemy pieces are covered as well
+    """
 
     def __getKingMoves(self, r: int, c: int, moves):
-        allyColor = "w" if self.whiteToMove else "b"
-        for d in omniDirection:
-            endRow = r + d[0]
-            endCol = c + d[1]
-            print("Current Ally " + allyColor)
-            if isInBoard(endRow, endCol):
-                endPiece = self.board[endRow][endCol]
-                # Try to move the king to the new location and check for checks
-
-                if endPiece[0] != allyColor:
-                    print(endPiece)
-                    if self.whiteToMove:
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-
-                    inCheck, _, _ = self.__inCheckAnhKhoa()
-                    if not inCheck:
-                        print(str(Move((r, c), (endRow, endCol), self.board)))
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-                    # Revert the king move testing
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
+        base = ((r * 8 + c) << 6) | (pieceIndex[self.board[r][c]] << 12)
+        if self.whiteToMove:
+            allyColor, enemyAttacks = "w", self.attackMaps['b']
+        else:
+            allyColor, enemyAttacks = "b", self.attackMaps['w']
+        for endRow, endCol in kingTable[r * 8 + c]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] != allyColor and not (enemyAttacks >> (endRow * 8 + endCol)) & 1:
+                moves.append(base | (endRow * 8 + endCol) | (pieceIndex[endPiece] << 16))
 
     pass
 
@@ -477,6 +1178,7 @@ class GameState:
 
     def __getSiegeMoves(self, r: int, c: int, moves, maxLength: int):
         piece = self.board[r][c]
+        base = ((r * 8 + c) << 6) | (pieceIndex[piece] << 12)
         enemy = 'b' if self.whiteToMove else 'w'
         for d in mapDirection[piece[1]]:
             for i in range(1, maxLength):
@@ -487,10 +1189,10 @@ class GameState:
                 if (0 <= endRow < 8) and (0 <= endCol < 8):
 
                     if self.board[endRow][endCol] == "--":  # Empty square
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(base | (endRow * 8 + endCol))
 
                     elif self.board[endRow][endCol][0] == enemy:  # Enemy square, stop moving in that direction
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(base | (endRow * 8 + endCol) | (pieceIndex[self.board[endRow][endCol]] << 16))
                         break
                     else:  # Allies square
                         break
@@ -499,17 +1201,20 @@ class GameState:
 
     '''
     All moves without considering check
+    Walks the piece lists of the side to move, so empty squares are never visited
     '''
 
     def getAllPossibleMoves(self):
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)
+        moves = array('I')
+        metrics = self.metrics
+        for piece in colorPieces['w' if self.whiteToMove else 'b']:
+            moveFunction = self.moveFunctions[piece[1]]
+            if metrics is not None:
+                start = clock()
+            for sq in self.pieceSquares[piece]:
+                moveFunction(sq >> 3, sq & 7, moves)
+            if metrics is not None:
+                metrics.addTime("generate." + piece[1], start)
 
         return moves
 
@@ -517,10 +1222,13 @@ class GameState:
 """
 # Store the start and end coordinates of the move.
 # Along with the current state of the board just before the move is made
+# The engine itself works on packed codes, a Move is a view of one built for the UI and notation
 """
 
 
 class Move:
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "moveID", "code")
+
     def __init__(self, startSq, endSq, board):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
@@ -529,6 +1237,27 @@ class Move:
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
         self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        self.code = encodeMove(self.startRow, self.startCol, self.endRow, self.endCol,
+                               self.pieceMoved, self.pieceCaptured)
+
+    """
+    # Build the view of a packed move code without looking at a board
+    """
+
+    @classmethod
+    def fromCode(cls, code):
+        move = cls.__new__(cls)
+        start = (code >> 6) & 63
+        end = code & 63
+        move.startRow = start >> 3
+        move.startCol = start & 7
+        move.endRow = end >> 3
+        move.endCol = end & 7
+        move.pieceMoved = pieceCodes[(code >> 12) & 15]
+        move.pieceCaptured = pieceCodes[(code >> 16) & 15]
+        move.moveID = move.startRow * 1000 + move.startCol * 100 + move.endRow * 10 + move.endCol
+        move.code = code
+        return move
 
     def getChessNotation(self):
         return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
@@ -537,7 +1266,113 @@ class Move:
         return colsToFiles[c] + rowsToRanks[r]
 
     def __eq__(self, other):
-        return self.moveID == other.moveID
+        return isinstance(other, Move) and self.moveID == other.moveID
+
+    def __hash__(self):
+        return self.moveID
 
     def __str__(self):
         return str(self.moveID)
+
+
+"""
+# The legal moves of a position, backed by the array of packed codes from the generator
+# Move objects are built only when the list is iterated or indexed
+# 'move in moveList' looks the start and end squares up in a dictionary instead of scanning the list
+"""
+
+
+class MoveList:
+    __slots__ = ("codes", "__bySquares")
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.__bySquares = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        for code in self.codes:
+            yield Move.fromCode(code)
+
+    def __getitem__(self, i):
+        return Move.fromCode(self.codes[i])
+
+    def __contains__(self, move):
+        return self.find(move) is not None
+
+    """
+    # The legal code with the same start and end squares as the given Move, None if there is none
+    """
+
+    def find(self, move):
+        if self.__bySquares is None:
+            self.__bySquares = {code & 0xFFF: code for code in self.codes}
+        return self.__bySquares.get((((move.startRow * 8 + move.startCol) << 6) | (move.endRow * 8 + move.endCol)))
+
+
+"""
+# Read-only view of GameState.moveLog, turns the stored codes into Move objects on access
+"""
+
+
+class MoveLog:
+    __slots__ = ("codes",)
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        for code in self.codes:
+            yield Move.fromCode(code)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Move.fromCode(code) for code in self.codes[i]]
+        return Move.fromCode(self.codes[i])
+
+
+"""
+# Legal moves by position, for GameState.moveCache: zobristKey (board and side to move) ->
+# (move codes, isInCheck, checkMate, staleMate). Holds at most 'capacity' positions, the least recently
+# used one is evicted first
+"""
+
+
+class MoveCache:
+    def __init__(self, capacity=1024):
+        self.capacity = max(1, capacity)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,205 @@
+"""
+EPD suite runner: runs perft or a search on every position of an EPD file, spread over a process pool.
+
+One position per line: the FEN fields (placement, side, castling, en passant, optionally the two counters)
+followed by ';' separated operations. Perft suites give the expected counts as "D<depth> <nodes>",
+"id" names the position, anything else is kept and echoed back.
+    rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - ;D1 20 ;D2 400 ;id "start"
+
+The file is read line by line and the results are written as they arrive (in file order), one JSON object
+per position with its timing, so suites of any size run in a bounded amount of memory.
+Positions with castling rights or en passant squares are run like any other, but the engine does not
+play those moves yet, so their reference perft counts can differ.
+
+Usage (from the project root):
+    python -m Chess.ChessEpd perftsuite.epd --perft 3 -j 8 -o results.jsonl
+    python -m Chess.ChessEpd tactics.epd --search --depth 4
+    python -m Chess.ChessEpd tactics.epd --search --time 0.5 --limit 100
+
+Exit status: 0 ok, 1 a perft count differs from the reference or a line could not be parsed.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from Chess import ChessEngine
+from Chess.ChessPerft import perftByDepth
+from Chess.ChessSearch import Searcher, formatScore
+from Chess.ChessTransposition import TranspositionTable
+
+"""
+# Split an EPD line into (fen, {opcode: operand string})
+# Returns None for blank lines and comments (#)
+"""
+
+
+def parseEpd(line):
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    head, _, rest = line.partition(";")
+    fields = head.split()
+    if len(fields) < 4:
+        raise ValueError("EPD needs at least 4 FEN fields: " + line)
+    # Operations may also follow the 4 fields without a ';' before the first one
+    fen = " ".join(fields[:6] if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit() else fields[:4])
+    first = " ".join(fields[len(fen.split()):])
+    operations = {}
+    for operation in [first] + rest.split(";"):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(" ")
+            operations[opcode] = operand.strip().strip('"')
+    return fen, operations
+
+
+"""
+# Reference perft counts of a parsed line, index 0 = depth 1, None where the suite gives none
+"""
+
+
+def referenceCounts(operations):
+    counts = {}
+    for opcode, operand in operations.items():
+        if len(opcode) > 1 and opcode[0] == "D" and opcode[1:].isdigit():
+            counts[int(opcode[1:])] = int(operand)
+    if not counts:
+        return []
+    return [counts.get(depth) for depth in range(1, max(counts) + 1)]
+
+
+"""
+# Work on one position inside a pool process
+# task: (line number, line, settings dict), returns the result dict written to the output
+"""
+
+
+def runTask(task):
+    lineNumber, line, settings = task
+    result = {"line": lineNumber}
+    try:
+        parsed = parseEpd(line)
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+    if parsed is None:
+        return None
+    fen, operations = parsed
+    result["fen"] = fen
+    if "id" in operations:
+        result["id"] = operations["id"]
+    try:
+        gs = ChessEngine.newGameState(settings["backend"])
+        gs.setFen(fen)
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+
+    start = time.perf_counter()
+    if settings["mode"] == "perft":
+        reference = referenceCounts(operations)
+        depth = settings["depth"] or len(reference) or 1
+        counts = perftByDepth(gs, depth)
+        result["counts"] = counts
+        result["nodes"] = sum(counts)
+        result["ok"] = all(ref is None or ref == count for count, ref in zip(counts, reference))
+        if reference:
+            result["reference"] = reference[:depth]
+    else:
+        tt = TranspositionTable(settings["hash"]) if settings["hash"] > 0 else None
+        searched = Searcher(tt=tt).search(gs, settings["depth"] or 64, settings["time"], settings["nodes"])
+        result["bestmove"] = searched.bestMove.getChessNotation() if searched.bestMove is not None else None
+        result["score"] = formatScore(searched.score)
+        result["depth"] = searched.depth
+        result["nodes"] = searched.nodes
+        for opcode in ("bm", "am"):  # Expected/avoid moves, echoed for comparison
+            if opcode in operations:
+                result[opcode] = operations[opcode]
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+"""
+# Run every position of an EPD file, yields result dicts in file order
+# workers: pool size, 1 runs everything in this process
+"""
+
+
+def runSuite(path, settings, workers=1, limit=None):
+    with open(path) as f:
+        tasks = ((lineNumber, line, settings) for lineNumber, line in enumerate(f, 1)
+                 if line.strip() and not line.lstrip().startswith("#"))
+        tasks = itertools.islice(tasks, limit)
+        if workers <= 1:
+            for result in map(runTask, tasks):
+                if result is not None:
+                    yield result
+            return
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            for result in pool.imap(runTask, tasks, chunksize=4):
+                if result is not None:
+                    yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run perft or a search on every position of an EPD file")
+    parser.add_argument("epd", help="EPD file, one position per line")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--perft", type=int, nargs="?", const=0, metavar="DEPTH",
+                      help="Perft to DEPTH (default: every depth the line has a D<n> count for)")
+    mode.add_argument("--search", action="store_true", help="Search each position for a best move")
+    parser.add_argument("-d", "--depth", type=int, help="Search depth (with --search)")
+    parser.add_argument("-t", "--time", type=float, help="Search time per position in seconds")
+    parser.add_argument("-n", "--nodes", type=int, help="Search node budget per position")
+    parser.add_argument("--hash", type=float, default=4, help="Transposition table size in MB per search")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--limit", type=int, help="Only run the first LIMIT positions")
+    parser.add_argument("-o", "--output", help="Write one JSON result per position to this file")
+    args = parser.parse_args(argv)
+
+    if args.search:
+        if args.depth is None and args.time is None and args.nodes is None:
+            args.time = 1.0
+        settings = {"mode": "search", "depth": args.depth, "time": args.time, "nodes": args.nodes,
+                    "hash": args.hash, "backend": args.backend}
+    else:
+        settings = {"mode": "perft", "depth": args.perft or 0, "backend": args.backend}
+
+    output = open(args.output, "w") if args.output else None
+    positions = failed = errors = nodes = 0
+    start = time.perf_counter()
+    try:
+        for result in runSuite(args.epd, settings, args.jobs, args.limit):
+            positions += 1
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+            name = result.get("id", "line %d" % result["line"])
+            if "error" in result:
+                errors += 1
+                print("%s: ERROR %s" % (name, result["error"]))
+                continue
+            nodes += result["nodes"]
+            if settings["mode"] == "perft":
+                if not result["ok"]:
+                    failed += 1
+                    print("%s: MISMATCH %s expected %s" % (name, result["counts"], result["reference"]))
+            elif output is None:
+                print("%s: %s %s (depth %d, %.3fs)" % (name, result["bestmove"], result["score"],
+                                                       result["depth"], result["seconds"]))
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print("%d positions in %.2fs (%.1f positions/s, %.0f nps over %d workers), %d mismatches, %d errors" % (
+        positions, elapsed, positions / elapsed if elapsed > 0 else 0.0, nodes / elapsed if elapsed > 0 else 0.0,
+        max(1, args.jobs), failed, errors))
+    return 1 if failed or errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Evaluation: material and piece-square tables, tapered between middlegame and endgame, kept up to date move by move.
+
+An Evaluation attached to a game state (gs.evaluation) holds the middlegame and endgame sums for white minus
+black and the game phase. makeMoveCode/undoMove hand it every move code, and the moved and captured pieces in
+the code give the change directly: the moved piece's table value at the end square minus the start square,
+minus whatever stood on the end square. A leaf evaluation is then a blend of two numbers instead of a walk over
+the 64 squares. evaluateFull does that walk with the same tables, for checking and for comparison.
+
+Phase: knights and bishops count 1, rooks 2, queens 4, 24 with every piece on the board. The score is
+(middlegame * phase + endgame * (24 - phase)) / 24, so the endgame tables take over as pieces come off.
+Tables are the Simplified Evaluation Function ones, written from white's side with rank 8 in the first row,
+which is also how the board is indexed (r * 8 + c). Black reads them mirrored.
+
+Usage (from the project root):
+    python -m Chess.ChessEval                 # check against evaluateFull, time leaf evaluations and a search
+    python -m Chess.ChessEval --depth 5 -b bitboard
+"""
+import argparse
+import random
+import sys
+import time
+
+from Chess import ChessEngine
+from Chess.ChessPgn import STANDARD_FEN
+from Chess.ChessSearch import Searcher
+
+MIDDLEGAME_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+ENDGAME_VALUES = {'p': 120, 'N': 300, 'B': 320, 'R': 520, 'Q': 920, 'K': 0}
+PHASE_WEIGHTS = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+FULL_PHASE = 24
+
+PAWN = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0]
+PAWN_ENDGAME = [bonus for bonus in (0, 80, 50, 30, 15, 5, 0, 0) for _ in range(8)]  # Passers decide endgames
+KNIGHT = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0]
+QUEEN = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20]
+KING = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20]
+KING_ENDGAME = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+MIDDLEGAME_TABLES = {'p': PAWN, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING}
+ENDGAME_TABLES = {'p': PAWN_ENDGAME, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING_ENDGAME}
+
+"""
+# Signed value (white +, black -, material included) of every piece on every square, by the piece index of
+# a move code, index 0 ("--") is all zeros so a quiet move's captured piece costs nothing
+"""
+
+
+def _signedTables(values, tables):
+    signed = [[0] * 64]
+    for piece in ChessEngine.pieceCodes[1:]:
+        kind = piece[1]
+        if piece[0] == 'w':
+            signed.append([values[kind] + tables[kind][sq] for sq in range(64)])
+        else:
+            signed.append([-(values[kind] + tables[kind][sq ^ 56]) for sq in range(64)])  # sq ^ 56 mirrors the rank
+    return signed
+
+
+middlegameTable = _signedTables(MIDDLEGAME_VALUES, MIDDLEGAME_TABLES)
+endgameTable = _signedTables(ENDGAME_VALUES, ENDGAME_TABLES)
+phaseTable = [0] + [PHASE_WEIGHTS[piece[1]] for piece in ChessEngine.pieceCodes[1:]]
+
+
+def _blend(middlegame, endgame, phase):
+    phase = min(phase, FULL_PHASE)  # More pieces than the start position cannot mean more than the middlegame
+    return (middlegame * phase + endgame * (FULL_PHASE - phase)) // FULL_PHASE
+
+
+class Evaluation:
+    __slots__ = ("middlegame", "endgame", "phase")
+
+    def __init__(self, board):
+        self.reset(board)
+
+    def reset(self, board):
+        self.middlegame = self.endgame = self.phase = 0
+        for r in range(8):
+            for c in range(8):
+                index = ChessEngine.pieceIndex[board[r][c]]
+                self.middlegame += middlegameTable[index][r * 8 + c]
+                self.endgame += endgameTable[index][r * 8 + c]
+                self.phase += phaseTable[index]
+
+    def makeMove(self, code):
+        start = (code >> 6) & 63
+        end = code & 63
+        moved = (code >> 12) & 15
+        captured = (code >> 16) & 15
+        table = middlegameTable[moved]
+        self.middlegame += table[end] - table[start] - middlegameTable[captured][end]
+        table = endgameTable[moved]
+        self.endgame += table[end] - table[start] - endgameTable[captured][end]
+        self.phase -= phaseTable[captured]
+
+    def undoMove(self, code):
+        start = (code >> 6) & 63
+        end = code & 63
+        moved = (code >> 12) & 15
+        captured = (code >> 16) & 15
+        table = middlegameTable[moved]
+        self.middlegame -= table[end] - table[start] - middlegameTable[captured][end]
+        table = endgameTable[moved]
+        self.endgame -= table[end] - table[start] - endgameTable[captured][end]
+        self.phase += phaseTable[captured]
+
+    """
+    # Tapered score for the side to move
+    """
+
+    def score(self, whiteToMove):
+        score = _blend(self.middlegame, self.endgame, self.phase)
+        return score if whiteToMove else -score
+
+
+"""
+# Give gs an Evaluation that follows its moves from now on, returns it
+"""
+
+
+def attachEvaluation(gs):
+    gs.evaluation = Evaluation(gs.board)
+    return gs.evaluation
+
+
+"""
+# Searcher evaluation functions, both from the point of view of the side to move and always equal:
+# evaluateIncremental reads gs.evaluation (attached on first use), evaluateFull walks the board
+"""
+
+
+def evaluateIncremental(gs):
+    evaluation = gs.evaluation
+    if evaluation is None:
+        evaluation = attachEvaluation(gs)
+    return evaluation.score(gs.whiteToMove)
+
+
+def evaluateFull(gs):
+    middlegame = endgame = phase = 0
+    sq = 0
+    for row in gs.board:
+        for piece in row:
+            if piece != "--":
+                index = ChessEngine.pieceIndex[piece]
+                middlegame += middlegameTable[index][sq]
+                endgame += endgameTable[index][sq]
+                phase += phaseTable[index]
+            sq += 1
+    score = _blend(middlegame, endgame, phase)
+    return score if gs.whiteToMove else -score
+
+
+"""
+# Random games on gs (restored afterwards) that compare the incremental score with evaluateFull after every
+# move and every undo. Returns (positions checked, mismatches)
+"""
+
+
+def verify(gs, games=20, maxPlies=120, seed=1):
+    rng = random.Random(seed)
+    attachEvaluation(gs)
+    checked = mismatches = 0
+    for _ in range(games):
+        plies = 0
+        for _ in range(maxPlies):
+            codes = gs.getValidMoveCodes()
+            if len(codes) == 0:
+                break
+            gs.makeMoveCode(rng.choice(codes))
+            plies += 1
+            checked += 1
+            mismatches += evaluateIncremental(gs) != evaluateFull(gs)
+        for _ in range(plies):
+            gs.undoMove()
+            checked += 1
+            mismatches += evaluateIncremental(gs) != evaluateFull(gs)
+    return checked, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and time the incremental evaluation against a full scan")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    parser.add_argument("-d", "--depth", type=int, default=5, help="Depth of the timed searches")
+    parser.add_argument("--games", type=int, default=20, help="Random games for the check")
+    args = parser.parse_args(argv)
+
+    gs = ChessEngine.newGameState(args.backend)
+    checked, mismatches = verify(gs, args.games)
+    print("check: %d positions, %d mismatches" % (checked, mismatches))
+
+    # Leaf cost, timed on a position 40 random plies into a game
+    rng = random.Random(2)
+    for _ in range(40):
+        codes = gs.getValidMoveCodes()
+        if len(codes) == 0:
+            break
+        gs.makeMoveCode(rng.choice(codes))
+    repeats = 2000
+    for name, evaluate in (("full", evaluateFull), ("incremental", evaluateIncremental)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            evaluate(gs)
+        print("%-12s leaf evaluation %.2f us" % (name, (time.perf_counter() - start) * 1e6 / repeats))
+
+    for name, evaluate in (("full", evaluateFull), ("incremental", evaluateIncremental)):
+        gs = ChessEngine.newGameState(args.backend)
+        gs.setFen(STANDARD_FEN)
+        result = Searcher(evaluate).search(gs, args.depth)
+        print("%-12s search depth %d: %d nodes in %.3fs (%.0f nps), score %d, best %s" % (
+            name, result.depth, result.nodes, result.seconds, result.nps(), result.score,
+            result.bestMove.getChessNotation()))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,7 @@ Date: [I forgor]
 # Import the pygame module and ChessEngine from the Chess package
 import pygame as pg
 from Chess import ChessEngine
+from Chess.ChessWorker import EngineWorker
 from nguyenpanda.swan import Color
 
 # Initialize pygame
@@ -24,9 +25,13 @@ pg.init()
 WIDTH = HEIGHT = 512                # Window size, assuming a square window
 DIMENSION = 8                       # Dimension of the chessboard (8x8)
 SQ_SIZE = WIDTH // DIMENSION        # Size of each square on the chessboard
-MAX_FPS = 30
+MAX_FPS = 30                        # Upper bound on redraws per second while events keep coming
 IMG_PATH = "Chess/images/1xR/"
 IMAGES = {}                         # Dictionary to hold images of chess pieces
+BACKEND = "string"                  # Board representation: "string" or "bitboard" (see ChessEngine.newGameState)
+ENGINE_COLOR = None                 # "w" or "b" to let the engine play that side, None for two players
+ENGINE_TIME = 3.0                   # Seconds the engine thinks per move
+MOVE_CACHE = 1024                   # Positions whose legal moves are remembered for undo and revisits, 0 for none
 
 '''
 Function to load and scale images of the chess pieces
@@ -46,21 +51,44 @@ def main():
     screen     = pg.display.set_mode((WIDTH, HEIGHT))   # Create the game window
     screen.fill(pg.Color("white"))                  # Set the background color of the window to white
     clock      = pg.time.Clock()                         # Initialize a clock for controlling the game's frame rate
-    gs         = ChessEngine.GameState()                    # Initialize the game state
+    gs         = ChessEngine.newGameState(BACKEND)          # Initialize the game state
+    worker     = EngineWorker(moveCache=MOVE_CACHE)  # Move generation and search run in the background
+    gs.setMoveCache(MOVE_CACHE)                     # For the moves worked out here when the worker is too slow
 
-    validMoves = gs.getValidMoves()
+    worker.requestMoves(gs)
+    validMoves = None                               # Legal moves of the current position, None until the worker answers
+    enginePaused = False                            # Set by undo so the engine does not replay at once
+    frameDue   = pg.time.get_ticks()
     moveMade   = False
     sqSelected = ()                                 # Keep track of the last click of the user (tuple: (row, col))
     playerClick = []                                  # Keep track of the player's click (two tuples: [(6,4), (4,4)]) )
     loadImages()
+    boardSurface = renderBoard()                    # The empty board, drawn once
+    pg.event.set_blocked(pg.MOUSEMOTION)            # Nothing follows the mouse, do not wake up for it
+    drawGameState(screen, gs, playerClick, boardSurface)
+    pg.display.flip()
 
 
     running = True
     while running:  # Main game loop
-        for e in pg.event.get():
+        dirty = set()                               # Squares to redraw after this round of events
+        if worker.busy():
+            # Wake up every frame to poll the worker, on a fixed schedule so waits for the search thread do not add up
+            now = pg.time.get_ticks()
+            if frameDue <= now:
+                frameDue = frameDue + 1000 // MAX_FPS if now - frameDue < 1000 // MAX_FPS else now + 1000 // MAX_FPS
+            events = [pg.event.wait(frameDue - now)] + pg.event.get()
+        else:
+            # Sleep until something happens, then take everything that queued up meanwhile
+            events = [pg.event.wait()] + pg.event.get()
+        for e in events:
+            highlighted = selectedSquare(playerClick)
             # EXIT
             if e.type == pg.QUIT:   # Check for the QUIT event to stop the game
                 running = False
+            # The window was uncovered or restored, everything has to be drawn again
+            elif e.type in (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED):
+                dirty.update((r, c) for r in range(DIMENSION) for c in range(DIMENSION))
             # Mouse handler
             elif e.type == pg.MOUSEBUTTONDOWN:  # Move a piece but clicking on the square
                 location = pg.mouse.get_pos()   # (x, y) location of the mouse
@@ -89,10 +117,16 @@ def main():
                             print(Color['c'] + "White to move")
                         else:
                             print(Color['p'] + "Black to move")
+                        if validMoves is None:  # Moved before the worker answered, drop its work and look here
+                            worker.cancel()
+                            validMoves = gs.getValidMoves()
                         if move in validMoves:
                             print(move.getChessNotation())
                             print(move.moveID)
                             gs.makeMove(move)
+                            dirty.update(((move.startRow, move.startCol), (move.endRow, move.endCol)))
+                            validMoves = None
+                            enginePaused = False
                             moveMade = True
                             sqSelected = ()
                             playerClick = []
@@ -107,30 +141,84 @@ def main():
             # Key handler
             elif e.type == pg.KEYDOWN:
                 if e.key == pg.K_z:
+                    if len(gs.moveLog) > 0:
+                        undone = gs.moveLog[-1]
+                        dirty.update(((undone.startRow, undone.startCol), (undone.endRow, undone.endCol)))
                     gs.undoMove()
                     sqSelected = ()
                     playerClick = []
+                    validMoves  = None
+                    enginePaused = True
                     moveMade    = True
+            if selectedSquare(playerClick) != highlighted:  # The selection moved: clear the old one, draw the new
+                dirty.update(square for square in (highlighted, selectedSquare(playerClick)) if square)
 
-        if moveMade:
-            validMoves = gs.getValidMoves()
+        if moveMade:                                # Supersedes whatever the worker was still doing
+            worker.requestMoves(gs)
             moveMade   = False
 
-        drawGameState(screen, gs,playerClick)
-        clock.tick(MAX_FPS)
-        pg.display.flip()           # Refresh the game screen
+        answer = worker.poll()
+        if answer is not None:
+            kind, result = answer
+            if kind == "moves":
+                validMoves = result
+                if ENGINE_COLOR == ("w" if gs.whiteToMove else "b") and len(validMoves) > 0 and not enginePaused:
+                    worker.requestSearch(gs, ENGINE_TIME)
+            elif result.bestMove is not None:       # The engine's move
+                move = result.bestMove
+                print(move.getChessNotation())
+                gs.makeMove(move)
+                dirty.update(((move.startRow, move.startCol), (move.endRow, move.endCol)))
+                worker.requestMoves(gs)
 
+        if dirty:
+            pg.display.update(drawSquares(screen, gs, playerClick, boardSurface, dirty))   # Push only those squares
+        if not worker.busy():
+            clock.tick(MAX_FPS)
+
+    worker.close()
     #print(gs.board)
 
 '''
 Responsible for all graphics within a current game state.
 '''
-def drawGameState(screen, gs, playerClick):
+def drawGameState(screen, gs, playerClick, boardSurface):
     # Order of calling these 2 functions are important.
-    drawBoard(screen)
+    screen.blit(boardSurface, (0, 0))
     drawSelectionSquare(screen,playerClick)
     drawPieces(screen,gs.board)
 
+'''
+Redraw only the given squares (row, col) from the pre-rendered board, returns their rects for pg.display.update
+'''
+def drawSquares(screen, gs, playerClick, boardSurface, squares):
+    rects = []
+    selected = selectedSquare(playerClick)
+    for r, c in squares:
+        rect = pg.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(boardSurface, rect, rect)   # Background of this square only
+        if (r, c) == selected:
+            pg.draw.rect(screen, "brown2", rect)
+        piece = gs.board[r][c]
+        if piece != "--":
+            screen.blit(IMAGES[piece], rect)
+        rects.append(rect)
+    return rects
+
+'''
+Square highlighted by drawSelectionSquare, None when there is none
+'''
+def selectedSquare(playerClick):
+    return playerClick[0] if len(playerClick) == 1 else None
+
+'''
+Draw the empty board once on a surface of its own, redraws copy squares out of it
+'''
+def renderBoard():
+    surface = pg.Surface((WIDTH, HEIGHT)).convert()
+    drawBoard(surface)
+    return surface
+
 '''
 Draw the square on the board
 '''
@@ -0,0 +1,141 @@
+"""
+Metrics: named counters and timers for profiling the engine without printing.
+
+A GameState only records anything once a Metrics object is attached (gs.metrics = Metrics(...)),
+with nothing attached the hot paths pay a single 'is not None' test.
+Aggregates stay in memory until flush() hands them to the sinks:
+    MemorySink      - keeps running totals (and recent events) in memory
+    JsonLinesSink   - appends one JSON object per flush/event to a file
+    NullSink        - drops everything
+
+Usage:
+    metrics = Metrics([MemorySink()])
+    gs.metrics = metrics
+    ...
+    print(metrics.report())
+"""
+import json
+import time
+from collections import deque
+
+clock = time.perf_counter  # Start value for Metrics.addTime
+
+
+class Metrics:
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks) if sinks is not None else []
+        self.counters = {}
+        self.timers = {}  # name -> [calls, seconds]
+
+    def addSink(self, sink):
+        self.sinks.append(sink)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    """
+    # Add the time since 'start' (a clock() value) to a timer
+    """
+
+    def addTime(self, name, start):
+        elapsed = clock() - start
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, elapsed]
+        else:
+            timer[0] += 1
+            timer[1] += elapsed
+
+    """
+    # Something worth a record of its own (a checkmate, a finished search...), sent to the sinks right away
+    """
+
+    def event(self, name, **fields):
+        record = {"type": "event", "name": name, "time": time.time()}
+        record.update(fields)
+        for sink in self.sinks:
+            sink.write(record)
+
+    def snapshot(self):
+        return {"type": "metrics", "time": time.time(), "counters": dict(self.counters),
+                "timers": {name: {"calls": calls, "seconds": seconds}
+                           for name, (calls, seconds) in self.timers.items()}}
+
+    def reset(self):
+        self.counters = {}
+        self.timers = {}
+
+    """
+    # Send the aggregates collected since the last flush to every sink and start over
+    """
+
+    def flush(self):
+        record = self.snapshot()
+        for sink in self.sinks:
+            sink.write(record)
+        self.reset()
+        return record
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    """
+    # Human readable table of the current aggregates
+    """
+
+    def report(self):
+        lines = []
+        for name in sorted(self.timers):
+            calls, seconds = self.timers[name]
+            lines.append("%-24s %10d calls %10.3f ms %8.2f us/call" % (
+                name, calls, seconds * 1000, seconds * 1e6 / calls if calls else 0.0))
+        for name in sorted(self.counters):
+            lines.append("%-24s %10d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+
+class NullSink:
+    def write(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+"""
+# Running totals of every flushed snapshot, plus the last 'maxEvents' events
+"""
+
+
+class MemorySink:
+    def __init__(self, maxEvents=1000):
+        self.counters = {}
+        self.timers = {}
+        self.events = deque(maxlen=maxEvents)
+
+    def write(self, record):
+        if record["type"] == "event":
+            self.events.append(record)
+            return
+        for name, n in record["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for name, timer in record["timers"].items():
+            total = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0})
+            total["calls"] += timer["calls"]
+            total["seconds"] += timer["seconds"]
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
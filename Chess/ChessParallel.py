@@ -0,0 +1,177 @@
+"""
+Parallel search (Lazy SMP): several processes search the same position and share one transposition table.
+
+Every worker runs the ordinary Searcher on its own copy of the game state. They only talk through a
+SharedTranspositionTable, so a result stored by one worker is a hash hit for all the others. The main
+process searches as well and its result is the one returned, the helpers are stopped as soon as it is done.
+Odd helpers start one ply deeper so the workers do not walk the same tree in lockstep.
+
+Helper processes are started once (spawn) and reused for every search, close() shuts them down.
+
+Usage (from the project root):
+    python -m Chess.ChessParallel --threads 4 --time 5
+    python -m Chess.ChessParallel --benchmark 1,2,4 --depth 5
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from Chess import ChessEngine
+from Chess.ChessPerft import loadPosition
+from Chess.ChessSearch import Searcher, evaluateMaterial, formatScore, MAX_DEPTH
+from Chess.ChessTransposition import SharedTranspositionTable
+
+"""
+# Body of a helper process: attach to the table, then run one search per task until told to quit (None)
+# A task is (game state class, board, whiteToMove, startDepth), the reply is the number of nodes searched
+"""
+
+
+def _helperLoop(ttName, tasks, results, stopEvent, evaluate):
+    tt = SharedTranspositionTable(name=ttName)
+    searcher = Searcher(evaluate, tt, stopEvent)
+    results.put(0)  # Ready
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        gameStateClass, board, whiteToMove, startDepth = task
+        gs = gameStateClass()
+        gs.setBoard(board, whiteToMove)
+        results.put(searcher.search(gs, MAX_DEPTH, startDepth=startDepth).nodes)
+    tt.close()
+
+
+"""
+# threads: total number of searching processes, this one included (1 = plain single process search)
+# stopEvent and tablebases go to the Searcher of this process, see Searcher
+"""
+
+
+class ParallelSearcher:
+    def __init__(self, threads=1, hashMB=16, evaluate=evaluateMaterial, stopEvent=None, tablebases=None):
+        self.threads = max(1, threads)
+        self.tt = SharedTranspositionTable(hashMB)
+        context = multiprocessing.get_context("spawn")
+        self.stopEvent = context.Event()
+        self.results = context.Queue()
+        self.tasks = []
+        self.helpers = []
+        for _ in range(self.threads - 1):
+            tasks = context.Queue()
+            helper = context.Process(target=_helperLoop, daemon=True,
+                                     args=(self.tt.name, tasks, self.results, self.stopEvent, evaluate))
+            helper.start()
+            self.tasks.append(tasks)
+            self.helpers.append(helper)
+        for _ in self.helpers:  # Wait until every helper is attached, so start-up is not timed as search
+            self.results.get()
+        self.searcher = Searcher(evaluate, self.tt, stopEvent, tablebases)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for helper in self.helpers:
+            helper.join()
+        self.tasks = []
+        self.helpers = []
+        self.tt.close()
+        self.tt.unlink()
+
+    def stop(self):
+        self.searcher.stop()
+
+    """
+    # Same arguments and result as Searcher.search, the budgets apply to the main search
+    # result.nodes counts the main process only, result.helperNodes the rest
+    """
+
+    def search(self, gs, maxDepth=MAX_DEPTH, timeLimit=None, nodeLimit=None, onIteration=None):
+        self.stopEvent.clear()
+        board = [list(row) for row in gs.board]
+        for i, tasks in enumerate(self.tasks):
+            tasks.put((type(gs), board, gs.whiteToMove, 1 + (i + 1) % 2))
+        try:
+            result = self.searcher.search(gs, maxDepth, timeLimit, nodeLimit, onIteration)
+        finally:
+            self.stopEvent.set()
+            helperNodes = sum(self.results.get() for _ in self.helpers)
+        result.helperNodes = helperNodes
+        return result
+
+
+"""
+# Time to finish a fixed depth with every thread count, each run on an empty table
+# Returns a list of dicts (threads, seconds, nodes, helperNodes, speedup against the first count)
+"""
+
+
+def benchmark(gs, depth, threadCounts, hashMB=16):
+    rows = []
+    for threads in threadCounts:
+        with ParallelSearcher(threads, hashMB) as searcher:
+            start = time.perf_counter()
+            result = searcher.search(gs, depth)
+            seconds = time.perf_counter() - start
+        rows.append({"threads": threads, "seconds": seconds, "nodes": result.nodes,
+                     "helperNodes": result.helperNodes, "depth": result.depth,
+                     "speedup": rows[0]["seconds"] / seconds if rows else 1.0})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lazy SMP search over several processes")
+    parser.add_argument("--placement", help="FEN piece placement to search (default: GameState start)")
+    parser.add_argument("--black", action="store_true", help="Black to move in --placement")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    parser.add_argument("-j", "--threads", type=int, default=os.cpu_count() or 1,
+                        help="Number of searching processes (default: one per CPU)")
+    parser.add_argument("-d", "--depth", type=int, default=MAX_DEPTH, help="Maximum depth")
+    parser.add_argument("-t", "--time", type=float, help="Time budget in seconds")
+    parser.add_argument("-n", "--nodes", type=int, help="Node budget of the main search")
+    parser.add_argument("--hash", type=float, default=16, help="Shared transposition table size in MB")
+    parser.add_argument("--benchmark", help="Comma separated thread counts, time --depth with each one")
+    args = parser.parse_args(argv)
+
+    gs = ChessEngine.newGameState(args.backend)
+    if args.placement:
+        loadPosition(gs, args.placement, not args.black)
+
+    if args.benchmark:
+        depth = args.depth if args.depth != MAX_DEPTH else 5
+        threadCounts = [int(n) for n in args.benchmark.split(",")]
+        print("depth %d, %d CPUs" % (depth, os.cpu_count() or 1))
+        for row in benchmark(gs, depth, threadCounts, args.hash):
+            print("threads %2d: %.3fs, %d nodes (+%d in helpers), speedup %.2fx" % (
+                row["threads"], row["seconds"], row["nodes"], row["helperNodes"], row["speedup"]))
+        return 0
+
+    if args.depth == MAX_DEPTH and args.time is None and args.nodes is None:
+        args.time = 5.0  # Never run unbounded by accident
+
+    def report(info):
+        print("depth %d score %s nodes %d nps %.0f time %.3f pv %s" % (
+            info["depth"], formatScore(info["score"]), info["nodes"], info["nps"], info["seconds"],
+            " ".join(move.getChessNotation() for move in info["pv"])))
+
+    with ParallelSearcher(args.threads, args.hash) as searcher:
+        result = searcher.search(gs, args.depth, args.time, args.nodes, report)
+    if result.bestMove is None:
+        print("no legal moves")
+        return 1
+    print("bestmove %s (depth %d, %d nodes + %d in %d helpers, %.3fs)" % (
+        result.bestMove.getChessNotation(), result.depth, result.nodes, result.helperNodes,
+        args.threads - 1, result.seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
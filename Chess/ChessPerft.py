@@ -0,0 +1,267 @@
+"""
+Perft (performance test) for the move generator.
+
+Walks the game tree with GameState.getValidMoveCodes/makeMoveCode/undoMove, counts the
+nodes at every depth and compares them with stored reference counts.
+Also reports wall time and nodes per second so generator throughput can be tracked.
+
+Usage (from the project root):
+    python -m Chess.ChessPerft                              # run the whole reference suite
+    python -m Chess.ChessPerft -p start -d 3 --divide       # node count per root move
+    python -m Chess.ChessPerft --placement 8/8/8/8/8/8/8/K1k5 --black -d 2
+    python -m Chess.ChessPerft --min-nps 5000 --baseline perft_baseline.json
+    python -m Chess.ChessPerft --backend bitboard
+    python -m Chess.ChessPerft -p pins --metrics --metrics-file perft_metrics.jsonl
+
+The full run also checks that positions without exactly one king per side are refused (INVALID_POSITIONS).
+
+Exit status: 0 ok, 1 node count mismatch or an invalid position accepted, 2 throughput below the threshold.
+"""
+import argparse
+import json
+import sys
+import time
+
+from Chess import ChessEngine
+from Chess.ChessMetrics import Metrics, JsonLinesSink
+
+# Reference node counts per depth (index 0 = depth 1).
+# The engine does not implement castling, en-passant or promotion yet, so every position
+# is stored without castling rights and only to the depth where none of those moves appear.
+# Counts were cross-checked against a reference move generator.
+REFERENCE_POSITIONS = {
+    "start": {"placement": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR", "whiteToMove": True,
+              "counts": [20, 400, 8902, 197281]},
+    "default": {"placement": "r3k2r/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR", "whiteToMove": True,
+                "counts": [20, 460, 10237, 232049]},  # The layout GameState() starts with
+    "position3": {"placement": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8", "whiteToMove": True,
+                  "counts": [14, 191]},
+    "pins": {"placement": "1r3b2/pbp1k3/1p1pq2N/1P1PpP1p/4n1pP/P7/1n1BB3/RN2K2R", "whiteToMove": True,
+             "counts": [27, 959]},
+    "checks": {"placement": "2b5/p2p1B2/2rk1pqn/1Pr1p1P1/NP3p1p/B4P1P/3R2KR/5Q2", "whiteToMove": False,
+               "counts": [4, 165, 5393]},
+    "middlegame": {"placement": "r1b1kr2/1n2bppp/p1pp4/1pP1p3/5B1P/2NP1PQN/nP2P1P1/3RKB1R", "whiteToMove": True,
+                   "counts": [36, 1166]},
+}
+
+# Positions every backend has to reject with a ValueError instead of generating moves for them
+INVALID_POSITIONS = {
+    "no white king": "8/8/8/8/8/8/8/k7 w - - 0 1",
+    "two white kings": "k7/8/8/8/8/8/8/K6K w - - 0 1",
+}
+
+"""
+# Set up the board from the piece placement field of a FEN string
+"""
+
+
+def loadPosition(gs, placement: str, whiteToMove: bool = True):
+    gs.setBoard(ChessEngine.parsePlacement(placement), whiteToMove)
+    return gs
+
+
+"""
+# Check that setFen and setBoard (through loadPosition) refuse every INVALID_POSITIONS entry
+# Returns the number of positions that were accepted
+"""
+
+
+def checkInvalidPositions(backend):
+    accepted = 0
+    for name, fen in sorted(INVALID_POSITIONS.items()):
+        print(name)
+        for label, load in (("setFen", lambda gs: gs.setFen(fen)),
+                            ("setBoard", lambda gs: loadPosition(gs, fen.split()[0]))):
+            gs = ChessEngine.newGameState(backend)
+            try:
+                load(gs)
+            except ValueError:
+                print("  %s: rejected  ok" % label)
+            else:
+                print("  %s: ACCEPTED (expected a ValueError)" % label)
+                accepted += 1
+    return accepted
+
+
+"""
+# Count the leaf nodes 'depth' plies below the current position
+"""
+
+
+def perft(gs, depth: int):
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return gs.countValidMoves()
+    nodes = 0
+    for code in gs.getValidMoveCodes():
+        gs.makeMoveCode(code)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def _countNodes(gs, depth: int, ply: int, counts):
+    if ply + 1 == depth:
+        counts[ply] += gs.countValidMoves()
+    else:
+        moves = gs.getValidMoveCodes()
+        counts[ply] += len(moves)
+        for code in moves:
+            gs.makeMoveCode(code)
+            _countNodes(gs, depth, ply + 1, counts)
+            gs.undoMove()
+
+
+"""
+# Count the nodes at every ply in a single walk
+# Returns a list where index i holds the number of positions i + 1 plies deep
+"""
+
+
+def perftByDepth(gs, depth: int):
+    counts = [0] * depth
+    if depth > 0:
+        _countNodes(gs, depth, 0, counts)
+    return counts
+
+
+"""
+# Same walk as perftByDepth, but also splits the leaf count by root move
+# Returns (counts per depth, {root move notation: leaf nodes})
+"""
+
+
+def divide(gs, depth: int):
+    counts = [0] * depth
+    rootCounts = {}
+    if depth == 0:
+        return counts, rootCounts
+
+    moves = gs.getValidMoveCodes()
+    counts[0] = len(moves)
+    for code in moves:
+        subCounts = [0] * (depth - 1)
+        gs.makeMoveCode(code)
+        if depth > 1:
+            _countNodes(gs, depth - 1, 0, subCounts)
+        gs.undoMove()
+        for i in range(len(subCounts)):
+            counts[i + 1] += subCounts[i]
+        rootCounts[ChessEngine.Move.fromCode(code).getChessNotation()] = subCounts[-1] if subCounts else 1
+    return counts, rootCounts
+
+
+"""
+# Run one position and collect counts and timing
+# metrics: optional ChessMetrics.Metrics attached to the game state for the whole walk
+"""
+
+
+def runPosition(name: str, placement: str, whiteToMove: bool, depth: int, showDivide=False, backend="string",
+                metrics=None):
+    gs = loadPosition(ChessEngine.newGameState(backend), placement, whiteToMove)
+    gs.metrics = metrics
+    t0 = time.perf_counter()
+    if showDivide:
+        counts, rootCounts = divide(gs, depth)
+    else:
+        counts, rootCounts = perftByDepth(gs, depth), {}
+    elapsed = time.perf_counter() - t0
+    nodes = sum(counts)
+    return {"name": name, "depth": depth, "counts": counts, "divide": rootCounts,
+            "nodes": nodes, "seconds": elapsed, "nps": nodes / elapsed if elapsed > 0 else float("inf")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts and move generator throughput")
+    parser.add_argument("-p", "--position", action="append", choices=sorted(REFERENCE_POSITIONS),
+                        help="Reference position to run (repeatable, default: all)")
+    parser.add_argument("--placement", action="append", default=[],
+                        help="Extra position as a FEN piece placement (repeatable, no reference counts)")
+    parser.add_argument("--black", action="store_true", help="Black to move in the --placement positions")
+    parser.add_argument("-d", "--depth", type=int,
+                        help="Search depth (default: every depth with a reference count)")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string",
+                        help="Board representation to test (default: string)")
+    parser.add_argument("--divide", action="store_true", help="Print the leaf count of every root move")
+    parser.add_argument("--min-nps", type=float, default=0, help="Fail when a position runs below this nps")
+    parser.add_argument("--baseline", help="JSON file of nps per position to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed nps drop relative to the baseline (default 0.25 = 25%%)")
+    parser.add_argument("--write-baseline", help="Write the measured nps per position to this JSON file")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Print move generator counters and timers per position (slows the walk down)")
+    parser.add_argument("--metrics-file", help="Append the counters and timers per position to this JSON-lines file")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    names = args.position or ([] if args.placement else sorted(REFERENCE_POSITIONS))
+    for name in names:
+        ref = REFERENCE_POSITIONS[name]
+        depth = args.depth or len(ref["counts"])
+        jobs.append((name, ref["placement"], ref["whiteToMove"], depth, ref["counts"]))
+    for i, placement in enumerate(args.placement):
+        jobs.append(("placement%d" % (i + 1), placement, not args.black, args.depth or 1, None))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    metrics = None
+    if args.metrics or args.metrics_file:
+        metrics = Metrics([JsonLinesSink(args.metrics_file)] if args.metrics_file else [])
+
+    mismatch = False
+    slow = False
+    measured = {}
+    for name, placement, whiteToMove, depth, reference in jobs:
+        result = runPosition(name, placement, whiteToMove, depth, args.divide, args.backend, metrics)
+        measured[name] = result["nps"]
+        print("%s (depth %d)" % (name, depth))
+        if args.divide:
+            for notation in sorted(result["divide"]):
+                print("  %s: %d" % (notation, result["divide"][notation]))
+        for ply, count in enumerate(result["counts"]):
+            status = ""
+            if reference is not None and ply < len(reference):
+                if count == reference[ply]:
+                    status = "  ok"
+                else:
+                    status = "  MISMATCH (expected %d)" % reference[ply]
+                    mismatch = True
+            print("  depth %d: %d nodes%s" % (ply + 1, count, status))
+        print("  %d nodes in %.3fs (%.0f nps)" % (result["nodes"], result["seconds"], result["nps"]))
+        if metrics is not None:
+            if args.metrics:
+                print("  " + metrics.report().replace("\n", "\n  "))
+            metrics.count("perft." + name)  # Tags the flushed record with the position it belongs to
+            metrics.flush()
+
+        if args.min_nps and result["nps"] < args.min_nps:
+            print("  SLOW: below --min-nps %.0f" % args.min_nps)
+            slow = True
+        if name in baseline and result["nps"] < baseline[name] * (1 - args.tolerance):
+            print("  SLOW: %.0f nps vs baseline %.0f" % (result["nps"], baseline[name]))
+            slow = True
+
+    if metrics is not None:
+        metrics.close()
+
+    if not args.position and not args.placement and checkInvalidPositions(args.backend):
+        mismatch = True
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump(measured, f, indent=2, sort_keys=True)
+
+    if mismatch:
+        return 1
+    if slow:
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+PGN: read and write games in Standard Algebraic Notation (SAN).
+
+readGames(f) is a generator over a text stream: it yields one PgnGame (tag pairs, SAN moves, result) at a time
+and keeps nothing else, so archives of any size go through in constant memory.
+replayGame plays the SAN moves on a game state, every move is looked up in getValidMoves, which also resolves
+the disambiguation (Nbd7, R1e2...). gameToSan/writeGame go the other way, from a game's moveLog to SAN.
+
+The engine has no castling, en passant or promotion yet: games that use them stop with UnsupportedMoveError.
+
+Usage (from the project root):
+    python -m Chess.ChessPgn games.pgn                    # replay and validate every game
+    python -m Chess.ChessPgn games.pgn -o replayed.pgn    # write the games back with regenerated SAN
+"""
+import argparse
+import re
+import sys
+import time
+
+from Chess import ChessEngine
+
+STANDARD_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")  # Seven tag roster, written first
+
+_tagPattern = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_tokenPattern = re.compile(r'[{}();]|[^\s{}();]+')
+_moveNumber = re.compile(r'^\d+\.*')
+_sanPattern = re.compile(r'^([KQRBN])?([a-h])?([1-8])?(x)?([a-h][1-8])(=[QRBN])?$')
+
+
+class PgnError(ValueError):
+    pass
+
+
+class UnsupportedMoveError(PgnError):
+    pass
+
+
+class PgnGame:
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []  # SAN strings
+        self.result = result
+
+    """
+    # FEN the game starts from, the FEN tag when there is one
+    """
+
+    def startFen(self):
+        return self.headers.get("FEN", STANDARD_FEN)
+
+
+"""
+# SAN of 'move' in the position of gs, before it is played
+# validMoves: gs.getValidMoves() when the caller already has it
+"""
+
+
+def moveToSan(gs, move, validMoves=None):
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    piece = move.pieceMoved[1]
+    target = move.getRankFile(move.endRow, move.endCol)
+    capture = move.pieceCaptured != "--"
+    if piece == 'p':
+        san = (ChessEngine.colsToFiles[move.startCol] + "x" if capture else "") + target
+    else:
+        # Other pieces of the same kind that can reach the same square decide what to add
+        rivals = [other for other in validMoves if other.pieceMoved == move.pieceMoved and other != move
+                  and other.endRow == move.endRow and other.endCol == move.endCol]
+        qualifier = ""
+        if rivals:
+            if all(other.startCol != move.startCol for other in rivals):
+                qualifier = ChessEngine.colsToFiles[move.startCol]
+            elif all(other.startRow != move.startRow for other in rivals):
+                qualifier = ChessEngine.rowsToRanks[move.startRow]
+            else:
+                qualifier = move.getRankFile(move.startRow, move.startCol)
+        san = piece + qualifier + ("x" if capture else "") + target
+
+    gs.makeMove(move)
+    gs.getValidMoveCodes()  # Sets isInCheck and checkMate for the side that replies
+    if gs.checkMate:
+        san += "#"
+    elif gs.isInCheck:
+        san += "+"
+    gs.undoMove()
+    return san
+
+
+"""
+# The legal Move a SAN string stands for in the position of gs, PgnError when there is none or several
+"""
+
+
+def sanToMove(gs, san, validMoves=None):
+    text = san.rstrip("+#!?")
+    if text.startswith("O-O") or text.startswith("0-0"):
+        raise UnsupportedMoveError("Castling is not supported: " + san)
+    match = _sanPattern.match(text)
+    if match is None:
+        raise PgnError("Not a SAN move: " + san)
+    piece, fromFile, fromRank, _, target, promotion = match.groups()
+    if promotion:
+        raise UnsupportedMoveError("Promotion is not supported: " + san)
+    piece = piece or 'p'
+    endRow = ChessEngine.ranksToRows[target[1]]
+    endCol = ChessEngine.filesToCols[target[0]]
+
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    candidates = [move for move in validMoves
+                  if move.pieceMoved[1] == piece and move.endRow == endRow and move.endCol == endCol
+                  and (fromFile is None or move.startCol == ChessEngine.filesToCols[fromFile])
+                  and (fromRank is None or move.startRow == ChessEngine.ranksToRows[fromRank])]
+    if len(candidates) == 1:
+        return candidates[0]
+    if not candidates:
+        if piece == 'p' and fromFile is not None and gs.board[endRow][endCol] == "--":
+            raise UnsupportedMoveError("En passant is not supported: " + san)
+        raise PgnError("Illegal move: " + san)
+    raise PgnError("Ambiguous move: " + san)
+
+
+"""
+# Tokens of one line of movetext, state carries an open {comment} or (variation) over to the next line
+# Comments, variations, NAGs and move numbers are dropped, what is left are SAN moves and the result
+"""
+
+
+def _movetextTokens(line, state):
+    pos = 0
+    length = len(line)
+    while pos < length:
+        if state["comment"]:
+            end = line.find("}", pos)
+            if end < 0:
+                return
+            state["comment"] = False
+            pos = end + 1
+            continue
+        match = _tokenPattern.search(line, pos)
+        if match is None:
+            return
+        token = match.group()
+        pos = match.end()
+        if token == "{":
+            state["comment"] = True
+        elif token == ";":  # Comment to the end of the line
+            return
+        elif token == "(":
+            state["variation"] += 1
+        elif token == ")":
+            state["variation"] = max(0, state["variation"] - 1)
+        elif state["variation"] == 0 and token[0] != "$" and token != "}":
+            if token[0].isdigit() and token not in RESULTS:
+                token = _moveNumber.sub("", token)  # "12." "12..." or "12.e4"
+                if not token:
+                    continue
+            yield token
+
+
+"""
+# Games of a PGN text stream, one PgnGame at a time
+"""
+
+
+def readGames(f):
+    game = PgnGame()
+    state = {"comment": False, "variation": 0}
+    inMovetext = False
+    for line in f:
+        if not state["comment"] and not state["variation"]:
+            stripped = line.strip()
+            if stripped.startswith("["):
+                if inMovetext:  # Tag section of the next game while this one had no result
+                    yield game
+                    game = PgnGame()
+                    inMovetext = False
+                for key, value in _tagPattern.findall(stripped):
+                    game.headers[key] = value.replace('\\"', '"').replace("\\\\", "\\")
+                continue
+            if stripped.startswith("%"):  # Escape line
+                continue
+        for token in _movetextTokens(line, state):
+            inMovetext = True
+            if token in RESULTS:
+                game.result = token
+                yield game
+                game = PgnGame()
+                inMovetext = False
+            else:
+                game.moves.append(token)
+    if inMovetext or game.headers:
+        yield game
+
+
+"""
+# Play a game's moves on a new game state of the chosen backend, returns the game state
+# Raises PgnError (or UnsupportedMoveError) naming the ply that could not be played
+"""
+
+
+def replayGame(game, backend="string"):
+    gs = ChessEngine.newGameState(backend)
+    try:
+        gs.setFen(game.startFen())
+    except ValueError as error:
+        raise PgnError("FEN tag: %s" % error) from None
+    for ply, san in enumerate(game.moves, 1):
+        try:
+            move = sanToMove(gs, san)
+        except PgnError as error:
+            raise type(error)("ply %d: %s" % (ply, error)) from None
+        gs.makeMove(move)
+    return gs
+
+
+"""
+# SAN of every move in gs.moveLog, worked out by stepping back to the first position and replaying
+# Returns (FEN of the first position, SAN list), gs ends where it was
+"""
+
+
+def gameToSan(gs):
+    moves = list(gs.moveLog)
+    for _ in moves:
+        gs.undoMove()
+    startFen = gs.getFen()
+    sans = []
+    for move in moves:
+        sans.append(moveToSan(gs, move))
+        gs.makeMove(move)
+    return startFen, sans
+
+
+def formatGame(game):
+    headers = dict(game.headers)
+    headers["Result"] = game.result
+    lines = []
+    tags = [(key, headers.pop(key, "????.??.??" if key == "Date" else "?")) for key in ROSTER]
+    for key, value in tags + list(headers.items()):
+        lines.append('[%s "%s"]' % (key, value.replace("\\", "\\\\").replace('"', '\\"')))
+    lines.append("")
+
+    fields = game.startFen().split()
+    blackFirst = len(fields) > 1 and fields[1] == "b"
+    number = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for i, san in enumerate(game.moves):
+        if not blackFirst and i % 2 == 0:
+            tokens.append("%d." % (number + i // 2))
+        elif blackFirst and i == 0:
+            tokens.append("%d..." % number)
+        elif blackFirst and i % 2 == 1:
+            tokens.append("%d." % (number + (i + 1) // 2))
+        tokens.append(san)
+    tokens.append(game.result)
+
+    line = ""
+    for token in tokens:  # Movetext lines stay within 80 characters
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+"""
+# Write the game played on gs as PGN, headers are extra tag pairs (the seven tag roster is filled with '?')
+"""
+
+
+def writeGame(f, gs, headers=None, result="*"):
+    startFen, sans = gameToSan(gs)
+    game = PgnGame(dict(headers or {}), sans, result)
+    if startFen.split()[:2] != STANDARD_FEN.split()[:2] and "FEN" not in game.headers:
+        game.headers["SetUp"] = "1"
+        game.headers["FEN"] = startFen
+    f.write(formatGame(game))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and validate the games of a PGN file")
+    parser.add_argument("pgn", help="PGN file")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    parser.add_argument("--limit", type=int, help="Stop after LIMIT games")
+    parser.add_argument("-o", "--output", help="Write the replayed games here with SAN generated by the engine")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every game that fails")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else None
+    games = plies = illegal = unsupported = 0
+    start = time.perf_counter()
+    try:
+        with open(args.pgn, encoding="utf-8", errors="replace") as f:
+            for game in readGames(f):
+                if args.limit is not None and games >= args.limit:
+                    break
+                games += 1
+                try:
+                    gs = replayGame(game, args.backend)
+                except UnsupportedMoveError as error:
+                    unsupported += 1
+                    if args.verbose:
+                        print("game %d: %s" % (games, error))
+                    continue
+                except PgnError as error:
+                    illegal += 1
+                    print("game %d: %s" % (games, error))
+                    continue
+                plies += len(game.moves)
+                if output is not None:
+                    writeGame(output, gs, game.headers, game.result)
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print("%d games, %d plies in %.2fs (%.1f games/s), %d illegal, %d unsupported (castling/en passant/promotion)"
+          % (games, plies, elapsed, games / elapsed if elapsed > 0 else 0.0, illegal, unsupported))
+    return 1 if illegal else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
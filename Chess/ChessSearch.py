@@ -0,0 +1,412 @@
+"""
+Search: picks a move for the side to move.
+
+Negamax alpha-beta on top of GameState.getStagedMoveCodes/makeMoveCode/undoMove, driven by
+iterative deepening so a move is always ready when the time or node budget runs out.
+Moves come hash/PV move first, then captures, killers and quiet moves by history score,
+so a cutoff usually happens before the quiet moves are even generated.
+Every finished iteration reports depth, score, nodes, nodes/sec and the principal variation.
+
+Leaves are not evaluated straight away: a quiescence search keeps playing captures (every move when in
+check) until the position is quiet, so a piece left hanging at the horizon is seen. The side to move can
+always stand pat on the static evaluation. Captures are tried MVV-LVA first, and a capture that loses
+material by static exchange evaluation (ChessEngine.staticExchange, worked out from the ray and knight
+tables without making a move) is skipped.
+
+Usage (from the project root):
+    python -m Chess.ChessSearch --time 2
+    python -m Chess.ChessSearch --depth 4 --placement 6k1/5ppp/8/8/8/8/5PPP/3R2K1
+    python -m Chess.ChessSearch --time 2 --hash 64
+    python -m Chess.ChessSearch --depth 6 --placement 8/8/8/3k4/8/8/8/R3K3 --tablebases tablebases
+    python -m Chess.ChessSearch --depth 4 --compare      # node counts without quiescence / without SEE pruning
+"""
+import argparse
+import sys
+import time
+
+from Chess import ChessEngine
+from Chess.ChessPerft import loadPosition
+from Chess.ChessTablebase import TablebaseSet
+from Chess.ChessTransposition import TranspositionTable, EXACT, LOWER, UPPER
+
+CHECKMATE = 100000  # Mate scores are CHECKMATE - plies to mate, anything above MATE_BOUND is a forced mate
+MATE_BOUND = CHECKMATE - 1000
+MAX_DEPTH = 64
+
+pieceValues = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0, '-': 0}
+indexValues = [pieceValues[piece[1]] for piece in ChessEngine.pieceCodes]  # By the piece index of a move code
+
+"""
+# Material balance from the point of view of the side to move
+"""
+
+
+def evaluateMaterial(gs):
+    score = 0
+    for row in gs.board:
+        for piece in row:
+            if piece[0] == 'w':
+                score += pieceValues[piece[1]]
+            elif piece[0] == 'b':
+                score -= pieceValues[piece[1]]
+    return score if gs.whiteToMove else -score
+
+
+"""
+# Mate scores count plies from the root, the table stores them counted from the node instead
+# so an entry stays correct when the same position is reached at another ply
+"""
+
+
+def scoreToTable(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class SearchAborted(Exception):
+    pass
+
+
+"""
+# Everything a search hands back, bestMove and the pv are Move objects
+# iterations: one info dict per finished depth (depth, score, nodes, nps, seconds, pv)
+"""
+
+
+class SearchResult:
+    def __init__(self):
+        self.bestMove = None
+        self.score = 0
+        self.pv = []
+        self.depth = 0
+        self.nodes = 0
+        self.seconds = 0.0
+        self.iterations = []
+        self.helperNodes = 0  # Nodes searched by the helper processes of a ParallelSearcher
+        self.quiescenceNodes = 0  # Part of nodes searched by the quiescence search
+        self.seePruned = 0  # Captures the quiescence search skipped as losing
+
+    def nps(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+
+"""
+# tt: optional TranspositionTable shared by every search of this Searcher
+# stopEvent: optional threading/multiprocessing Event, setting it stops the search like stop() does,
+# polled together with the clock
+# tablebases: optional ChessTablebase.TablebaseSet, positions it covers are scored exactly and not searched
+# quiescence: resolve captures at the leaves, seePruning: skip the losing ones there
+"""
+
+
+class Searcher:
+    def __init__(self, evaluate=evaluateMaterial, tt=None, stopEvent=None, tablebases=None, quiescence=True,
+                 seePruning=True):
+        self.evaluate = evaluate
+        self.tt = tt
+        self.stopEvent = stopEvent
+        self.tablebases = tablebases
+        self.quiescence = quiescence
+        self.seePruning = seePruning
+        self.tablebaseHits = 0
+        self.stopRequested = False
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.seePruned = 0
+        self.nodeLimit = None
+        self.deadline = None
+        self.killers = []  # Per ply, the last two quiet moves that caused a beta cutoff
+        self.history = []  # By move code & 0xFFF (start and end square), grows with depth^2 on every quiet cutoff
+
+    """
+    # Ask a running search to return as soon as possible, safe to call from another thread
+    """
+
+    def stop(self):
+        self.stopRequested = True
+
+    """
+    # Iterative deepening from startDepth (normally 1) to maxDepth
+    # timeLimit (seconds) and nodeLimit are hard budgets: the search aborts mid-iteration
+    # and falls back to the last finished one. onIteration(info) is called after every depth.
+    """
+
+    def search(self, gs, maxDepth=MAX_DEPTH, timeLimit=None, nodeLimit=None, onIteration=None, startDepth=1):
+        result = SearchResult()
+        self.stopRequested = False
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.seePruned = 0
+        self.tablebaseHits = 0
+        self.nodeLimit = nodeLimit
+        self.killers = [[0, 0] for _ in range(maxDepth + 1)]
+        self.history = [0] * 4096
+        start = time.perf_counter()
+        self.deadline = start + timeLimit if timeLimit is not None else None
+        if self.tt is not None:
+            self.tt.newSearch()
+        rootPly = len(gs.moveLog)
+
+        rootMoves = gs.getValidMoveCodes()
+        if len(rootMoves) == 0:
+            result.seconds = time.perf_counter() - start
+            return result
+        result.bestMove = ChessEngine.Move.fromCode(rootMoves[0])  # Something to play even if depth 1 never finishes
+
+        pv = []
+        for depth in range(startDepth, maxDepth + 1):
+            linePv = []
+            try:
+                score = self.__negamax(gs, depth, -CHECKMATE - 1, CHECKMATE + 1, 0, linePv, pv)
+            except SearchAborted:
+                while len(gs.moveLog) > rootPly:  # Unwind the moves made by the aborted iteration
+                    gs.undoMove()
+                break
+            pv = linePv
+            elapsed = time.perf_counter() - start
+            pvMoves = [ChessEngine.Move.fromCode(code) for code in pv]
+            result.bestMove = pvMoves[0] if pvMoves else result.bestMove
+            result.score = score
+            result.pv = pvMoves
+            result.depth = depth
+            info = {"depth": depth, "score": score, "nodes": self.nodes, "seconds": elapsed,
+                    "nps": self.nodes / elapsed if elapsed > 0 else 0.0, "pv": list(pvMoves)}
+            result.iterations.append(info)
+            if onIteration is not None:
+                onIteration(info)
+            if abs(score) > MATE_BOUND:  # Forced mate found, deeper iterations cannot improve it
+                break
+
+        result.nodes = self.nodes
+        result.quiescenceNodes = self.quiescenceNodes
+        result.seePruned = self.seePruned
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def __checkBudget(self):
+        if self.stopRequested:
+            raise SearchAborted()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchAborted()
+        if (self.nodes & 63) == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchAborted()
+            if self.stopEvent is not None and self.stopEvent.is_set():
+                raise SearchAborted()
+
+    """
+    # Fail-hard negamax with alpha-beta pruning
+    # pv is filled with the best line (move codes) from this node, previousPv is the line of the last iteration,
+    # its move at this ply is searched first while we are still following it
+    """
+
+    def __negamax(self, gs, depth, alpha, beta, ply, pv, previousPv):
+        self.nodes += 1
+        self.__checkBudget()
+
+        if self.tablebases is not None and ply > 0:
+            found = self.tablebases.probe(gs)
+            if found is not None:
+                self.tablebaseHits += 1
+                outcome, plies = found
+                if outcome > 0:
+                    return CHECKMATE - ply - plies
+                if outcome < 0:
+                    return -CHECKMATE + ply + plies
+                return 0
+
+        if depth == 0:
+            if self.quiescence:
+                self.nodes -= 1  # Counted again as a quiescence node
+                return self.__quiescence(gs, alpha, beta, ply)
+            return self.evaluate(gs)
+
+        tt = self.tt
+        hashCode = 0
+        if tt is not None:
+            entry = tt.probe(gs.zobristKey)
+            if entry is not None:
+                entryDepth, bound, entryScore, hashCode = entry
+                if ply > 0 and entryDepth >= depth:
+                    entryScore = scoreFromTable(entryScore, ply)
+                    if bound == EXACT:
+                        return entryScore
+                    if bound == LOWER and entryScore >= beta:
+                        return beta
+                    if bound == UPPER and entryScore <= alpha:
+                        return alpha
+
+        pvMove = previousPv[ply] if ply < len(previousPv) else None
+        killers = self.killers[ply]
+        moves = gs.getStagedMoveCodes(pvMove if pvMove is not None else hashCode, killers, self.history)
+        inCheck = gs.isInCheck
+        bestMove = 0
+        searched = 0
+        for move in moves:
+            searched += 1
+            childPv = []
+            gs.makeMoveCode(move)
+            score = -self.__negamax(gs, depth - 1, -beta, -alpha, ply + 1, childPv,
+                                    previousPv if move == pvMove else ())
+            gs.undoMove()
+            if score >= beta:
+                if not move & 0xF0000:  # Quiet move, remember it for the siblings and for every node
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[move & 0xFFF] += depth * depth
+                if tt is not None:
+                    tt.store(gs.zobristKey, depth, LOWER, scoreToTable(beta, ply), move)
+                return beta
+            if score > alpha:
+                alpha = score
+                bestMove = move
+                pv[:] = [move] + childPv
+        if searched == 0:
+            return -CHECKMATE + ply if inCheck else 0
+        if tt is not None:
+            tt.store(gs.zobristKey, depth, EXACT if bestMove else UPPER, scoreToTable(alpha, ply), bestMove)
+        return alpha
+
+    """
+    # Captures only (every evasion in check) until the position is quiet, fail-hard like __negamax
+    # Out of check the side to move may stand pat: the static evaluation is a lower bound of its score
+    """
+
+    def __quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        self.quiescenceNodes += 1
+        self.__checkBudget()
+
+        inCheck = gs.inCheck()
+        if not inCheck:
+            standPat = self.evaluate(gs)
+            if standPat >= beta:
+                return beta  # Cut before any move is generated
+            if standPat > alpha:
+                alpha = standPat
+        moves = gs.getCaptureMoveCodes()
+        if inCheck and not moves:
+            return -CHECKMATE + ply
+        board = gs.board
+        prune = self.seePruning and not inCheck
+        values = ChessEngine.exchangeValues
+        for move in moves:
+            # Taking a piece worth at least the capturer cannot lose material, only the others need the exchange
+            if prune and values[(move >> 16) & 15] < values[(move >> 12) & 15] and \
+                    ChessEngine.staticExchange(board, move) < 0:
+                self.seePruned += 1
+                continue
+            gs.makeMoveCode(move)
+            score = -self.__quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score >= beta:
+                return beta
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+def formatScore(score):
+    if score > MATE_BOUND:
+        return "mate %d" % ((CHECKMATE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return "mate -%d" % ((CHECKMATE + score) // 2)
+    return "cp %d" % score
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the best move with iterative deepening")
+    parser.add_argument("--placement", help="FEN piece placement to search (default: GameState start)")
+    parser.add_argument("--black", action="store_true", help="Black to move in --placement")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    parser.add_argument("-d", "--depth", type=int, default=MAX_DEPTH, help="Maximum depth")
+    parser.add_argument("-t", "--time", type=float, help="Time budget in seconds")
+    parser.add_argument("-n", "--nodes", type=int, help="Node budget")
+    parser.add_argument("--hash", type=float, default=16, help="Transposition table size in MB, 0 disables it")
+    parser.add_argument("--tablebases", help="Directory with ChessTablebase files to probe")
+    parser.add_argument("--no-quiescence", action="store_true", help="Evaluate the leaves as they are")
+    parser.add_argument("--no-see", action="store_true", help="Search losing captures in the quiescence search too")
+    parser.add_argument("--compare", action="store_true",
+                        help="Search to --depth without quiescence, with every capture and with SEE pruning")
+    args = parser.parse_args(argv)
+    if args.compare:
+        return compareQuiescence(args)
+    if args.depth == MAX_DEPTH and args.time is None and args.nodes is None:
+        args.time = 5.0  # Never run unbounded by accident
+
+    gs = ChessEngine.newGameState(args.backend)
+    if args.placement:
+        loadPosition(gs, args.placement, not args.black)
+
+    def report(info):
+        print("depth %d score %s nodes %d nps %.0f time %.3f pv %s" % (
+            info["depth"], formatScore(info["score"]), info["nodes"], info["nps"], info["seconds"],
+            " ".join(move.getChessNotation() for move in info["pv"])))
+
+    tt = TranspositionTable(args.hash) if args.hash > 0 else None
+    tablebases = None
+    if args.tablebases:
+        tablebases = TablebaseSet(args.tablebases)
+    searcher = Searcher(tt=tt, tablebases=tablebases, quiescence=not args.no_quiescence, seePruning=not args.no_see)
+    result = searcher.search(gs, args.depth, args.time, args.nodes, report)
+    if tablebases is not None:
+        print("tablebase hits %d" % searcher.tablebaseHits)
+        tablebases.close()
+    if result.bestMove is None:
+        print("no legal moves")
+        return 1
+    print("bestmove %s (depth %d, %d nodes in %.3fs, %.0f nps)" % (
+        result.bestMove.getChessNotation(), result.depth, result.nodes, result.seconds, result.nps()))
+    if searcher.quiescence:
+        print("quiescence nodes %d (%.1f%%), %d losing captures pruned" % (
+            result.quiescenceNodes, 100.0 * result.quiescenceNodes / max(1, result.nodes), result.seePruned))
+    if tt is not None:
+        print("hash %.1f MB, hit rate %.1f%% (%d/%d probes), %d stores, %d overwrites, usage %.1f%%" % (
+            tt.sizeBytes() / (1024 * 1024), tt.hitRate() * 100, tt.hits, tt.probes, tt.stores, tt.overwrites,
+            tt.usage() * 100))
+    return 0
+
+
+"""
+# The same fixed depth search three times, each with a fresh hash table: leaves evaluated as they are,
+# quiescence over every capture, quiescence with losing captures pruned by SEE
+"""
+
+
+def compareQuiescence(args):
+    if args.depth == MAX_DEPTH:
+        args.depth = 4
+    results = []
+    for name, quiescence, seePruning in (("none", False, False), ("all captures", True, False),
+                                         ("SEE pruning", True, True)):
+        gs = ChessEngine.newGameState(args.backend)
+        if args.placement:
+            loadPosition(gs, args.placement, not args.black)
+        tt = TranspositionTable(args.hash) if args.hash > 0 else None
+        result = Searcher(tt=tt, quiescence=quiescence, seePruning=seePruning).search(gs, args.depth)
+        results.append(result)
+        print("%-13s depth %d: %8d nodes, quiescence %5.1f%%, %6d pruned, %.3fs (%.0f nps), score %s, best %s" % (
+            name, result.depth, result.nodes, 100.0 * result.quiescenceNodes / max(1, result.nodes),
+            result.seePruned, result.seconds, result.nps(), formatScore(result.score),
+            result.bestMove.getChessNotation() if result.bestMove else "none"))
+    full, pruned = results[1], results[2]
+    print("SEE pruning: %.1f%% fewer nodes, %.1f%% less time than searching every capture" % (
+        100.0 * (full.nodes - pruned.nodes) / max(1, full.nodes),
+        100.0 * (full.seconds - pruned.seconds) / full.seconds if full.seconds > 0 else 0.0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Self-play load test: plays games between move choosers without the front end, spread over a process pool.
+
+A chooser picks the move of one side:
+    random      any legal move
+    greedy      the capture of the most valuable piece (least valuable capturer first), else any legal move
+    search:<d>  the best move of a Searcher at depth d (ChessEval's incremental evaluation), with a hash table
+                kept for the whole game
+
+Every game starts from the standard position (or --fen) and ends in checkmate, stalemate, threefold repetition,
+the fifty move rule or --max-plies. Each finished game is written as one JSON object as soon as it arrives
+(result, moves, time per move, the worker's pid and peak RSS), and the run ends with the totals: games/s,
+positions/s, move time percentiles per chooser and the peak RSS of every worker.
+Castling, en passant and promotion are not played by the engine yet, so a pawn on the last rank just stays.
+
+Usage (from the project root):
+    python -m Chess.ChessSelfPlay -n 100 --white random --black greedy -j 4 -o games.jsonl
+    python -m Chess.ChessSelfPlay -n 20 --white search:2 --black search:3 --alternate
+    python -m Chess.ChessSelfPlay --check             # move times go to the chooser that moved
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from Chess import ChessEngine
+from Chess.ChessEval import evaluateIncremental
+from Chess.ChessPgn import STANDARD_FEN
+from Chess.ChessSearch import Searcher
+from Chess.ChessTransposition import TranspositionTable
+
+try:
+    import resource  # Unix only, peak RSS is reported as None elsewhere
+except ImportError:
+    resource = None
+
+CHOOSERS = ("random", "greedy", "search:<depth>")
+FIFTY_MOVE_PLIES = 100
+CHECK_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR b - - 0 1"  # Black moves first, for --check
+
+"""
+# (kind, depth) of a chooser name, depth is None for random and greedy
+# Raises ValueError for an unknown chooser or a bad depth
+"""
+
+
+def parseChooser(name):
+    kind, _, depth = name.partition(":")
+    if kind in ("random", "greedy") and not depth:
+        return kind, None
+    if kind == "search" and depth.isdigit() and int(depth) > 0:
+        return kind, int(depth)
+    raise ValueError("unknown chooser '%s', expected one of %s" % (name, ", ".join(CHOOSERS)))
+
+
+"""
+# Picks moves for one side of one game
+"""
+
+
+class Chooser:
+    def __init__(self, name, rng, hashMB=4):
+        self.name = name
+        self.kind, self.depth = parseChooser(name)
+        self.rng = rng
+        self.searcher = Searcher(evaluateIncremental, TranspositionTable(hashMB)) if self.kind == "search" else None
+
+    """
+    # A move code from 'moves' (the legal moves of gs, not empty)
+    """
+
+    def choose(self, gs, moves):
+        if self.kind == "random":
+            return self.rng.choice(moves)
+        if self.kind == "greedy":
+            captures = [move for move in moves if move & 0xF0000]
+            if not captures:
+                return self.rng.choice(moves)
+            best = max(ChessEngine.captureOrder(move) for move in captures)
+            return self.rng.choice([move for move in captures if ChessEngine.captureOrder(move) == best])
+        bestMove = self.searcher.search(gs, self.depth).bestMove
+        if bestMove is None:
+            return moves[0]
+        return next(move for move in moves if move & 0xFFFF == bestMove.code & 0xFFFF)
+
+
+"""
+# Peak resident set size of this process in kB, None where the resource module is missing
+"""
+
+
+def peakRss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # Bytes on macOS, kB on Linux
+
+
+"""
+# Play one game inside a pool process
+# task: (game number, white chooser, black chooser, settings dict), returns the result dict written to the output
+"""
+
+
+def playGame(task):
+    number, white, black, settings = task
+    rng = random.Random(settings["seed"] * 1000003 + number)
+    gs = ChessEngine.newGameState(settings["backend"])
+    gs.setFen(settings["fen"])
+    choosers = {True: Chooser(white, rng, settings["hash"]), False: Chooser(black, rng, settings["hash"])}
+    whiteStarts = gs.whiteToMove
+    seen = {gs.zobristKey: 1}
+    quietPlies = 0
+    moves, moveTimes = [], []
+    termination = None
+    start = time.perf_counter()
+    while termination is None:
+        legal = gs.getValidMoveCodes()
+        if len(legal) == 0:
+            termination = "checkmate" if gs.checkMate else "stalemate"
+            break
+        moveStart = time.perf_counter()
+        code = choosers[gs.whiteToMove].choose(gs, legal)
+        moveTimes.append(time.perf_counter() - moveStart)
+        gs.makeMoveCode(code)
+        moves.append(ChessEngine.Move.fromCode(code).getChessNotation())
+        if code & 0xF0000 or ChessEngine.pieceCodes[(code >> 12) & 15][1] == 'p':  # Capture or pawn move
+            quietPlies = 0
+        else:
+            quietPlies += 1
+        seen[gs.zobristKey] = seen.get(gs.zobristKey, 0) + 1
+        if seen[gs.zobristKey] >= 3:
+            termination = "repetition"
+        elif quietPlies >= FIFTY_MOVE_PLIES:
+            termination = "fifty moves"
+        elif len(moves) >= settings["maxPlies"]:
+            termination = "max plies"
+    if termination == "checkmate":
+        outcome = "0-1" if gs.whiteToMove else "1-0"
+    else:
+        outcome = "1/2-1/2"
+    return {"game": number, "white": white, "black": black, "result": outcome, "termination": termination,
+            "whiteStarts": whiteStarts, "plies": len(moves), "seconds": time.perf_counter() - start, "moves": moves,
+            "moveTimes": [round(seconds, 6) for seconds in moveTimes], "pid": os.getpid(), "peakRssKB": peakRss()}
+
+
+"""
+# (chooser, seconds) of every move of a game result, in order: the side to move in the start position moved first
+"""
+
+
+def timedMoves(result):
+    first, second = result["white"], result["black"]
+    if not result["whiteStarts"]:
+        first, second = second, first
+    for i, seconds in enumerate(result["moveTimes"]):
+        yield second if i % 2 else first, seconds
+
+
+"""
+# Play a game from CHECK_FEN (black to move) and replay it: every move timedMoves credits to a chooser has to be
+# made by a piece of that chooser's color. Returns the number of moves credited to the wrong side
+"""
+
+
+def checkMoveAttribution(backend="string"):
+    settings = {"backend": backend, "fen": CHECK_FEN, "maxPlies": 60, "hash": 1, "seed": 1}
+    result = playGame((0, "random", "greedy", settings))
+    colors = {result["white"]: 'w', result["black"]: 'b'}
+    gs = ChessEngine.newGameState(backend)
+    gs.setFen(CHECK_FEN)
+    wrong = 0
+    for (chooser, _), notation in zip(timedMoves(result), result["moves"]):
+        start = ChessEngine.ranksToRows[notation[1]] * 8 + ChessEngine.filesToCols[notation[0]]
+        wrong += gs.board[start >> 3][start & 7][0] != colors[chooser]
+        gs.makeMoveCode(next(code for code in gs.getValidMoveCodes()
+                             if ChessEngine.Move.fromCode(code).getChessNotation() == notation))
+    return wrong
+
+
+"""
+# Play 'games' games, yields result dicts as they finish (not in game order)
+# alternate: swap the choosers' colors every other game, workers: pool size, 1 plays in this process
+"""
+
+
+def runGames(games, white, black, settings, workers=1, alternate=False):
+    tasks = ((number, black if alternate and number % 2 else white, white if alternate and number % 2 else black,
+              settings) for number in range(games))
+    if workers <= 1:
+        yield from map(playGame, tasks)
+        return
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        yield from pool.imap_unordered(playGame, tasks)
+
+
+"""
+# Nearest rank percentile of a sorted list
+"""
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values), max(1, math.ceil(fraction * len(values)))) - 1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play games between move choosers and measure the throughput")
+    parser.add_argument("-n", "--games", type=int, default=10, help="Number of games")
+    parser.add_argument("--white", default="random", help="Chooser of white: " + ", ".join(CHOOSERS))
+    parser.add_argument("--black", default="greedy", help="Chooser of black")
+    parser.add_argument("--alternate", action="store_true", help="Swap the colors every other game")
+    parser.add_argument("--fen", default=STANDARD_FEN, help="Start position of every game")
+    parser.add_argument("--max-plies", type=int, default=300, help="Adjudicate a draw after this many plies")
+    parser.add_argument("--hash", type=float, default=4, help="Transposition table size in MB per search chooser")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the random choices")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("-o", "--output", help="Write one JSON result per game to this file")
+    parser.add_argument("--check", action="store_true",
+                        help="Only check that move times are credited to the side that moved (black starts)")
+    args = parser.parse_args(argv)
+    if args.check:
+        wrong = checkMoveAttribution(args.backend)
+        print("move attribution from %s: %s" % (CHECK_FEN, "ok" if not wrong else "%d moves credited wrongly" % wrong))
+        return 1 if wrong else 0
+    try:
+        parseChooser(args.white)
+        parseChooser(args.black)
+    except ValueError as error:
+        parser.error(str(error))
+
+    settings = {"backend": args.backend, "fen": args.fen, "maxPlies": args.max_plies, "hash": args.hash,
+                "seed": args.seed}
+    output = open(args.output, "w") if args.output else None
+    games = plies = 0
+    outcomes = {}
+    moveTimes = {}  # Chooser -> seconds of every move it made
+    workers = {}  # pid -> peak RSS in kB
+    start = time.perf_counter()
+    try:
+        for result in runGames(args.games, args.white, args.black, settings, args.jobs, args.alternate):
+            games += 1
+            plies += result["plies"]
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+            key = "%s-%s %s" % (result["white"], result["black"], result["result"])
+            outcomes[key] = outcomes.get(key, 0) + 1
+            for chooser, seconds in timedMoves(result):
+                moveTimes.setdefault(chooser, []).append(seconds)
+            workers[result["pid"]] = max(workers.get(result["pid"]) or 0, result["peakRssKB"] or 0)
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    print("%d games, %d positions in %.2fs: %.2f games/s, %.0f positions/s over %d workers" % (
+        games, plies, elapsed, games / elapsed if elapsed > 0 else 0.0, plies / elapsed if elapsed > 0 else 0.0,
+        max(1, args.jobs)))
+    for key in sorted(outcomes):
+        print("  %-32s %d" % (key, outcomes[key]))
+    for name in sorted(moveTimes):
+        times = sorted(moveTimes[name])
+        print("move time %-10s %6d moves, p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+            name, len(times), percentile(times, 0.5) * 1000, percentile(times, 0.9) * 1000,
+            percentile(times, 0.99) * 1000, times[-1] * 1000))
+    for pid in sorted(workers):
+        print("worker %d peak RSS %s" % (pid, "%.1f MB" % (workers[pid] / 1024) if workers[pid] else "unknown"))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
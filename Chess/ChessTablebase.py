@@ -0,0 +1,372 @@
+"""
+Endgame tablebases: exact win/draw/loss and distance to mate for king + one piece against a lone king.
+
+Generation is retrograde analysis. Every position of the material set is laid out once through the normal
+game state and move generator, so the tables follow the engine's own rules (no promotion yet: a pawn on
+the last rank just stays there). Checkmates are the first losses. From there the result flows backwards
+through the predecessor lists one ply at a time: a predecessor of a loss is a win, and a position whose
+every move reaches a win is a loss. Whatever is never reached is a draw.
+
+File layout (one file per material set, e.g. KQK.tb):
+    16-byte header: b"CTB1", the piece letter, the number of king squares, 10 reserved bytes
+    one byte per position, index ((side to move * kings + king slot) * 64 + black king) * 64 + piece
+        0        draw
+        1-127    side to move mates in that many plies
+        128+n    side to move is mated in n plies (128 = checkmated)
+        255      illegal position
+Symmetry keeps the tables small: the white king stays in the a1-d1-d4 triangle for pawnless sets (10 squares)
+and on files a-d with a pawn (32 squares). A probe maps the position onto those squares and reads one byte
+from the memory-mapped file. Positions where black has the piece are probed with the colors swapped.
+
+Usage (from the project root):
+    python -m Chess.ChessTablebase generate KQK KRK KPK -o tablebases
+    python -m Chess.ChessTablebase probe tablebases --fen "8/8/8/8/8/2k5/8/K1Q5 w - - 0 1"
+"""
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+
+from Chess import ChessEngine
+
+MAGIC = b"CTB1"
+HEADER_BYTES = 16
+DRAW, LOSS, ILLEGAL = 0, 128, 255
+PIECES = "QRBNP"  # Material sets are K + one of these against K
+BACKEND = "bitboard"  # Faster for the one setBoard per position that generation does
+
+"""
+# Square transforms (index r * 8 + c): the identity and mirror images of the board
+"""
+
+
+def _transform(flipRows, flipCols, transpose):
+    squares = []
+    for sq in range(64):
+        r, c = sq >> 3, sq & 7
+        if transpose:
+            r, c = c, r
+        if flipRows:
+            r = 7 - r
+        if flipCols:
+            c = 7 - c
+        squares.append(r * 8 + c)
+    return tuple(squares)
+
+
+PAWNLESS_TRANSFORMS = [_transform(fr, fc, t) for t in (False, True) for fr in (False, True) for fc in (False, True)]
+PAWN_TRANSFORMS = [_transform(False, False, False), _transform(False, True, False)]  # Pawns fix the direction
+MIRROR_ROWS = _transform(True, False, False)  # Swaps the colors' sides of the board
+
+# Squares the white king is kept on, row 7 is rank 1
+TRIANGLE = [r * 8 + c for r in range(7, 3, -1) for c in range(4) if 7 - r <= c]  # a1-d1-d4
+HALF_BOARD = [r * 8 + c for r in range(8) for c in range(4)]  # Files a-d
+
+
+class Layout:
+    def __init__(self, piece):
+        self.piece = piece
+        self.transforms = PAWN_TRANSFORMS if piece == 'P' else PAWNLESS_TRANSFORMS
+        self.kingSquares = HALF_BOARD if piece == 'P' else TRIANGLE
+        self.kingSlot = [-1] * 64
+        for slot, sq in enumerate(self.kingSquares):
+            self.kingSlot[sq] = slot
+        self.size = 2 * len(self.kingSquares) * 64 * 64
+
+    """
+    # Table index of a position (white king, black king, white piece, white to move)
+    # Of the transforms that bring the white king onto the kept squares, the one giving the lowest index wins
+    """
+
+    def index(self, wk, bk, p, whiteToMove):
+        side = 0 if whiteToMove else len(self.kingSquares)
+        best = -1
+        for squares in self.transforms:
+            slot = self.kingSlot[squares[wk]]
+            if slot >= 0:
+                index = ((side + slot) * 64 + squares[bk]) * 64 + squares[p]
+                if best < 0 or index < best:
+                    best = index
+        return best
+
+    def squaresOf(self, index):
+        rest, p = divmod(index, 64)
+        rest, bk = divmod(rest, 64)
+        side, slot = divmod(rest, len(self.kingSquares))
+        return self.kingSquares[slot], bk, p, side == 0
+
+
+"""
+# Whether a white 'piece' on sq attacks target, the white king on 'blocker' can stand in the way
+"""
+
+
+def _attacks(piece, sq, target, blocker):
+    if piece == 'P':
+        return target in (sq - 9, sq - 7) and abs((target & 7) - (sq & 7)) == 1
+    if piece == 'N':
+        return (target >> 3, target & 7) in ChessEngine.knightTable[sq]
+    directions = {'Q': range(8), 'R': range(4, 8), 'B': range(4)}[piece]
+    rays = ChessEngine.rayTable[sq]
+    for i in directions:
+        for r, c in rays[i]:
+            square = r * 8 + c
+            if square == target:
+                return True
+            if square == blocker:
+                break
+    return False
+
+
+def _isLegal(piece, wk, bk, p, whiteToMove):
+    if wk == bk or wk == p or bk == p:
+        return False
+    if max(abs((wk >> 3) - (bk >> 3)), abs((wk & 7) - (bk & 7))) <= 1:  # Kings side by side
+        return False
+    if piece == 'P' and p >> 3 == 7:  # A white pawn can never stand on rank 1
+        return False
+    # The side that just moved cannot have left its king in check, only the black king can be attacked here
+    return not (whiteToMove and _attacks(piece, p, bk, wk))
+
+
+"""
+# Build the table of K + piece against K, returns (bytearray of values, stats dict)
+"""
+
+
+def generate(piece, backend=BACKEND):
+    piece = piece.upper()
+    if piece not in PIECES:
+        raise ValueError("Unknown piece '" + piece + "', expected one of " + PIECES)
+    layout = Layout(piece)
+    size = layout.size
+    values = bytearray([ILLEGAL]) * size
+    moveCounts = array('H', bytes(2 * size))  # Legal moves, a loss needs every one of them to reach a win
+    successorStart = array('I', bytes(4 * (size + 1)))
+    successors = array('I')
+    mates = []
+
+    gs = ChessEngine.newGameState(backend)
+    board = [["--"] * 8 for _ in range(8)]
+    pieceCode = "w" + ('p' if piece == 'P' else piece)
+    for index in range(size):
+        successorStart[index] = len(successors)
+        wk, bk, p, whiteToMove = layout.squaresOf(index)
+        if not _isLegal(piece, wk, bk, p, whiteToMove):
+            continue
+        for sq, code in ((wk, "wK"), (bk, "bK"), (p, pieceCode)):
+            board[sq >> 3][sq & 7] = code
+        gs.setBoard(board, whiteToMove)
+        for sq in (wk, bk, p):
+            board[sq >> 3][sq & 7] = "--"
+
+        codes = gs.getValidMoveCodes()
+        values[index] = DRAW
+        moveCounts[index] = len(codes)
+        if len(codes) == 0:
+            if gs.isInCheck:
+                values[index] = LOSS
+                mates.append(index)
+            continue
+        for code in codes:
+            if code & 0xF0000:  # The piece is taken, king against king is a draw, never a win to count
+                continue
+            start, end = (code >> 6) & 63, code & 63
+            successors.append(layout.index(end if start == wk else wk, end if start == bk else bk,
+                                           end if start == p else p, not whiteToMove))
+    successorStart[size] = len(successors)
+
+    # Predecessor lists, the successor lists turned around (counting sort into one flat array)
+    predecessorStart = array('I', bytes(4 * (size + 1)))
+    for successor in successors:
+        predecessorStart[successor + 1] += 1
+    for index in range(size):
+        predecessorStart[index + 1] += predecessorStart[index]
+    fill = array('I', predecessorStart)
+    predecessors = array('I', bytes(4 * len(successors)))
+    for index in range(size):
+        for i in range(successorStart[index], successorStart[index + 1]):
+            successor = successors[i]
+            predecessors[fill[successor]] = index
+            fill[successor] += 1
+
+    # Retrograde pass, one ply of distance at a time
+    resolved = bytearray(size)
+    for index in mates:
+        resolved[index] = 1
+    frontier = mates
+    plies = 0
+    while frontier:
+        nextFrontier = []
+        for index in frontier:
+            lost = values[index] >= LOSS
+            for i in range(predecessorStart[index], predecessorStart[index + 1]):
+                predecessor = predecessors[i]
+                if resolved[predecessor]:
+                    continue
+                if lost:  # One move to a lost position is enough
+                    values[predecessor] = plies + 1
+                    resolved[predecessor] = 1
+                    nextFrontier.append(predecessor)
+                else:
+                    moveCounts[predecessor] -= 1
+                    if moveCounts[predecessor] == 0:  # Every move lets the other side win
+                        values[predecessor] = LOSS + plies + 1
+                        resolved[predecessor] = 1
+                        nextFrontier.append(predecessor)
+        frontier = nextFrontier
+        plies += 1
+
+    legal = [value for value in values if value != ILLEGAL]
+    stats = {"positions": len(legal), "wins": sum(1 for value in legal if 0 < value < LOSS),
+             "losses": sum(1 for value in legal if value >= LOSS),
+             "longestMate": max([value for value in legal if 0 < value < LOSS] or [0])}
+    stats["draws"] = stats["positions"] - stats["wins"] - stats["losses"]
+    return values, stats
+
+
+def writeTable(path, piece, values):
+    layout = Layout(piece)
+    with open(path, "wb") as f:
+        f.write(MAGIC + piece.encode() + bytes([len(layout.kingSquares)]) + bytes(HEADER_BYTES - 6))
+        f.write(values)
+
+
+"""
+# One memory-mapped table file
+"""
+
+
+class Tablebase:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:4] != MAGIC:
+            self.close()
+            raise ValueError(path + " is not a tablebase file")
+        self.piece = chr(self.data[4])
+        self.layout = Layout(self.piece)
+        if len(self.data) != HEADER_BYTES + self.layout.size:
+            self.close()
+            raise ValueError(path + " has the wrong size")
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    """
+    # Raw value byte of a position with the piece on white's side
+    """
+
+    def probeSquares(self, wk, bk, p, whiteToMove):
+        return self.data[HEADER_BYTES + self.layout.index(wk, bk, p, whiteToMove)]
+
+
+"""
+# Turn a value byte into (outcome for the side to move: 1 win, 0 draw, -1 loss, plies to mate)
+"""
+
+
+def decodeValue(value):
+    if value == DRAW or value == ILLEGAL:
+        return 0, 0
+    if value < LOSS:
+        return 1, value
+    return -1, value - LOSS
+
+
+"""
+# Every table found in a directory, probed by material
+"""
+
+
+class TablebaseSet:
+    def __init__(self, directory):
+        self.tables = {}
+        for piece in PIECES:
+            path = os.path.join(directory, "K%sK.tb" % piece)
+            if os.path.exists(path):
+                self.tables[piece] = Tablebase(path)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+    """
+    # (outcome, plies to mate) for the side to move of gs, None when no table covers the position
+    """
+
+    def probe(self, gs):
+        if gs.pieceCount() != 3:
+            return None
+        kings = {}
+        extra = None
+        for r in range(8):
+            for c in range(8):
+                piece = gs.board[r][c]
+                if piece == "--":
+                    continue
+                if piece[1] == 'K':
+                    kings[piece[0]] = r * 8 + c
+                else:
+                    extra = (piece, r * 8 + c)
+        if extra is None or len(kings) != 2:
+            return None
+        piece, sq = extra
+        table = self.tables.get(piece[1].upper())
+        if table is None:
+            return None
+        if piece[0] == 'w':
+            value = table.probeSquares(kings['w'], kings['b'], sq, gs.whiteToMove)
+        else:  # Swap the colors: black's pieces become white ones on the mirrored squares
+            value = table.probeSquares(MIRROR_ROWS[kings['b']], MIRROR_ROWS[kings['w']], MIRROR_ROWS[sq],
+                                       not gs.whiteToMove)
+        return decodeValue(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe king + piece against king tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="Generate tables")
+    build.add_argument("material", nargs="+", help="Material sets: KQK KRK KBK KNK KPK")
+    build.add_argument("-o", "--output", default=".", help="Directory for the table files")
+    build.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default=BACKEND)
+    probe = commands.add_parser("probe", help="Look a position up")
+    probe.add_argument("directory", help="Directory with the table files")
+    probe.add_argument("--fen", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        os.makedirs(args.output, exist_ok=True)
+        for material in args.material:
+            material = material.upper()
+            if len(material) != 3 or material[0] != 'K' or material[2] != 'K' or material[1] not in PIECES:
+                parser.error("material must look like KQK, got " + material)
+            start = time.perf_counter()
+            values, stats = generate(material[1], args.backend)
+            seconds = time.perf_counter() - start
+            path = os.path.join(args.output, material + ".tb")
+            writeTable(path, material[1], values)
+            print("%s: %d positions, %d wins, %d draws, %d losses, longest mate %d plies, "
+                  "generated in %.1fs, %d bytes" % (material, stats["positions"], stats["wins"], stats["draws"],
+                                                    stats["losses"], stats["longestMate"], seconds,
+                                                    os.path.getsize(path)))
+        return 0
+
+    gs = ChessEngine.newGameState()
+    gs.setFen(args.fen)
+    tablebases = TablebaseSet(args.directory)
+    result = tablebases.probe(gs)
+    tablebases.close()
+    if result is None:
+        print("not in the tables")
+        return 1
+    outcome, plies = result
+    print({1: "win, mate in %d plies" % plies, 0: "draw", -1: "loss, mated in %d plies" % plies}[outcome])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
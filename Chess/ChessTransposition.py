@@ -0,0 +1,178 @@
+"""
+Transposition table: remembers search results by position hash (GameState.zobristKey).
+
+Fixed size, allocated once as two flat arrays of 64-bit integers (keys and packed entries),
+so memory stays the same no matter how long the process runs.
+Each bucket holds two entries: a depth-preferred slot that keeps the deepest result of the
+current search, and an always-replace slot for everything else.
+The key array holds key XOR entry rather than the key itself, so a probe only accepts an entry whose
+two words were written by the same store. That lets several processes share one table without locks
+(SharedTranspositionTable): a store torn by a concurrent writer simply reads back as a miss.
+
+Packed entry layout (bits):
+    0-15   best move  (low 16 bits of the packed move code: squares and moved piece, 0 = no move)
+    16-35  score      (offset by SCORE_OFFSET so it stays positive)
+    36-43  depth
+    44-45  bound      (0 = empty slot, EXACT, LOWER, UPPER)
+    46-51  age        (search generation, lets stale entries be replaced first)
+"""
+from array import array
+from multiprocessing import shared_memory
+
+EXACT, LOWER, UPPER = 1, 2, 3
+ENTRY_BYTES = 16  # 8 bytes of key + 8 bytes of packed data
+SCORE_OFFSET = 1 << 19
+AGE_MASK = 63
+
+MOVE_MASK = 0xFFFF  # Part of a packed move code kept in an entry, enough to identify it in a move list
+
+"""
+# Find the full move code matching a stored best move, None if it is not in the list
+"""
+
+
+def findMove(codes, stored):
+    if stored == 0:
+        return None
+    for code in codes:
+        if code & MOVE_MASK == stored:
+            return code
+    return None
+
+
+class TranspositionTable:
+    def __init__(self, sizeMB=16):
+        entries = max(2, int(sizeMB * 1024 * 1024) // ENTRY_BYTES)
+        buckets = 1
+        while buckets * 2 * 2 <= entries:  # Power of two buckets so the index is a mask
+            buckets *= 2
+        self.bucketMask = buckets - 1
+        self.keys = array('Q', bytes(8 * 2 * buckets))
+        self.data = array('Q', bytes(8 * 2 * buckets))
+        self.age = 0
+        self.resetStats()
+
+    def sizeBytes(self):
+        return len(self.keys) * self.keys.itemsize + len(self.data) * self.data.itemsize
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0  # Stores that evicted a different position
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    """
+    # Fraction of slots filled by the current search, sampled from the first 1000 slots
+    """
+
+    def usage(self):
+        sample = min(1000, len(self.data))
+        used = 0
+        for i in range(sample):
+            entry = self.data[i]
+            if (entry >> 44) & 3 and (entry >> 46) & AGE_MASK == self.age:
+                used += 1
+        return used / sample
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * len(self.keys)))
+        self.data = array('Q', bytes(8 * len(self.data)))
+        self.age = 0
+        self.resetStats()
+
+    """
+    # Start a new search, entries from earlier searches become the first to be replaced
+    """
+
+    def newSearch(self):
+        self.age = (self.age + 1) & AGE_MASK
+
+    """
+    # Look up a position
+    # Returns (depth, bound, score, move code) or None when the position is not stored
+    """
+
+    def probe(self, key):
+        self.probes += 1
+        slot = (key & self.bucketMask) << 1
+        for i in (slot, slot + 1):
+            entry = self.data[i]
+            if self.keys[i] ^ entry == key:
+                bound = (entry >> 44) & 3
+                if bound:
+                    self.hits += 1
+                    return (entry >> 36) & 0xFF, bound, ((entry >> 16) & 0xFFFFF) - SCORE_OFFSET, entry & 0xFFFF
+        return None
+
+    def store(self, key, depth, bound, score, moveCode):
+        moveCode &= MOVE_MASK
+        slot = (key & self.bucketMask) << 1
+        keys = self.keys
+        data = self.data
+        self.stores += 1
+
+        # Depth-preferred slot: same position, a stale entry, or at least as deep as what is there
+        stored = data[slot]
+        sameKey = keys[slot] ^ stored == key
+        if sameKey or not (stored >> 44) & 3 or (stored >> 46) & AGE_MASK != self.age \
+                or depth >= (stored >> 36) & 0xFF:
+            index = slot
+        else:
+            index = slot + 1  # Always-replace slot
+            stored = data[index]
+            sameKey = keys[index] ^ stored == key
+        if sameKey and moveCode == 0:
+            moveCode = stored & 0xFFFF  # Keep the old best move rather than losing it
+
+        if not sameKey and (stored >> 44) & 3:
+            self.overwrites += 1
+        entry = (moveCode | ((score + SCORE_OFFSET) << 16) | (min(depth, 255) << 36) |
+                 (bound << 44) | (self.age << 46))
+        keys[index] = key ^ entry
+        data[index] = entry
+
+
+"""
+# Same table in a multiprocessing.shared_memory block, for searches running in several processes
+# The creating process passes 'name' to the others, which attach with SharedTranspositionTable(name=name)
+# Counters (probes, hits...) and the age stay per process, every worker starts its searches together
+# close() detaches, the creator also calls unlink() once every worker is done
+"""
+
+
+class SharedTranspositionTable(TranspositionTable):
+    def __init__(self, sizeMB=16, name=None):
+        if name is None:
+            entries = max(2, int(sizeMB * 1024 * 1024) // ENTRY_BYTES)
+            buckets = 1
+            while buckets * 2 * 2 <= entries:
+                buckets *= 2
+            self.memory = shared_memory.SharedMemory(create=True, size=ENTRY_BYTES * 2 * buckets)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            # The block can come back rounded up to a whole page, keep the power of two the creator used
+            buckets = 1 << ((self.memory.size // (ENTRY_BYTES * 2)).bit_length() - 1)
+        self.name = self.memory.name
+        self.bucketMask = buckets - 1
+        half = 8 * 2 * buckets
+        self.keys = self.memory.buf[:half].cast('Q')
+        self.data = self.memory.buf[half:2 * half].cast('Q')
+        self.age = 0
+        self.resetStats()
+
+    def clear(self):
+        zeros = bytes(8 * len(self.keys))
+        self.memory.buf[:2 * len(zeros)] = zeros + zeros
+        self.age = 0
+        self.resetStats()
+
+    def close(self):
+        self.keys.release()
+        self.data.release()
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
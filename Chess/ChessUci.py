@@ -0,0 +1,311 @@
+"""
+UCI: the engine without the pygame front end, speaking the Universal Chess Interface over stdin/stdout.
+
+Commands are read by an asyncio loop, the search runs on a worker thread, so stop, isready and ponderhit
+are answered while a search is going. Every finished iteration sends an info line (depth, score, nodes,
+nps, time, pv) and the bestmove follows when the search ends, or on stop/ponderhit for go infinite and
+go ponder. End of input is treated like quit once the running search has finished, so a file of commands
+can be piped in for batch runs.
+
+Supported: uci, isready, setoption (Hash, Threads, Ponder, TablebasePath), ucinewgame,
+position startpos|fen ... [moves ...], go (wtime btime winc binc movestogo depth nodes movetime infinite
+ponder), stop, ponderhit, quit. Castling, en passant and promotion moves are not played by the engine yet,
+a position using them stops at that move with an info string.
+
+Usage (from the project root):
+    python -m Chess.ChessUci
+    python -m Chess.ChessUci --backend bitboard < commands.txt
+"""
+import argparse
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Chess import ChessEngine
+from Chess.ChessEval import evaluateIncremental
+from Chess.ChessParallel import ParallelSearcher
+from Chess.ChessPgn import STANDARD_FEN
+from Chess.ChessSearch import Searcher, formatScore, MAX_DEPTH
+from Chess.ChessTablebase import TablebaseSet
+from Chess.ChessTransposition import TranspositionTable
+
+ENGINE_NAME = "ChessBot"
+ENGINE_AUTHOR = "RestingWiki"
+MOVE_OVERHEAD = 0.05  # Seconds kept back from every move for the GUI and the pipes
+DEFAULT_MOVES_TO_GO = 30  # Moves the remaining time is spread over when the GUI does not say
+
+GO_NUMBERS = ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime", "mate")
+
+"""
+# Seconds to spend on the move from the go parameters (times in ms), None for no time limit
+"""
+
+
+def allotTime(params, whiteToMove):
+    if "movetime" in params:
+        return max(0.001, params["movetime"] / 1000 - MOVE_OVERHEAD)
+    remaining = params.get("wtime" if whiteToMove else "btime")
+    if remaining is None:
+        return None
+    increment = params.get("winc" if whiteToMove else "binc", 0)
+    movesToGo = params.get("movestogo") or DEFAULT_MOVES_TO_GO
+    budget = remaining / 1000 / movesToGo + increment / 1000 * 0.75
+    return max(0.001, min(budget, remaining / 1000 * 0.5) - MOVE_OVERHEAD)
+
+
+"""
+# Game state for "position startpos|fen <fen> [moves <uci moves>]"
+# Returns (game state, error message or None), moves after an illegal or unsupported one are dropped
+"""
+
+
+def parsePosition(tokens, backend="string"):
+    gs = ChessEngine.newGameState(backend)
+    moves = []
+    if "moves" in tokens:
+        moves = tokens[tokens.index("moves") + 1:]
+        tokens = tokens[:tokens.index("moves")]
+    if tokens and tokens[0] == "fen":
+        gs.setFen(" ".join(tokens[1:]))
+    elif tokens and tokens[0] == "startpos":
+        gs.setFen(STANDARD_FEN)  # A new GameState holds the front end's own setup, not the standard one
+    else:
+        raise ValueError("position needs startpos or fen")
+    for text in moves:
+        move = next((move for move in gs.getValidMoves() if move.getChessNotation() == text), None)
+        if move is None:
+            return gs, "move %s is illegal or not supported here, position stops before it" % text
+        gs.makeMove(move)
+    return gs, None
+
+
+class UciEngine:
+    def __init__(self, backend="string", output=sys.stdout):
+        self.backend = backend
+        self.output = output
+        self.outputLock = threading.Lock()  # Info lines come from the search thread
+        self.options = {"Hash": 16, "Threads": 1, "Ponder": False, "TablebasePath": ""}
+        self.gs = parsePosition(["startpos"], backend)[0]
+        self.searcher = None
+        self.tablebases = None
+        self.stopEvent = threading.Event()
+        self.searchThread = ThreadPoolExecutor(1)
+        self.searchTask = None
+        self.waitForStop = False  # go infinite/ponder: hold the bestmove until stop or ponderhit
+        self.released = None  # asyncio.Event set by stop/ponderhit
+        self.ponderTime = None  # Budget that starts on ponderhit
+        self.timer = None
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    """
+    # Searcher for the current options, built on first use and again after setoption
+    # Evaluates with the tapered piece-square tables of ChessEval, kept up to date move by move
+    """
+
+    def __getSearcher(self):
+        if self.searcher is None:
+            if self.options["TablebasePath"]:
+                self.tablebases = TablebaseSet(self.options["TablebasePath"])
+            if self.options["Threads"] > 1:
+                self.searcher = ParallelSearcher(self.options["Threads"], self.options["Hash"], evaluateIncremental,
+                                                 stopEvent=self.stopEvent, tablebases=self.tablebases)
+            else:
+                self.searcher = Searcher(evaluateIncremental, TranspositionTable(self.options["Hash"]),
+                                         stopEvent=self.stopEvent, tablebases=self.tablebases)
+        return self.searcher
+
+    def __closeSearcher(self):
+        if isinstance(self.searcher, ParallelSearcher):
+            self.searcher.close()
+        if self.tablebases is not None:
+            self.tablebases.close()
+        self.searcher = None
+        self.tablebases = None
+
+    def close(self):
+        self.__closeSearcher()
+        self.searchThread.shutdown()
+
+    def searching(self):
+        return self.searchTask is not None and not self.searchTask.done()
+
+    def __sendInfo(self, info):
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+            info["depth"], formatScore(info["score"]), info["nodes"], info["nps"], info["seconds"] * 1000,
+            " ".join(move.getChessNotation() for move in info["pv"])))
+
+    """
+    # Runs on the search thread
+    """
+
+    def __runSearch(self, searcher, gs, depth, timeLimit, nodeLimit):
+        return searcher.search(gs, depth, timeLimit, nodeLimit, self.__sendInfo)
+
+    async def __reportBestMove(self, future):
+        try:
+            result = await future
+        except Exception as error:  # Keep the loop alive, the GUI still needs a bestmove
+            self.send("info string search failed: %s" % error)
+            result = None
+        if self.waitForStop:
+            await self.released.wait()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if result is None or result.bestMove is None:
+            self.send("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.send("bestmove %s ponder %s" % (result.bestMove.getChessNotation(),
+                                                 result.pv[1].getChessNotation()))
+        else:
+            self.send("bestmove " + result.bestMove.getChessNotation())
+
+    def __go(self, tokens):
+        if self.searching():
+            self.send("info string already searching")
+            return
+        params = {}
+        for i, token in enumerate(tokens):
+            if token in GO_NUMBERS and i + 1 < len(tokens):
+                try:
+                    params[token] = int(tokens[i + 1])
+                except ValueError:
+                    self.send("info string bad value for %s: %s" % (token, tokens[i + 1]))
+        budget = allotTime(params, self.gs.whiteToMove)
+        infinite = "infinite" in tokens
+        ponder = "ponder" in tokens
+        self.waitForStop = infinite or ponder
+        self.ponderTime = budget if ponder and not infinite else None
+        self.released = asyncio.Event()
+        self.stopEvent.clear()
+        depth = params.get("depth", MAX_DEPTH)
+        if "mate" in params:  # Mate in n needs at most 2n - 1 plies
+            depth = min(depth, 2 * params["mate"] - 1)
+        timeLimit = None if self.waitForStop else budget
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.searchThread, self.__runSearch, self.__getSearcher(), self.gs, depth,
+                                      timeLimit, params.get("nodes"))
+        self.searchTask = asyncio.ensure_future(self.__reportBestMove(future))
+
+    def __stop(self):
+        self.stopEvent.set()
+        if self.released is not None:
+            self.released.set()
+
+    def __ponderHit(self):
+        if not self.searching() or self.released.is_set():
+            return
+        self.waitForStop = False
+        self.released.set()
+        if self.ponderTime is not None:  # The clock now runs for us, the search gets its budget from here
+            self.timer = asyncio.get_running_loop().call_later(self.ponderTime, self.stopEvent.set)
+
+    def __setOption(self, tokens):
+        if "name" not in tokens:
+            return
+        nameEnd = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:nameEnd])
+        value = " ".join(tokens[nameEnd + 1:])
+        option = next((option for option in self.options if option.lower() == name.lower()), None)
+        if option is None:
+            self.send("info string unknown option " + name)
+            return
+        if self.searching():
+            self.send("info string options cannot change during a search")
+            return
+        try:
+            if option in ("Hash", "Threads"):
+                self.options[option] = max(1, int(value))
+            elif option == "Ponder":
+                self.options[option] = value.lower() == "true"
+            else:
+                self.options[option] = "" if value == "<empty>" else value
+        except ValueError:
+            self.send("info string bad value for %s: %s" % (option, value))
+            return
+        self.__closeSearcher()
+
+    """
+    # Handle one command line, returns False on quit
+    """
+
+    async def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, tokens = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default 16 min 1 max 4096")
+            self.send("option name Threads type spin default 1 min 1 max 256")
+            self.send("option name Ponder type check default false")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.__setOption(tokens)
+        elif command == "ucinewgame":
+            if self.searcher is not None and not self.searching():
+                self.__closeSearcher()  # Fresh hash table, killers and history
+        elif command == "position":
+            try:
+                self.gs, error = parsePosition(tokens, self.backend)
+            except ValueError as error:
+                self.send("info string %s" % error)
+                return True
+            if error is not None:
+                self.send("info string " + error)
+        elif command == "go":
+            self.__go(tokens)
+        elif command == "stop":
+            self.__stop()
+        elif command == "ponderhit":
+            self.__ponderHit()
+        elif command == "quit":
+            self.__stop()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    """
+    # Read commands from 'stream' until quit or end of input
+    # Lines are read on a thread of their own so the loop is free while waiting for input
+    """
+
+    async def run(self, stream=sys.stdin):
+        loop = asyncio.get_running_loop()
+        reader = ThreadPoolExecutor(1)
+        try:
+            while True:
+                line = await loop.run_in_executor(reader, stream.readline)
+                if not line:  # End of input: let a bounded search finish, then leave
+                    if self.waitForStop:
+                        self.__stop()
+                    break
+                if not await self.handle(line.strip()):
+                    break
+            if self.searchTask is not None:
+                await self.searchTask
+        finally:
+            reader.shutdown(wait=False)
+            self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the engine as a UCI engine over stdin/stdout")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    args = parser.parse_args(argv)
+    asyncio.run(UciEngine(args.backend).run())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
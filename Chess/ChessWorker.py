@@ -0,0 +1,164 @@
+"""
+Engine worker: move generation and search off the UI thread.
+
+The front end hands a position to EngineWorker (requestMoves / requestSearch) and keeps drawing. The work runs
+on a copy of the position in a background thread, and the front end polls for the answer once per frame.
+Only the newest request counts: a new request or cancel() supersedes the old one. A superseded search stops
+at its next budget check through the Searcher's stopEvent, and its result is dropped.
+
+The work runs in a thread, not a process: the position and the answer pass without pickling, and the search
+gives the interpreter lock up at every switch interval, so a frame is never held up for long.
+
+Usage (from the project root), times a search while checking how often the calling thread gets to run:
+    python -m Chess.ChessWorker --time 3
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Chess import ChessEngine
+from Chess.ChessEval import evaluateIncremental
+from Chess.ChessSearch import Searcher, MAX_DEPTH
+from Chess.ChessTransposition import TranspositionTable
+
+"""
+# Stop flag of one request for the Searcher: set as soon as a newer request is made
+"""
+
+
+class _Superseded:
+    def __init__(self, worker, ticket):
+        self.worker = worker
+        self.ticket = ticket
+
+    def is_set(self):
+        return self.worker.ticket != self.ticket
+
+
+"""
+# Copy of the position of gs for the worker thread, the front end keeps playing on the original
+"""
+
+
+def _copyPosition(gs):
+    copy = type(gs)()
+    copy.setBoard([list(row) for row in gs.board], gs.whiteToMove)
+    return copy
+
+
+"""
+# moveCache: capacity of the worker's ChessEngine.MoveCache for requestMoves, 0 for none
+"""
+
+
+class EngineWorker:
+    def __init__(self, hashMB=16, moveCache=0):
+        self.executor = ThreadPoolExecutor(1)
+        self.tt = TranspositionTable(hashMB)  # Kept between searches, only ever used by the worker thread
+        self.moveCache = ChessEngine.MoveCache(moveCache) if moveCache else None  # Same, for requestMoves
+        self.ticket = 0
+        self.pending = None  # (kind, future) of the newest request
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.cancel()
+        self.executor.shutdown(wait=True)
+
+    def busy(self):
+        return self.pending is not None
+
+    """
+    # Drop the newest request, a search in progress stops at its next budget check
+    """
+
+    def cancel(self):
+        with self.lock:
+            self.ticket += 1
+            if self.pending is not None:
+                self.pending[1].cancel()
+                self.pending = None
+
+    def __submit(self, kind, function, *args):
+        self.cancel()
+        with self.lock:
+            self.pending = (kind, self.executor.submit(function, *args, self.ticket))
+
+    """
+    # Legal moves of gs, poll() answers ("moves", MoveList)
+    """
+
+    def requestMoves(self, gs):
+        self.__submit("moves", self.__moves, _copyPosition(gs))
+
+    """
+    # Best move for gs by ChessEval's incremental evaluation, poll() answers ("search", SearchResult),
+    # its bestMove is None when there is no legal move
+    """
+
+    def requestSearch(self, gs, timeLimit=None, maxDepth=MAX_DEPTH, nodeLimit=None):
+        self.__submit("search", self.__search, _copyPosition(gs), timeLimit, maxDepth, nodeLimit)
+
+    """
+    # (kind, answer) of the newest request once it is done, None while it runs or when nothing was asked
+    # An exception raised by the work is raised here
+    """
+
+    def poll(self):
+        with self.lock:
+            if self.pending is None or not self.pending[1].done():
+                return None
+            kind, future = self.pending
+            self.pending = None
+        return kind, future.result()
+
+    def __moves(self, gs, ticket):
+        gs.moveCache = self.moveCache
+        return ChessEngine.MoveList(gs.getValidMoveCodes())
+
+    def __search(self, gs, timeLimit, maxDepth, nodeLimit, ticket):
+        searcher = Searcher(evaluateIncremental, self.tt, _Superseded(self, ticket))
+        return searcher.search(gs, maxDepth, timeLimit, nodeLimit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search in the background and measure how often this thread runs")
+    parser.add_argument("-b", "--backend", choices=ChessEngine.BACKENDS, default="string")
+    parser.add_argument("-t", "--time", type=float, default=3.0, help="Search time in seconds")
+    parser.add_argument("--fps", type=int, default=30, help="Frame rate the polling loop aims for")
+    args = parser.parse_args(argv)
+
+    gs = ChessEngine.newGameState(args.backend)
+    frameTime = 1.0 / args.fps
+    gaps = []
+    with EngineWorker() as worker:
+        worker.requestSearch(gs, args.time)
+        start = last = time.perf_counter()
+        nextFrame = start
+        answer = None
+        while answer is None:  # Stands in for the pygame loop: poll, then wait for the next frame
+            answer = worker.poll()
+            nextFrame += frameTime  # Fixed schedule, so waiting for the interpreter lock does not add up
+            time.sleep(max(0.0, nextFrame - time.perf_counter()))
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+        elapsed = time.perf_counter() - start
+    kind, result = answer
+    gaps.sort()
+    print("bestmove %s (depth %d, %d nodes in %.2fs)" % (
+        result.bestMove.getChessNotation() if result.bestMove else "none", result.depth, result.nodes, elapsed))
+    print("%d frames, %.1f fps, frame time median %.1f ms, worst %.1f ms" % (
+        len(gaps), len(gaps) / elapsed, gaps[len(gaps) // 2] * 1000, gaps[-1] * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())